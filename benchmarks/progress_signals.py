@@ -0,0 +1,61 @@
+"""下载进度信号数量基准：对比逐块发信号与ProgressReporter节流后的每MB信号数
+
+用法: python benchmarks/progress_signals.py
+"""
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import ProgressReporter  # noqa: E402
+
+CHUNK_SIZE = 8192
+FILE_SIZE = 20 * 1024 * 1024
+
+
+class FakeClock:
+    """模拟时钟，按给定带宽推进时间，避免基准真的等待网络"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def legacy_signals(file_size):
+    """旧实现：每个8 KiB块都发一次download_progress"""
+    return (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+def throttled_signals(file_size, bandwidth):
+    clock = FakeClock()
+    count = 0
+
+    def callback(*args):
+        nonlocal count
+        count += 1
+
+    with mock.patch("main.time.monotonic", clock):
+        reporter = ProgressReporter(callback)
+        downloaded = 0
+        while downloaded < file_size:
+            chunk = min(CHUNK_SIZE, file_size - downloaded)
+            downloaded += chunk
+            clock.now += chunk / bandwidth
+            reporter.update(downloaded, file_size)
+    return count
+
+
+def main():
+    mb = FILE_SIZE / (1024 * 1024)
+    print(f"文件大小: {mb:.0f} MB, 块大小: {CHUNK_SIZE} 字节")
+    print(f"{'带宽':>12} {'旧实现 信号/MB':>16} {'节流后 信号/MB':>16}")
+    for bandwidth_mb in (0.5, 2, 10, 50, 200):
+        bandwidth = bandwidth_mb * 1024 * 1024
+        before = legacy_signals(FILE_SIZE) / mb
+        after = throttled_signals(FILE_SIZE, bandwidth) / mb
+        print(f"{bandwidth_mb:>9} MB/s {before:>16.1f} {after:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""音乐室广播扇出延迟基准：对比逐个 await ws.send() 与 BroadcastHub（每连接发送队列 + 写协程）
+
+模拟 1000 个客户端：绝大多数立即完成发送，少量慢客户端每次发送要等待一段时间，
+还有几个半死连接（TCP 未断开但不再读数据）。统计每条广播从发出到各客户端发送完成的延迟。
+
+用法: python benchmarks/room_broadcast.py [客户端数]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from music_room_server import BroadcastHub  # noqa: E402
+
+CLIENTS = 1000
+SLOW_RATIO = 0.01       # 慢客户端比例
+SLOW_DELAY = 0.02       # 慢客户端每次发送耗时（秒）
+DEAD_CLIENTS = 2        # 半死连接数
+DEAD_DELAY = 1.0        # 半死连接每次发送耗时（秒，模拟发送缓冲区写满）
+ROUNDS = 5
+INTERVAL = 0.05         # 两次广播之间的间隔（秒）
+
+
+class FakeWebSocket:
+    """模拟 websockets 连接：send 完成时记录当前广播的延迟"""
+    def __init__(self, delay, latencies):
+        self.delay = delay
+        self.latencies = latencies
+        self.closed = False
+
+    async def send(self, payload):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        sent_at = json.loads(payload)["sent_at"]
+        self.latencies.append(time.perf_counter() - sent_at)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = True
+
+
+def make_clients(count, latencies):
+    rng = random.Random(42)
+    delays = [SLOW_DELAY if rng.random() < SLOW_RATIO else 0 for _ in range(count)]
+    for i in rng.sample(range(count), DEAD_CLIENTS):
+        delays[i] = DEAD_DELAY
+    return [FakeWebSocket(delay, latencies) for delay in delays]
+
+
+def message():
+    return {"type": "chat", "user_id": "bench", "message": "x" * 64, "sent_at": time.perf_counter()}
+
+
+async def legacy_fanout(count):
+    """旧实现：每条广播序列化一次，然后逐个 await send"""
+    latencies = []
+    sockets = make_clients(count, latencies)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        payload = json.dumps(message())
+        for ws in sockets:
+            try:
+                await ws.send(payload)
+            except Exception:
+                pass
+        await asyncio.sleep(INTERVAL)
+    return latencies, time.perf_counter() - start, 0
+
+
+async def hub_fanout(count):
+    latencies = []
+    sockets = make_clients(count, latencies)
+    hub = BroadcastHub(max_queue=2)
+    for i, ws in enumerate(sockets):
+        hub.register(f"user{i}", ws)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        hub.broadcast(message())
+        await asyncio.sleep(INTERVAL)
+    # 等待仍在队列中的消息发完（半死连接会被踢出，不等待它们）
+    while any(not client.queue.empty() for client in hub.clients.values() if client.websocket.delay < DEAD_DELAY):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(SLOW_DELAY * 2)
+    elapsed = time.perf_counter() - start
+    evicted = sum(1 for ws in sockets if ws.closed)
+    for user_id in list(hub.clients):
+        hub.unregister(user_id, hub.clients[user_id].websocket)
+    return latencies, elapsed, evicted
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(name, latencies, elapsed, evicted):
+    ms = [value * 1000 for value in latencies]
+    print(
+        f"{name:<14} {len(ms):>8} {percentile(ms, 0.5):>10.2f} {percentile(ms, 0.99):>10.2f} "
+        f"{max(ms):>10.2f} {elapsed:>8.2f} {evicted:>6}"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else CLIENTS
+    print(f"客户端: {count}（慢客户端约 {SLOW_RATIO:.0%}，半死连接 {DEAD_CLIENTS} 个），广播 {ROUNDS} 次")
+    print(f"{'实现':<14} {'送达数':>8} {'p50(ms)':>10} {'p99(ms)':>10} {'max(ms)':>10} {'总耗时(s)':>8} {'踢出':>6}")
+    report("逐个await", *asyncio.run(legacy_fanout(count)))
+    report("BroadcastHub", *asyncio.run(hub_fanout(count)))
+
+
+if __name__ == "__main__":
+    main()
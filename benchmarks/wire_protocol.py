@@ -0,0 +1,168 @@
+"""音乐室线路编码基准：对比 JSON 文本帧与 msgpack 二进制帧（整数类型码、批量合并、deflate 压缩）
+
+统计两项：
+1. 每条事件的线上字节数：小事件（聊天、播放状态、目录增量）单独发送、多条合并成一帧，以及房间目录快照；
+2. 一次扇出的编码开销：把一条事件发给 N 个接收者时，逐个接收者 json.dumps（旧实现）、
+   只编码一次的 JSON、只编码一次的 msgpack（每个接收者仍要加帧头）。
+
+运行前先做一次往返校验：超过 COMPRESS_MIN_BYTES 的帧（会被 deflate）能否原样解码。
+未安装 msgpack 时只输出 JSON 的结果。
+
+用法: python benchmarks/wire_protocol.py [接收者数]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from music_room_server import MSGPACK_ENABLED, WireProtocol  # noqa: E402
+
+RECIPIENTS = 1000
+ROOMS = 500             # 房间目录快照中的房间数
+BATCH = 16              # 批量合并时每帧的事件数
+REPEAT = 50
+
+
+def small_events():
+    now = time.time() * 1000
+    return [
+        {"type": "chat", "user_id": "user-1024", "message": "这首歌真好听", "timestamp": int(now / 1000)},
+        {
+            "type": "playback_state", "room_id": "6f1c2f4e-8d7a-4c55-9a51-3b2f0e6c7d11",
+            "song_path": "D:/Music/周杰伦 - 晴天.mp3", "state": "playing", "position": 73120,
+            "server_time": now, "rate": 1.0, "version": 42, "user_id": "user-1024"
+        },
+        {"type": "member_count_changed", "version": 1337, "room_id": "6f1c2f4e-8d7a-4c55-9a51-3b2f0e6c7d11",
+         "member_count": 12},
+        {"type": "time_sync", "t0": now - 12.5, "t1": now, "t2": now + 0.02},
+    ]
+
+
+def mixed_batch():
+    """一帧内合并的事件：类型交替，数值各不相同"""
+    events = []
+    for i in range(BATCH):
+        event = dict(small_events()[i % 4])
+        if "version" in event:
+            event["version"] += i
+        if "position" in event:
+            event["position"] += i * 517
+        if "member_count" in event:
+            event["member_count"] = i + 3
+        if "message" in event:
+            event["message"] = f"第 {i} 条消息"
+        events.append(event)
+    return events
+
+
+def room_list():
+    return {
+        "type": "room_list",
+        "version": 1337,
+        "rooms": [
+            {
+                "id": f"{i:08x}-8d7a-4c55-9a51-3b2f0e6c7d11",
+                "name": f"一起听歌 {i}",
+                "owner": f"user-{i * 7 % 1000}",
+                "member_count": i % 20 + 1
+            }
+            for i in range(ROOMS)
+        ]
+    }
+
+
+def json_size(message):
+    return len(json.dumps(message).encode("utf-8"))
+
+
+def msgpack_size(messages):
+    return len(WireProtocol.frame([WireProtocol.pack(message) for message in messages]))
+
+
+def report_sizes():
+    events = small_events()
+    print(f"{'消息（字节/条）':<22} {'JSON':>10} {'msgpack':>10} {'节省':>7}")
+    for event in events:
+        plain = json_size(event)
+        if MSGPACK_ENABLED:
+            single = msgpack_size([event])
+            print(f"{event['type']:<22} {plain:>10} {single:>10} {1 - single / plain:>7.0%}")
+        else:
+            print(f"{event['type']:<22} {plain:>10} {'-':>10} {'-':>7}")
+
+    batch = mixed_batch()
+    plain = sum(json_size(event) for event in batch) / BATCH
+    if MSGPACK_ENABLED:
+        batched = msgpack_size(batch) / BATCH
+        print(f"{f'混合事件批量x{BATCH}':<22} {plain:>10.1f} {batched:>10.1f} {1 - batched / plain:>7.0%}")
+    else:
+        print(f"{f'混合事件批量x{BATCH}':<22} {plain:>10.1f} {'-':>10} {'-':>7}")
+
+    snapshot = room_list()
+    plain = json_size(snapshot)
+    if MSGPACK_ENABLED:
+        raw = len(WireProtocol.pack(snapshot)) + 1
+        framed = msgpack_size([snapshot])
+        print(f"{f'room_list({ROOMS}房间)':<22} {plain:>10} {raw:>10} {1 - raw / plain:>7.0%}")
+        print(f"{'  + deflate':<22} {'':>10} {framed:>10} {1 - framed / plain:>7.0%}")
+    else:
+        print(f"{f'room_list({ROOMS}房间)':<22} {plain:>10} {'-':>10} {'-':>7}")
+
+
+def check_round_trip():
+    """编码后再解码，确认压缩帧、批量帧在每种编码下都能还原"""
+    snapshot = room_list()
+    for encoding in WireProtocol.supported_encodings():
+        for messages in ([snapshot], [snapshot] + mixed_batch(), small_events()):
+            frame = WireProtocol.encode_frame(messages, encoding)
+            decoded = WireProtocol.decode_frame(frame)
+            assert decoded == messages, f"{encoding} 往返解码结果不一致"
+        frame = WireProtocol.encode_frame([snapshot], encoding)
+        assert len(frame) > 1 and frame[0] & WireProtocol.FLAG_DEFLATE, f"{encoding} 大帧没有压缩"
+    print(f"往返校验通过: {', '.join(WireProtocol.supported_encodings())}\n")
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def report_fanout(recipients):
+    event = small_events()[1]
+    targets = range(recipients)
+
+    def legacy():
+        return [json.dumps(event) for _ in targets]
+
+    def json_once():
+        payload = json.dumps(event)
+        return [payload for _ in targets]
+
+    def msgpack_once():
+        payload = WireProtocol.pack(event)
+        return [WireProtocol.frame([payload]) for _ in targets]
+
+    print(f"\n扇出 {recipients} 个接收者（{event['type']}），每次扇出的编码耗时")
+    print(f"{'实现':<22} {'耗时(ms)':>10} {'总字节':>10}")
+    rows = [("逐个 json.dumps", legacy), ("JSON 编码一次", json_once)]
+    if MSGPACK_ENABLED:
+        rows.append(("msgpack 编码一次", msgpack_once))
+    for name, fn in rows:
+        total = sum(len(p if isinstance(p, bytes) else p.encode("utf-8")) for p in fn())
+        print(f"{name:<22} {timed(fn):>10.3f} {total:>10}")
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else RECIPIENTS
+    if not MSGPACK_ENABLED:
+        print("未安装 msgpack（pip install msgpack），只测试 JSON")
+    check_round_trip()
+    report_sizes()
+    report_fanout(recipients)
+
+
+if __name__ == "__main__":
+    main()
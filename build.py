@@ -30,7 +30,6 @@ hidden_imports = [
     'aiohttp',
     'aiohttp.client',
     'aiohttp.client_exceptions',
-    'aiofiles',
     'httpx',
     'requests',
     'bs4',
@@ -1,26 +1,36 @@
 import asyncio
+import atexit
+import bisect
+import concurrent.futures
+import copy
 import datetime
 import hashlib
 import io
 import json
 import logging
+import multiprocessing
 import os
 import sqlite3
 import random
 import re
 import socket
 import ssl
+import struct
 import subprocess
 import sys
 import time
 import traceback
 import urllib.parse
 import webbrowser
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from pathlib import Path
-import aiofiles
 import aiohttp
 import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
 import numpy as np
 import websockets  
@@ -31,37 +41,50 @@ from PyQt5.QtWebSockets import QWebSocket
 from bilibili_api import Credential, video
 from bilibili_api.video import VideoDownloadURLDataDetecter
 from PIL import Image, ImageDraw, ImageFont
+from smart_rules import (
+    HISTORY_FIELDS, SMART_FIELD_ALIASES, compile_smart_conditions, compile_smart_rules, normalize_smart_rules
+)
 from PyQt5.QtCore import (
-    QByteArray, QObject, QPoint, QSettings, QSize, Qt, QThread, QTimer, QUrl, pyqtSignal, QEvent
+    QAbstractListModel, QByteArray, QFileSystemWatcher, QModelIndex, QObject, QPoint, QRectF, QSettings, QSize, Qt, QThread, QTimer, QUrl, pyqtSignal, QEvent
 )
 from PyQt5.QtGui import (
     QColor, QDesktopServices, QFont, QFontDatabase, QIcon, QImage, 
     QPalette, QPixmap, QCursor
 )
-from PyQt5.QtMultimedia import QMediaContent, QMediaMetaData, QMediaPlayer
+from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtWidgets import (
     QAbstractItemView, QAction, QApplication, QCheckBox, QColorDialog,
     QComboBox, QDialog, QDialogButtonBox, QFileDialog, QFontDialog, QFormLayout, QFrame,
     QGridLayout, QGroupBox, QHBoxLayout, QHeaderView, QInputDialog, QLabel, QLayout,
-    QLineEdit, QListWidget, QListWidgetItem, QMainWindow, QMenu, QMenuBar,
+    QLineEdit, QListView, QListWidget, QListWidgetItem, QMainWindow, QMenu, QMenuBar,
     QMessageBox, QPlainTextEdit, QProgressBar, QProgressDialog, QPushButton,
-    QScrollArea, QSlider, QSpinBox, QStatusBar, QTabWidget, QTableWidget,
+    QScrollArea, QSlider, QSpinBox, QStatusBar, QStyle, QStyleOptionSlider, QTabWidget, QTableWidget,
     QTableWidgetItem, QTextEdit, QTreeWidget, QVBoxLayout, QWidget, QTreeWidget
 )
 from PyQt5.QtMultimediaWidgets import QVideoWidget
 from PyQt5.QtMultimedia import QAudioProbe, QAudioFormat
-from PyQt5.QtGui import QPainter
+from PyQt5.QtGui import QPainter, QPen, QBrush, QLinearGradient, QFontMetricsF
 from PyQt5.QtWidgets import QToolBar
-from scipy.fftpack import fft 
 try:
     import librosa
     import librosa.feature
     import librosa.beat
-    from sklearn.metrics.pairwise import cosine_similarity
+    import librosa.onset
     AUDIO_FEATURES_ENABLED = True
 except ImportError:
     AUDIO_FEATURES_ENABLED = False
-    logging.warning("librosa or scikit-learn not installed, audio feature extraction disabled")
+    logging.warning("librosa not installed, audio feature extraction disabled")
+try:
+    import mutagen
+    MUTAGEN_ENABLED = True
+except ImportError:
+    MUTAGEN_ENABLED = False
+    logging.warning("mutagen not installed, library tags will fall back to file names")
+try:
+    import msgpack
+    MSGPACK_ENABLED = True
+except ImportError:
+    MSGPACK_ENABLED = False
 
 # =============== 自定义事件类 ===============
 class PlayEvent(QEvent):
@@ -101,6 +124,14 @@ class PlayFileEvent(QEvent):
         super().__init__(PlayFileEvent.event_type)
         self.file_path = file_path
 
+class SearchEvent(QEvent):
+    event_type = QEvent.Type(QEvent.registerEventType())
+    def __init__(self, keyword, refresh, reply):
+        super().__init__(SearchEvent.event_type)
+        self.keyword = keyword
+        self.refresh = refresh
+        self.reply = reply  # {"cached": 是否命中缓存, "done": threading.Event}
+
 # =============== 设置管理功能 ===============
 def get_settings_path():
     """获取设置文件路径"""
@@ -226,72 +257,185 @@ def load_default_settings():
             "max_results": 20,
             "auto_play": True,
             "playback_mode": "list",
-            "repeat_mode": "none"
+            "repeat_mode": "none",
+            "search_cache_ttl": 1800,
+            "batch_concurrency": 3,
+            "batch_bandwidth_limit_kbps": 0,
+            "audio_recommendations": False  # 开启后在后台为音乐库提取音频特征，供相似歌曲推荐使用
         },
         "background_image": "",
         "custom_tools": []
     }
 
+def _apply_settings_defaults(settings):
+    """补全旧版本设置文件中缺失的字段"""
+    if "bilibili" not in settings:
+        settings["bilibili"] = {
+            "cookie": "",
+            "max_duration": 600
+        }
+    if "save_paths" not in settings:
+        settings["save_paths"] = load_default_settings()["save_paths"]
+    elif "videos" not in settings["save_paths"]:
+        settings["save_paths"]["videos"] = os.path.join(os.path.expanduser("~"), "Videos")
+    if "custom_tools" not in settings:
+        settings["custom_tools"] = []   
+    if "sources" not in settings:
+        settings["sources"] = load_default_settings()["sources"]
+    elif "sources_list" not in settings["sources"]:
+        settings["sources"]["sources_list"] = load_default_settings()["sources"]["sources_list"]
+    return settings
+
+class SettingsStore:
+    """进程内设置缓存：只加载一次，读操作走内存，写操作延迟合并后原子写盘"""
+    def __init__(self, path, flush_delay=1.0, check_interval=1.0):
+        self.path = path
+        self.flush_delay = flush_delay          # 写盘防抖间隔（秒）
+        self.check_interval = check_interval    # 外部修改检测间隔（秒）
+        self._lock = threading.RLock()
+        self._settings = None
+        self._mtime = None
+        self._dirty = False
+        self._timer = None
+        self._last_check = 0.0
+        
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        
+    def _load_from_disk(self):
+        """从磁盘读取设置，文件不存在时创建默认设置"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        
+        if not os.path.exists(self.path):
+            logger.info("创建默认设置文件")
+            self._settings = load_default_settings()
+            self._dirty = True
+            self._write_to_disk()
+            return
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._settings = _apply_settings_defaults(json.load(f))
+            self._mtime = self._file_mtime()
+        except Exception as e:
+            logging.error(f"加载设置失败: {str(e)}，使用默认设置")
+            self._settings = load_default_settings()
+            # 不覆盖损坏的文件，等下一次显式保存
+            self._mtime = self._file_mtime()
+        
+    def _check_external_change(self):
+        """检测设置文件是否被外部修改（按间隔检查mtime）"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        
+        mtime = self._file_mtime()
+        if mtime == self._mtime:
+            return
+        if self._dirty:
+            # 本地有未写盘的修改，以内存为准，稍后写盘时覆盖
+            logger.warning("设置文件已被外部修改，但存在未保存的更改，将以当前更改为准")
+            return
+        logger.info("检测到设置文件被外部修改，重新加载")
+        self._load_from_disk()
+        
+    def get(self):
+        """返回内存中的设置对象（只读使用，不要直接修改）"""
+        with self._lock:
+            if self._settings is None:
+                self._load_from_disk()
+            else:
+                self._check_external_change()
+            return self._settings
+        
+    def snapshot(self):
+        """返回设置的独立副本，调用者可以自由修改"""
+        return copy.deepcopy(self.get())
+        
+    def update(self, settings):
+        """替换内存中的设置并安排延迟写盘"""
+        with self._lock:
+            self._settings = copy.deepcopy(settings)
+            self._dirty = True
+            self._schedule_flush()
+        return True
+        
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.flush_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+        
+    def _write_to_disk(self):
+        """写入临时文件后原子替换，避免写到一半的设置文件"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._settings, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._mtime = self._file_mtime()
+            self._dirty = False
+            logger.info(f"设置已保存到: {self.path}")
+            return True
+        except Exception as e:
+            logging.error(f"保存设置失败: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        
+    def flush(self):
+        """立即把未保存的修改写盘"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return True
+            return self._write_to_disk()
+
+_settings_store = None
+
+def get_settings_store():
+    """获取进程内共享的设置存储"""
+    global _settings_store
+    if _settings_store is None:
+        _settings_store = SettingsStore(get_settings_path())
+        atexit.register(_settings_store.flush)
+    return _settings_store
+
 def load_settings():
     """加载设置"""
-    settings_path = get_settings_path()
-    os.makedirs(os.path.dirname(settings_path), exist_ok=True)
-    
-    if not os.path.exists(settings_path):
-        logger.info("创建默认设置文件")
-        default_settings = load_default_settings()
-        save_settings(default_settings)
-        return default_settings
-    
-    try:
-        with open(settings_path, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-            
-            if "bilibili" not in settings:
-                settings["bilibili"] = {
-                    "cookie": "",
-                    "max_duration": 600
-                }
-            if "save_paths" not in settings:
-                settings["save_paths"] = load_default_settings()["save_paths"]
-            elif "videos" not in settings["save_paths"]:
-                settings["save_paths"]["videos"] = os.path.join(os.path.expanduser("~"), "Videos")
-            if "custom_tools" not in settings:
-                settings["custom_tools"] = []   
-            if "sources" not in settings:
-                settings["sources"] = load_default_settings()["sources"]
-            elif "sources_list" not in settings["sources"]:
-                settings["sources"]["sources_list"] = load_default_settings()["sources"]["sources_list"]
-    
-            return settings
-    except Exception as e:
-        logging.error(f"加载设置失败: {str(e)}，使用默认设置")
-        return load_default_settings()
+    return get_settings_store().snapshot()
 
 def save_settings(settings):
     """保存设置"""
-    settings_path = get_settings_path()
-    try:
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=4)
-        logger.info(f"设置已保存到: {settings_path}")
-        return True
-    except Exception as e:
-        logging.error(f"保存设置失败: {str(e)}")
-        return False
+    return get_settings_store().update(settings)
+
+def flush_settings():
+    """立即将待保存的设置写盘"""
+    return get_settings_store().flush()
 
 def get_active_source_config():
     """获取当前激活的音源配置"""
-    settings = load_settings()
+    settings = get_settings_store().get()
     active_source = settings["sources"]["active_source"]
     for source in settings["sources"]["sources_list"]:
         if source["name"] == active_source:
-            return source
-    return settings["sources"]["sources_list"][0]
+            return copy.deepcopy(source)
+    return copy.deepcopy(settings["sources"]["sources_list"][0])
 
 def get_source_names():
     """获取所有音源名称"""
-    settings = load_settings()
+    settings = get_settings_store().get()
     return [source["name"] for source in settings["sources"]["sources_list"]]
 
 def ensure_settings_file_exists():
@@ -300,6 +444,7 @@ def ensure_settings_file_exists():
     if not os.path.exists(settings_path):
         logger.warning("settings.json 文件不存在，创建默认设置")
         save_settings(load_default_settings())
+        flush_settings()
 
 # =============== 设置管理功能结束 ===============
 
@@ -326,11 +471,540 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger("MusicApp")
+APP_START_TIME = time.perf_counter()  # 启动计时起点（模块导入完成时）
+
+# =============== HTTP连接池 ===============
+try:
+    import h2  # httpx的HTTP/2支持依赖h2
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+class HttpClientManager:
+    """进程内共享的HTTP客户端：按主机复用长连接，统一超时、重试和并发限制"""
+    DEFAULT_TIMEOUT = (10, 30)  # (连接超时, 读取超时)
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    
+    def __init__(self, max_per_host=6, max_hosts=16, retries=2, backoff=0.5):
+        self.max_per_host = max_per_host
+        self.max_hosts = max_hosts
+        self.retries = retries
+        
+        # 同步请求：一个Session，每个主机一个连接池
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        
+        # 异步请求：共享事件循环 + 一个httpx.AsyncClient
+        self._loop = None
+        self._loop_thread = None
+        self._async_client = None
+        
+    def _host_slot(self, url):
+        """获取目标主机的并发信号量"""
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._host_slots[host] = slot
+            return slot
+        
+    def request(self, method, url, **kwargs):
+        """发送同步请求（复用连接池）。
+
+        stream=True 时响应体在返回之后才读取，主机并发名额保留到 response.close()，调用方必须关闭响应。
+        """
+        kwargs.setdefault("timeout", self.DEFAULT_TIMEOUT)
+        slot = self._host_slot(url)
+        slot.acquire()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except BaseException:
+            slot.release()
+            raise
+        if kwargs.get("stream"):
+            self._release_on_close(response, slot)
+        else:
+            slot.release()
+        return response
+
+    @staticmethod
+    def _release_on_close(response, slot):
+        """把主机名额的释放挂到 response.close() 上（with 语句退出时也会调用），只释放一次"""
+        close = response.close
+        held = [True]
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if held[0]:
+                    held[0] = False
+                    slot.release()
+        response.close = close_and_release
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+        
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+        
+    def _ensure_loop(self):
+        """启动共享的异步事件循环线程"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="HttpClientLoop", daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+        
+    def run_coroutine(self, coro):
+        """在共享事件循环中执行协程并等待结果（在工作线程中调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+        
+    def async_client(self) -> httpx.AsyncClient:
+        """获取共享的httpx.AsyncClient，只能在run_coroutine执行的协程中使用"""
+        if self._loop is None or asyncio.get_running_loop() is not self._loop:
+            raise RuntimeError("异步HTTP客户端只能在共享事件循环中使用")
+        if self._async_client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_per_host * self.max_hosts,
+                max_keepalive_connections=self.max_per_host * 2
+            )
+            transport = httpx.AsyncHTTPTransport(http2=HTTP2_ENABLED, limits=limits, retries=self.retries)
+            self._async_client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(self.DEFAULT_TIMEOUT[1], connect=self.DEFAULT_TIMEOUT[0])
+            )
+            logger.info(f"创建共享异步HTTP客户端 (HTTP/2: {'启用' if HTTP2_ENABLED else '未启用'})")
+        return self._async_client
+        
+    def close(self):
+        """关闭所有连接"""
+        try:
+            self.session.close()
+        except Exception:
+            pass
+        if self._loop is not None:
+            if self._async_client is not None:
+                try:
+                    self.run_coroutine(self._async_client.aclose())
+                except Exception:
+                    pass
+                self._async_client = None
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+_http_client = None
+
+def get_http_client():
+    """获取进程内共享的HTTP客户端"""
+    global _http_client
+    if _http_client is None:
+        _http_client = HttpClientManager()
+        atexit.register(_http_client.close)
+    return _http_client
+
+# =============== 搜索结果缓存 ===============
+def make_search_key(source_config, keyword, page=1, max_results=20):
+    """根据音源配置、关键词、页码和结果数量生成缓存键"""
+    source = {key: source_config.get(key) for key in ("name", "url", "method", "params", "search_params")}
+    raw = json.dumps([source, keyword.strip(), page, max_results], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def active_source_search_key(keyword):
+    """当前激活音源下搜索关键词的缓存键"""
+    config = get_active_source_config()
+    max_results = get_settings_store().get()["other"]["max_results"]
+    return make_search_key(config, keyword, config.get("params", {}).get("page", 1), max_results)
+
+class SearchCache:
+    """搜索结果缓存：内存LRU + SQLite持久化，条目超过TTL后失效"""
+    def __init__(self, db_path, ttl=1800, max_entries=200):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (创建时间, 结果列表)
+        self._conn = None
+        self._open()
+        
+    def _open(self):
+        """打开数据库并把未过期的条目载入内存"""
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    key TEXT PRIMARY KEY,
+                    created REAL NOT NULL,
+                    results TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute("DELETE FROM search_cache WHERE created < ?", (time.time() - self.ttl,))
+            rows = self._conn.execute("SELECT key, created, results FROM search_cache ORDER BY created").fetchall()
+            for key, created, results in rows[-self.max_entries:]:
+                self._entries[key] = (created, json.loads(results))
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"打开搜索缓存失败: {str(e)}")
+            self._conn = None
+        
+    def _execute(self, sql, params):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(sql, params)
+        except Exception as e:
+            logger.error(f"写入搜索缓存失败: {str(e)}")
+        
+    def get(self, key):
+        """读取缓存的结果，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, results = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                self._execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(results)
+        
+    def put(self, key, results):
+        """写入搜索结果，超出容量时淘汰最久未使用的条目"""
+        if not results:
+            return
+        with self._lock:
+            now = time.time()
+            self._entries[key] = (now, copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            self._execute(
+                "INSERT OR REPLACE INTO search_cache (key, created, results) VALUES (?, ?, ?)",
+                (key, now, json.dumps(results, ensure_ascii=False))
+            )
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._execute("DELETE FROM search_cache WHERE key = ?", (evicted_key,))
+            if self._conn is not None:
+                self._conn.commit()
+
+_search_cache = None
+
+def get_search_cache():
+    """获取进程内共享的搜索结果缓存"""
+    global _search_cache
+    if _search_cache is None:
+        ttl = get_settings_store().get()["other"].get("search_cache_ttl", 1800)
+        db_path = os.path.join(os.path.dirname(get_settings_path()), "search_cache.db")
+        _search_cache = SearchCache(db_path, ttl=ttl)
+    return _search_cache
+
+# =============== 断点续传下载 ===============
+class ProgressReporter:
+    """下载进度节流：百分比变化时才报告且频率不超过max_rate，同时计算速度和剩余时间。
+    callback(percent, downloaded, total, bytes_per_second, eta_seconds)"""
+    def __init__(self, callback, max_rate=20, smoothing=0.3):
+        self.callback = callback
+        self.min_interval = 1.0 / max_rate
+        self.smoothing = smoothing
+        self.speed = 0.0
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_emit = 0.0
+        self._last_percent = -1
+        self._last_sample = (self._start, 0)
+        
+    def update(self, downloaded, total):
+        """可在多个下载线程中调用"""
+        with self._lock:
+            now = time.monotonic()
+            finished = total > 0 and downloaded >= total
+            percent = min(100, int(100 * downloaded / total)) if total > 0 else 0
+            if not finished:
+                if now - self._last_emit < self.min_interval:
+                    return
+                if total > 0 and percent == self._last_percent:
+                    return
+            
+            # 指数平滑的下载速度
+            sample_time, sample_bytes = self._last_sample
+            if now > sample_time:
+                current = (downloaded - sample_bytes) / (now - sample_time)
+                self.speed = current if self.speed == 0 else (
+                    self.smoothing * current + (1 - self.smoothing) * self.speed
+                )
+            self._last_sample = (now, downloaded)
+            eta = (total - downloaded) / self.speed if total > 0 and self.speed > 0 else 0.0
+            
+            self._last_emit = now
+            self._last_percent = percent
+            speed = self.speed
+        self.callback(percent, downloaded, total, speed, eta)
+
+def format_transfer_rate(bytes_per_second, eta_seconds):
+    """格式化下载速度和剩余时间"""
+    if bytes_per_second >= 1024 * 1024:
+        speed = f"{bytes_per_second / (1024 * 1024):.2f} MB/s"
+    else:
+        speed = f"{bytes_per_second / 1024:.0f} KB/s"
+    eta = int(eta_seconds)
+    return f"{speed}，剩余 {eta // 60:02d}:{eta % 60:02d}"
+
+class ResumableDownloader:
+    """可续传的下载器：写入.part临时文件并用.part.json清单记录进度，
+    中断或崩溃后通过Range请求续传；服务器支持Range时大文件分段并行下载"""
+    CHUNK_SIZE = 64 * 1024
+    MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+    MANIFEST_INTERVAL = 1.0  # 清单写盘间隔（秒）
+    
+    def __init__(self, url, file_path, headers=None, max_segments=4, max_retries=2,
+                 progress_callback=None, should_stop=None, limiter=None):
+        self.url = url
+        self.file_path = file_path
+        self.part_path = file_path + ".part"
+        self.manifest_path = file_path + ".part.json"
+        self.headers = dict(headers or {})
+        self.max_segments = max_segments
+        self.max_retries = max_retries
+        self.progress_callback = progress_callback
+        self.should_stop = should_stop or (lambda: False)
+        self.limiter = limiter  # 可选的BandwidthLimiter，多个下载共享带宽上限
+        self.total = 0
+        self.segments = []  # [[起始, 结束(含), 已下载字节数], ...]
+        self._synced = []   # 各分段已 fsync 到磁盘的字节数，清单只记录这部分
+        self._lock = threading.Lock()
+        self._manifest_lock = threading.Lock()  # 多个分段线程共用一个临时文件，写清单需要串行
+        self._last_manifest = 0.0
+        self._stopped = False
+        
+    # ---------- 清单 ----------
+    def _load_manifest(self, total, validator):
+        """读取与当前资源匹配的清单，不匹配时返回None"""
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.part_path)):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("total") != total or manifest.get("validator") != validator:
+                return None
+            if os.path.getsize(self.part_path) != total:
+                return None
+            return manifest["segments"]
+        except Exception:
+            return None
+        
+    def _manifest_due(self):
+        return time.monotonic() - self._last_manifest >= self.MANIFEST_INTERVAL
+        
+    def _save_manifest(self, validator, force=False):
+        with self._manifest_lock:
+            now = time.monotonic()
+            if not force and now - self._last_manifest < self.MANIFEST_INTERVAL:
+                return
+            self._last_manifest = now
+            with self._lock:
+                segments = [[start, end, self._synced[i]] for i, (start, end, _) in enumerate(self.segments)]
+            data = {"url": self.url, "total": self.total, "validator": validator, "segments": segments}
+            tmp_path = self.manifest_path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.manifest_path)
+            except Exception as e:
+                logger.warning(f"保存下载清单失败: {str(e)}")
+        
+    def _sync(self, f, index, done):
+        """把分段已写入的数据刷到磁盘，之后清单才能记录这些字节"""
+        f.flush()
+        os.fsync(f.fileno())
+        with self._lock:
+            self._synced[index] = done
+        
+    def _cleanup(self):
+        for path in (self.part_path, self.manifest_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        
+    # ---------- 下载 ----------
+    def _throttle(self, size):
+        if self.limiter is None:
+            return True
+        return self.limiter.consume(size, self.should_stop)
+        
+    def _report(self):
+        if self.progress_callback:
+            with self._lock:
+                downloaded = sum(segment[2] for segment in self.segments)
+            self.progress_callback(downloaded, self.total)
+        
+    def _probe(self):
+        """用bytes=0-0的Range请求探测文件大小和是否支持分段"""
+        response = get_http_client().get(
+            self.url, headers={**self.headers, "Range": "bytes=0-0"}, stream=True
+        )
+        try:
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = int(content_range.rsplit("/", 1)[-1]) if "/" in content_range else 0
+                validator = response.headers.get("ETag") or response.headers.get("Last-Modified") or ""
+                return total, validator, total > 0
+            if response.status_code == 200:
+                total = int(response.headers.get("Content-Length", 0))
+                return total, "", False
+            raise IOError(f"HTTP状态码 {response.status_code}")
+        finally:
+            response.close()
+        
+    def _plan_segments(self, total):
+        count = max(1, min(self.max_segments, total // self.MIN_SEGMENT_SIZE))
+        size = total // count
+        segments = []
+        for i in range(count):
+            start = i * size
+            end = total - 1 if i == count - 1 else start + size - 1
+            segments.append([start, end, 0])
+        return segments
+        
+    def _download_segment(self, index, validator):
+        """下载一个分段，失败时从已下载位置重试"""
+        for attempt in range(self.max_retries + 1):
+            start, end, done = self.segments[index]
+            if start + done > end:
+                return True
+            try:
+                headers = {**self.headers, "Range": f"bytes={start + done}-{end}"}
+                response = get_http_client().get(self.url, headers=headers, stream=True)
+                try:
+                    if response.status_code != 206:
+                        raise IOError(f"分段请求返回HTTP状态码 {response.status_code}")
+                    with open(self.part_path, 'r+b') as f:
+                        f.seek(start + done)
+                        try:
+                            for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                                if self.should_stop() or not self._throttle(len(chunk)):
+                                    self._stopped = True
+                                    return False
+                                if not chunk:
+                                    continue
+                                chunk = chunk[:end + 1 - (start + done)]
+                                f.write(chunk)
+                                done += len(chunk)
+                                with self._lock:
+                                    self.segments[index][2] = done
+                                self._report()
+                                if self._manifest_due():
+                                    self._sync(f, index, done)
+                                    self._save_manifest(validator)
+                                if start + done > end:
+                                    break
+                        finally:
+                            self._sync(f, index, done)
+                finally:
+                    response.close()
+                if start + done > end:
+                    return True
+            except Exception as e:
+                if self._stopped:
+                    return False
+                logger.warning(f"分段下载失败 ({attempt + 1}/{self.max_retries + 1}): {str(e)}")
+        return False
+        
+    def _download_stream(self):
+        """服务器不支持Range时整体下载（无法续传）"""
+        response = get_http_client().get(self.url, headers=self.headers, stream=True)
+        try:
+            if response.status_code != 200:
+                logger.error(f"下载失败: HTTP状态码 {response.status_code}")
+                return False
+            self.total = int(response.headers.get("Content-Length", 0)) or self.total
+            self.segments = [[0, max(self.total - 1, 0), 0]]
+            with open(self.part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                    if self.should_stop() or not self._throttle(len(chunk)):
+                        self._stopped = True
+                        return False
+                    if chunk:
+                        f.write(chunk)
+                        with self._lock:
+                            self.segments[0][2] += len(chunk)
+                        self._report()
+            return True
+        finally:
+            response.close()
+        
+    def run(self):
+        """执行下载，成功返回True；取消或失败时保留.part文件以便续传"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+            total, validator, ranges = self._probe()
+            self.total = total
+            
+            if not ranges:
+                self._cleanup()
+                if not self._download_stream():
+                    return False
+            else:
+                segments = self._load_manifest(total, validator)
+                if segments is not None:
+                    self.segments = segments
+                    logger.info(f"续传下载: {self.file_path} ({sum(s[2] for s in segments)}/{total} 字节)")
+                else:
+                    self.segments = self._plan_segments(total)
+                    with open(self.part_path, 'wb') as f:
+                        f.truncate(total)
+                self._synced = [segment[2] for segment in self.segments]
+                self._save_manifest(validator, force=True)
+                self._report()
+                
+                pending = [i for i, (start, end, done) in enumerate(self.segments) if start + done <= end]
+                if len(pending) > 1:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                        results = list(executor.map(lambda i: self._download_segment(i, validator), pending))
+                else:
+                    results = [self._download_segment(i, validator) for i in pending]
+                self._save_manifest(validator, force=True)
+                if not all(results):
+                    if self._stopped:
+                        logger.info(f"下载已暂停，可稍后续传: {self.file_path}")
+                    return False
+            
+            # 校验大小后原子替换
+            size = os.path.getsize(self.part_path)
+            if self.total and size != self.total:
+                logger.error(f"下载文件大小不匹配: {size} != {self.total}")
+                self._cleanup()
+                return False
+            os.replace(self.part_path, self.file_path)
+            try:
+                os.remove(self.manifest_path)
+            except OSError:
+                pass
+            return True
+        except Exception as e:
+            logger.error(f"下载失败: {str(e)}")
+            return False
 
 # =============== Bilibili视频搜索插件整合 ===============
 class VideoAPI(QObject):
     """视频API类"""
     download_progress = pyqtSignal(int)
+    download_speed = pyqtSignal(float, float)  # 字节/秒, 剩余秒数
     
     def __init__(self, cookie: str, parent=None):
         super().__init__(parent)
@@ -346,22 +1020,22 @@ class VideoAPI(QObject):
     async def search_video(self, keyword: str, page: int = 1) -> list[dict] | None:
         """搜索视频"""
         params = {"search_type": "video", "keyword": keyword, "page": page}
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    self.BILIBILI_SEARCH_API, 
-                    params=params, 
-                    headers=self.BILIBILI_HEADER
-                )
-                response.raise_for_status()
-                data = response.json()
+        client = get_http_client().async_client()
+        try:
+            response = await client.get(
+                self.BILIBILI_SEARCH_API, 
+                params=params, 
+                headers=self.BILIBILI_HEADER
+            )
+            response.raise_for_status()
+            data = response.json()
 
-                if data["code"] == 0:
-                    video_list = data["data"].get("result", [])
-                    return video_list
-            except Exception as e:
-                logging.error(f"Bilibili搜索发生错误: {e}")
-                return []
+            if data["code"] == 0:
+                video_list = data["data"].get("result", [])
+                return video_list
+        except Exception as e:
+            logging.error(f"Bilibili搜索发生错误: {e}")
+            return []
 
     async def download_video(self, video_id: str, temp_dir: str) -> str | None:
         """下载视频"""
@@ -403,26 +1077,19 @@ class VideoAPI(QObject):
                         logging.warning(f"删除临时文件失败: {e}")
 
     async def _download_b_file(self, url: str, full_file_name: str):
-        """下载文件并显示进度"""
-        async with httpx.AsyncClient() as client:
-            async with client.stream("GET", url, headers=self.BILIBILI_HEADER) as resp:
-                current_len = 0
-                total_len = int(resp.headers.get("content-length", 0))
-                last_percent = -1
-
-                async with aiofiles.open(full_file_name, "wb") as f:
-                    async for chunk in resp.aiter_bytes():
-                        if self.thread() and self.thread().isInterruptionRequested():
-                            logging.info("下载被中断")
-                            return
-                        
-                        current_len += len(chunk)
-                        await f.write(chunk)
+        """下载文件并显示进度（分段并行，支持续传）"""
+        reporter = ProgressReporter(self.report_progress)
+        downloader = ResumableDownloader(
+            url, full_file_name, headers=self.BILIBILI_HEADER,
+            progress_callback=reporter.update,
+            should_stop=lambda: bool(self.thread() and self.thread().isInterruptionRequested())
+        )
+        if not await asyncio.get_running_loop().run_in_executor(None, downloader.run):
+            logging.info("下载被中断或失败")
 
-                        percent = int(current_len / total_len * 100)
-                        if percent != last_percent:
-                            last_percent = percent
-                            self.download_progress.emit(percent)
+    def report_progress(self, percent, downloaded, total, speed, eta):
+        self.download_progress.emit(percent)
+        self.download_speed.emit(speed, eta)
     
     async def _merge_file_to_mp4(self, v_full_file_name: str, a_full_file_name: str, output_file_name: str):
         """合并视频文件和音频文件"""
@@ -452,6 +1119,7 @@ class VideoSearchDialog(QDialog):
         
         self.video_api = VideoAPI(cookie, parent=self)
         self.video_api.download_progress.connect(self.update_progress)
+        self.video_api.download_speed.connect(self.update_speed)
         self.temp_dir = get_temp_dir("bilibili_video_cache")
         os.makedirs(self.temp_dir, exist_ok=True)
         self.selected_video = None
@@ -521,6 +1189,7 @@ class VideoSearchDialog(QDialog):
     def closeEvent(self, event):
         try:
             self.video_api.download_progress.disconnect(self.update_progress)
+            self.video_api.download_speed.disconnect(self.update_speed)
         except:
             pass
         self.terminate_all_threads()
@@ -623,6 +1292,9 @@ class VideoSearchDialog(QDialog):
         
     def update_progress(self, progress):
         self.progress_bar.setValue(progress)
+
+    def update_speed(self, speed, eta):
+        self.progress_bar.setFormat(f"%p%  {format_transfer_rate(speed, eta)}")
         
     def download_finished(self, file_path):
         self.progress_bar.setVisible(False)
@@ -646,22 +1318,15 @@ class VideoSearchThread(QThread):
         self.video_api = video_api
         
     def run(self):
-        loop = None
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             if self.isInterruptionRequested():
                 return
-            results = loop.run_until_complete(self.video_api.search_video(self.keyword))
+            results = get_http_client().run_coroutine(self.video_api.search_video(self.keyword))
             if self.isInterruptionRequested():
                 return
             self.results_ready.emit(results or [])
         except Exception as e:
             self.error_occurred.emit(str(e))
-        finally:
-            if loop and not loop.is_closed():
-                loop.call_soon_threadsafe(loop.stop)
-                loop.close()
     
     def stop(self):
         self.requestInterruption()
@@ -684,14 +1349,10 @@ class VideoDownloadThread(QThread):
         self.video_api = video_api
         
     def run(self):
-        loop = None
-
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             if self.isInterruptionRequested():
                 return
-            temp_file = loop.run_until_complete(
+            temp_file = get_http_client().run_coroutine(
                 self.video_api.download_video(self.video_id, self.temp_dir)
             )
             if self.isInterruptionRequested():
@@ -708,10 +1369,6 @@ class VideoDownloadThread(QThread):
                 os.replace(temp_file, self.file_path)
         except Exception as e:
             self.error_occurred.emit(str(e))
-        finally:
-            if loop and not loop.is_closed():
-                loop.call_soon_threadsafe(loop.stop)
-                loop.close()
     
     def stop(self):
         self.requestInterruption()
@@ -724,6 +1381,7 @@ class VideoDownloadThread(QThread):
 class AudioAPI(QObject):
     """B站音频API类"""
     download_progress = pyqtSignal(int)
+    download_speed = pyqtSignal(float, float)  # 字节/秒, 剩余秒数
     
     def __init__(self, cookie: str, parent=None):
         super().__init__(parent)
@@ -740,22 +1398,22 @@ class AudioAPI(QObject):
     async def search_video(self, keyword: str, page: int = 1) -> list[dict] | None:
         """搜索视频"""
         params = {"search_type": "video", "keyword": keyword, "page": page}
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    self.BILIBILI_SEARCH_API, 
-                    params=params, 
-                    headers=self.BILIBILI_HEADER
-                )
-                response.raise_for_status()
-                data = response.json()
+        client = get_http_client().async_client()
+        try:
+            response = await client.get(
+                self.BILIBILI_SEARCH_API, 
+                params=params, 
+                headers=self.BILIBILI_HEADER
+            )
+            response.raise_for_status()
+            data = response.json()
 
-                if data["code"] == 0:
-                    video_list = data["data"].get("result", [])
-                    return video_list
-            except Exception as e:
-                logging.error(f"Bilibili搜索发生错误: {e}")
-                return []
+            if data["code"] == 0:
+                video_list = data["data"].get("result", [])
+                return video_list
+        except Exception as e:
+            logging.error(f"Bilibili搜索发生错误: {e}")
+            return []
 
     async def get_audio_info(self, bvid: str) -> dict | None:
         """获取音频信息（包含真实音频URL）"""
@@ -763,33 +1421,33 @@ class AudioAPI(QObject):
             return self.audio_info_cache[bvid]
         try:
             video_info_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(video_info_url, headers=self.BILIBILI_HEADER)
-                data = response.json()
-                if data["code"] != 0:
-                    return None
-                cid = data["data"]["cid"]
-                title = data["data"]["title"]
-                author = data["data"]["owner"]["name"]
-                duration = data["data"]["duration"]
-                cover_url = data["data"]["pic"]
+            client = get_http_client().async_client()
+            response = await client.get(video_info_url, headers=self.BILIBILI_HEADER)
+            data = response.json()
+            if data["code"] != 0:
+                return None
+            cid = data["data"]["cid"]
+            title = data["data"]["title"]
+            author = data["data"]["owner"]["name"]
+            duration = data["data"]["duration"]
+            cover_url = data["data"]["pic"]
+            
+            audio_url = f"https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=0&fnval=16"
+            response = await client.get(audio_url, headers=self.BILIBILI_HEADER)
+            data = response.json()
+            if data["code"] != 0:
+                return None
                 
-                audio_url = f"https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=0&fnval=16"
-                response = await client.get(audio_url, headers=self.BILIBILI_HEADER)
-                data = response.json()
-                if data["code"] != 0:
-                    return None
-                    
-                audio_url = data["data"]["dash"]["audio"][0]["baseUrl"]
-                audio_info = {
-                    "title": title,
-                    "author": author,
-                    "duration": duration,
-                    "cover_url": cover_url,
-                    "audio_url": audio_url
-                }
-                self.audio_info_cache[bvid] = audio_info
-                return audio_info
+            audio_url = data["data"]["dash"]["audio"][0]["baseUrl"]
+            audio_info = {
+                "title": title,
+                "author": author,
+                "duration": duration,
+                "cover_url": cover_url,
+                "audio_url": audio_url
+            }
+            self.audio_info_cache[bvid] = audio_info
+            return audio_info
         except Exception as e:
             logging.error(f"获取音频信息失败: {e}")
             return None
@@ -802,28 +1460,20 @@ class AudioAPI(QObject):
                 return False
             audio_url = audio_info["audio_url"]
             
-            async with httpx.AsyncClient() as client:
-                async with client.stream("GET", audio_url, headers=self.BILIBILI_HEADER) as response:
-                    if response.status_code != 200:
-                        return False
-                    total_size = int(response.headers.get("Content-Length", 0))
-                    downloaded = 0
-                    
-                    async with aiofiles.open(file_path, "wb") as f:
-                        async for chunk in response.aiter_bytes(chunk_size=8192):
-                            if self.thread() and self.thread().isInterruptionRequested():
-                                logging.info("下载被中断")
-                                return False
-                            await f.write(chunk)
-                            downloaded += len(chunk)
-                            if total_size > 0:
-                                progress = int(100 * downloaded / total_size)
-                                self.download_progress.emit(progress)
-            return True
+            downloader = ResumableDownloader(
+                audio_url, file_path, headers=self.BILIBILI_HEADER,
+                progress_callback=ProgressReporter(self.report_progress).update,
+                should_stop=lambda: bool(self.thread() and self.thread().isInterruptionRequested())
+            )
+            return await asyncio.get_running_loop().run_in_executor(None, downloader.run)
         except Exception as e:
             logging.error(f"音频下载失败: {e}")
             return False
 
+    def report_progress(self, percent, downloaded, total, speed, eta):
+        self.download_progress.emit(percent)
+        self.download_speed.emit(speed, eta)
+
 
 class AudioSearchDialog(QDialog):
     """Bilibili音频搜索对话框"""
@@ -834,6 +1484,7 @@ class AudioSearchDialog(QDialog):
         
         self.audio_api = AudioAPI(cookie, parent=self)
         self.audio_api.download_progress.connect(self.update_progress)
+        self.audio_api.download_speed.connect(self.update_speed)
         self.temp_dir = get_temp_dir("bilibili_audio_cache")
         os.makedirs(self.temp_dir, exist_ok=True)
         self.selected_video = None
@@ -903,6 +1554,7 @@ class AudioSearchDialog(QDialog):
     def closeEvent(self, event):
         try:
             self.audio_api.download_progress.disconnect(self.update_progress)
+            self.audio_api.download_speed.disconnect(self.update_speed)
         except:
             pass
         self.terminate_all_threads()
@@ -1004,6 +1656,9 @@ class AudioSearchDialog(QDialog):
         
     def update_progress(self, progress):
         self.progress_bar.setValue(progress)
+
+    def update_speed(self, speed, eta):
+        self.progress_bar.setFormat(f"%p%  {format_transfer_rate(speed, eta)}")
         
     def download_finished(self, file_path):
         self.progress_bar.setVisible(False)
@@ -1027,22 +1682,15 @@ class AudioSearchThread(QThread):
         self.audio_api = audio_api
         
     def run(self):
-        loop = None
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             if self.isInterruptionRequested():
                 return
-            results = loop.run_until_complete(self.audio_api.search_video(self.keyword))
+            results = get_http_client().run_coroutine(self.audio_api.search_video(self.keyword))
             if self.isInterruptionRequested():
                 return
             self.results_ready.emit(results or [])
         except Exception as e:
             self.error_occurred.emit(str(e))
-        finally:
-            if loop and not loop.is_closed():
-                loop.call_soon_threadsafe(loop.stop)
-                loop.close()
     
     def stop(self):
         self.requestInterruption()
@@ -1064,13 +1712,10 @@ class AudioDownloadThread(QThread):
         self.audio_api = audio_api
         
     def run(self):
-        loop = None
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             if self.isInterruptionRequested():
                 return
-            success = loop.run_until_complete(
+            success = get_http_client().run_coroutine(
                 self.audio_api.download_audio(self.bvid, self.file_path)
             )
             if self.isInterruptionRequested():
@@ -1081,10 +1726,6 @@ class AudioDownloadThread(QThread):
                 self.error_occurred.emit("音频下载失败")
         except Exception as e:
             self.error_occurred.emit(str(e))
-        finally:
-            if loop and not loop.is_closed():
-                loop.call_soon_threadsafe(loop.stop)
-                loop.close()
     
     def stop(self):
         self.requestInterruption()
@@ -1093,62 +1734,795 @@ class AudioDownloadThread(QThread):
             self.terminate()
             self.wait()
 
+# =============== 音乐库目录 ===============
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg', '.aac', '.wma', '.ape')
+QUICK_HASH_BYTES = 64 * 1024
+
+
+def quick_file_hash(path, size):
+    """快速内容指纹：文件大小 + 首尾各64KB的SHA1（避免整文件读取）"""
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(QUICK_HASH_BYTES))
+        if size > QUICK_HASH_BYTES * 2:
+            f.seek(-QUICK_HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(QUICK_HASH_BYTES))
+    return digest.hexdigest()
+
+
+def read_track_tags(path, size, mtime_ns):
+    """读取单个文件的标签（在线程池中执行），返回目录表中的一行"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    title, artist, album, genre, year, duration = stem, "", "", "", None, 0
+    if MUTAGEN_ENABLED:
+        try:
+            audio = mutagen.File(path, easy=True)
+            if audio is not None:
+                if audio.info is not None:
+                    duration = int(getattr(audio.info, "length", 0) * 1000)
+                tags = audio.tags or {}
+                title = (tags.get("title") or [stem])[0]
+                artist = (tags.get("artist") or [""])[0]
+                album = (tags.get("album") or [""])[0]
+                genre = (tags.get("genre") or [""])[0]
+                year_match = re.match(r"\d{4}", (tags.get("date") or [""])[0])
+                year = int(year_match.group(0)) if year_match else None
+        except Exception as e:
+            logger.debug(f"读取标签失败 {path}: {str(e)}")
+    try:
+        file_hash = quick_file_hash(path, size)
+    except OSError:
+        file_hash = ""
+    return (
+        path, os.path.dirname(path), size, mtime_ns, duration,
+        title, artist, album, genre, year, file_hash, time.time()
+    )
+
+
+class LibraryCatalog:
+    """音乐库元数据目录：os.scandir 遍历 + 线程池读标签，SQLite 存储，按 mtime/size 增量更新"""
+    def __init__(self, db_path, max_workers=4):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self._lock = threading.RLock()
+        self._conn = None
+        self._open()
+
+    def _open(self):
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS tracks (
+                    path TEXT PRIMARY KEY,
+                    dir TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    title TEXT,
+                    artist TEXT,
+                    album TEXT,
+                    genre TEXT,
+                    year INTEGER,
+                    hash TEXT,
+                    scanned REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tracks_dir ON tracks(dir);
+                CREATE INDEX IF NOT EXISTS idx_tracks_artist ON tracks(artist);
+                CREATE INDEX IF NOT EXISTS idx_tracks_album ON tracks(album);
+                CREATE INDEX IF NOT EXISTS idx_tracks_title ON tracks(title);
+                CREATE INDEX IF NOT EXISTS idx_tracks_mtime ON tracks(mtime);
+                CREATE INDEX IF NOT EXISTS idx_tracks_hash ON tracks(hash);
+                CREATE TABLE IF NOT EXISTS play_history (
+                    path TEXT NOT NULL,
+                    played_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_path ON play_history(path, played_at);
+                CREATE TABLE IF NOT EXISTS folders (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders(parent);
+            ''')
+            self._migrate()
+            self._conn.executescript('''
+                CREATE INDEX IF NOT EXISTS idx_tracks_genre ON tracks(genre);
+                CREATE INDEX IF NOT EXISTS idx_tracks_year ON tracks(year);
+                CREATE INDEX IF NOT EXISTS idx_tracks_duration ON tracks(duration);
+            ''')
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"打开音乐库目录失败: {str(e)}")
+            self._conn = None
+
+    def _migrate(self):
+        """旧版目录缺少风格/年份列时补齐，并让下次扫描重新读取标签"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tracks)")}
+        if "genre" not in columns:
+            self._conn.execute("ALTER TABLE tracks ADD COLUMN genre TEXT")
+            self._conn.execute("ALTER TABLE tracks ADD COLUMN year INTEGER")
+            self._conn.execute("UPDATE tracks SET mtime = -1")
+
+    def walk(self, root):
+        """用 os.scandir 遍历目录树，返回 ({路径: (大小, mtime_ns)}, [子目录])"""
+        files = {}
+        folders = []
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                folders.append(entry.path)
+                                stack.append(entry.path)
+                            elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                                stat = entry.stat()
+                                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.warning(f"无法读取目录 {current}: {str(e)}")
+        return files, folders
+
+    def read_rows(self, pending, should_stop=None):
+        """并发读取 {路径: (大小, mtime_ns)} 中各文件的标签"""
+        rows = []
+        if not pending:
+            return rows
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="LibraryScan"
+        ) as executor:
+            futures = [executor.submit(read_track_tags, path, size, mtime) for path, (size, mtime) in pending.items()]
+            for future in concurrent.futures.as_completed(futures):
+                if should_stop and should_stop():
+                    for f in futures:
+                        f.cancel()
+                    break
+                rows.append(future.result())
+        return rows
+
+    def write_rows(self, rows):
+        self._conn.executemany('''
+            INSERT OR REPLACE INTO tracks
+                (path, dir, size, mtime, duration, title, artist, album, genre, year, hash, scanned)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+    def scan(self, root, should_stop=None):
+        """增量扫描：只重新读取新增或 mtime/size 变化的文件，返回 (新增, 更新, 删除)"""
+        if self._conn is None or not os.path.isdir(root):
+            return 0, 0, 0
+        started = time.monotonic()
+        root = os.path.normpath(root)
+        files, folders = self.walk(root)
+        
+        prefix = os.path.join(root, "")
+        with self._lock:
+            known = {
+                path: (size, mtime) for path, size, mtime in self._conn.execute(
+                    "SELECT path, size, mtime FROM tracks WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (root, len(prefix), prefix)
+                )
+            }
+        pending = {path: stat for path, stat in files.items() if known.get(path) != stat}
+        removed = [path for path in known if path not in files]
+        
+        rows = self.read_rows(pending, should_stop)
+        with self._lock:
+            with self._conn:
+                self.write_rows(rows)
+                self._conn.executemany("DELETE FROM tracks WHERE path = ?", ((path,) for path in removed))
+                self._conn.execute(
+                    "DELETE FROM folders WHERE path = ? OR substr(path, 1, ?) = ?", (root, len(prefix), prefix)
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO folders (path, parent) VALUES (?, ?)",
+                    [(root, os.path.dirname(root))] + [(folder, os.path.dirname(folder)) for folder in folders]
+                )
+        
+        added = sum(1 for path in pending if path not in known)
+        logger.info(
+            f"音乐库扫描完成: {len(files)} 首, 新增 {added}, 更新 {len(pending) - added}, "
+            f"删除 {len(removed)}, 耗时 {time.monotonic() - started:.2f}s"
+        )
+        return added, len(pending) - added, len(removed)
+
+    def folders_under(self, root):
+        """列出已编目的目录树（含根目录）"""
+        root = os.path.normpath(root)
+        prefix = os.path.join(root, "")
+        return [row[0] for row in self.query(
+            "SELECT path FROM folders WHERE path = ? OR substr(path, 1, ?) = ?", (root, len(prefix), prefix)
+        )]
+
+    def refresh_folder(self, path):
+        """只重新比对单个目录（不递归），返回 (新增, 更新, 删除, 新子目录) 路径列表"""
+        if self._conn is None:
+            return [], [], [], []
+        path = os.path.normpath(path)
+        prefix = os.path.join(path, "")
+        
+        if not os.path.isdir(path):
+            # 目录已被删除：移除其下全部条目
+            with self._lock:
+                removed = [row[0] for row in self._conn.execute(
+                    "SELECT path FROM tracks WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+                )]
+                with self._conn:
+                    self._conn.execute("DELETE FROM tracks WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+                    self._conn.execute(
+                        "DELETE FROM folders WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix)
+                    )
+            return [], [], removed, []
+        
+        files = {}
+        folders = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                        elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"无法读取目录 {path}: {str(e)}")
+            return [], [], [], []
+        
+        with self._lock:
+            known = {
+                row[0]: (row[1], row[2])
+                for row in self._conn.execute("SELECT path, size, mtime FROM tracks WHERE dir = ?", (path,))
+            }
+            known_folders = {
+                row[0] for row in self._conn.execute("SELECT path FROM folders WHERE parent = ?", (path,))
+            }
+        pending = {file_path: stat for file_path, stat in files.items() if known.get(file_path) != stat}
+        removed = [file_path for file_path in known if file_path not in files]
+        new_folders = [folder for folder in folders if folder not in known_folders]
+        
+        rows = self.read_rows(pending)
+        with self._lock:
+            with self._conn:
+                self.write_rows(rows)
+                self._conn.executemany("DELETE FROM tracks WHERE path = ?", ((p,) for p in removed))
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO folders (path, parent) VALUES (?, ?)", (path, os.path.dirname(path))
+                )
+        
+        added = [file_path for file_path in pending if file_path not in known]
+        updated = [file_path for file_path in pending if file_path in known]
+        return added, updated, removed, new_folders
+
+    def tracks_for_paths(self, paths):
+        """批量查询歌曲元数据，返回 {路径: 行字典}"""
+        result = {}
+        if self._conn is None:
+            return result
+        paths = list(paths)
+        with self._lock:
+            # SQLite 参数个数有限制，分批查询
+            for i in range(0, len(paths), 500):
+                batch = paths[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor = self._conn.execute(
+                    f"SELECT path, size, mtime, duration, title, artist, album, hash FROM tracks WHERE path IN ({placeholders})",
+                    batch
+                )
+                for row in cursor:
+                    result[row[0]] = self.row_to_dict(row)
+        return result
+
+    @staticmethod
+    def row_to_dict(row):
+        path, size, mtime, duration, title, artist, album, file_hash = row
+        return {
+            "path": path, "size": size, "mtime": mtime, "duration": duration,
+            "title": title, "artist": artist, "album": album, "hash": file_hash
+        }
+
+    def list_folder(self, path):
+        """列出已编目目录的子目录和歌曲，未编目返回 None"""
+        if self._conn is None:
+            return None
+        path = os.path.normpath(path)
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM folders WHERE path = ?", (path,)).fetchone() is None:
+                return None
+            folders = [row[0] for row in self._conn.execute(
+                "SELECT path FROM folders WHERE parent = ? AND path != ? ORDER BY path", (path, path)
+            )]
+            tracks = [self.row_to_dict(row) for row in self._conn.execute(
+                "SELECT path, size, mtime, duration, title, artist, album, hash FROM tracks WHERE dir = ? ORDER BY path",
+                (path,)
+            )]
+        return folders, tracks
+
+    def record_play(self, path):
+        """记录一次播放"""
+        if self._conn is None:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute("INSERT INTO play_history (path, played_at) VALUES (?, ?)", (path, time.time()))
+
+    def query(self, sql, params=()):
+        """执行只读查询（供智能播放列表等使用）"""
+        if self._conn is None:
+            return []
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_library_catalog = None
+_library_catalog_lock = threading.Lock()
+
+
+def get_library_catalog():
+    """获取进程内共享的音乐库目录"""
+    global _library_catalog
+    with _library_catalog_lock:
+        if _library_catalog is None:
+            db_path = os.path.join(os.path.dirname(get_settings_path()), "library.db")
+            _library_catalog = LibraryCatalog(db_path)
+        return _library_catalog
+
+
+class LibraryScanWorker(QThread):
+    """后台增量扫描音乐目录"""
+    scan_finished = pyqtSignal(int, int, int)
+
+    def __init__(self, root, parent=None):
+        super().__init__(parent)
+        self.root = root
+
+    def run(self):
+        try:
+            added, updated, removed = get_library_catalog().scan(self.root, self.isInterruptionRequested)
+            self.scan_finished.emit(added, updated, removed)
+        except Exception as e:
+            logger.error(f"音乐库扫描失败: {str(e)}")
+
+
+class LibraryWatcher(QObject):
+    """监视音乐/歌词目录，防抖后只刷新发生变化的目录，保持音乐库目录实时"""
+    library_changed = pyqtSignal(list, list, list)  # 新增, 更新, 删除
+    lyrics_changed = pyqtSignal(list)  # 发生变化的目录
+    _refresh_done = pyqtSignal(list, list, list, list)
+
+    def __init__(self, debounce_ms=800, poll_interval_ms=5000, verify_interval_ms=60000, parent=None):
+        super().__init__(parent)
+        self.roots = []
+        self.dirty = set()
+        self.snapshots = {}  # 轮询模式：目录 -> mtime_ns
+        self.polling = False
+        self.refreshing = False
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.mark_dirty)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.flush)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(poll_interval_ms)
+        self.poll_timer.timeout.connect(self.poll)
+        # 原地改写文件（重新写标签、同名替换）不改变目录 mtime，通知和目录轮询都发现不了，定时逐文件复核
+        self.verify_timer = QTimer(self)
+        self.verify_timer.setInterval(verify_interval_ms)
+        self.verify_timer.timeout.connect(self.verify)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="LibraryWatcher")
+        self._refresh_done.connect(self.handle_refresh_done)
+
+    def watch(self, root, folders=None):
+        """开始监视目录树，inotify 等不可用时退回 mtime 轮询"""
+        root = os.path.normpath(root)
+        if root in self.roots or not os.path.isdir(root):
+            return
+        self.roots.append(root)
+        self.add_folders(folders or [root])
+        self.verify_timer.start()
+        logger.info(f"开始监视目录: {root}（{'轮询' if self.polling else '文件系统通知'}）")
+
+    def watch_lyrics(self, folder):
+        """监视歌词目录（只通知歌词变化，不编入音乐库）"""
+        folder = os.path.normpath(folder)
+        if os.path.isdir(folder):
+            self.add_folders([folder])
+
+    def is_library_folder(self, folder):
+        return any(folder == root or folder.startswith(os.path.join(root, "")) for root in self.roots)
+
+    def add_folders(self, folders):
+        folders = [folder for folder in folders if folder not in self.snapshots]
+        if not folders:
+            return
+        if not self.polling:
+            failed = self.watcher.addPaths(folders)
+            if failed:
+                logger.warning(f"{len(failed)} 个目录无法使用文件系统通知，改用轮询")
+                self.polling = True
+                self.poll_timer.start()
+        for folder in folders:
+            try:
+                self.snapshots[folder] = os.stat(folder).st_mtime_ns
+            except OSError:
+                pass
+
+    def remove_folders(self, folders):
+        for folder in folders:
+            self.snapshots.pop(folder, None)
+        if not self.polling:
+            self.watcher.removePaths([folder for folder in folders if folder in self.watcher.directories()])
+
+    def notify_path(self, path):
+        """外部提示文件已变化（如下载完成），无需等待通知"""
+        self.mark_dirty(os.path.dirname(os.path.normpath(path)))
+
+    def mark_dirty(self, folder):
+        self.dirty.add(os.path.normpath(folder))
+        self.debounce_timer.start()
+
+    def poll(self):
+        """轮询模式：只比较目录 mtime 快照"""
+        for folder, mtime in list(self.snapshots.items()):
+            try:
+                current = os.stat(folder).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                self.snapshots[folder] = current
+                self.mark_dirty(folder)
+
+    def verify(self):
+        """定时复核：在后台比对音乐库目录中每个文件的大小和 mtime_ns 与目录记录"""
+        if self.refreshing:
+            return
+        folders = [folder for folder in self.snapshots if self.is_library_folder(folder)]
+        if not folders:
+            return
+        self.refreshing = True
+        self._executor.submit(self.verify_folders, folders)
+
+    def verify_folders(self, folders):
+        """工作线程：逐目录比对文件，只报告音乐库变化（新子目录留给目录通知处理）"""
+        catalog = get_library_catalog()
+        added, updated, removed = [], [], []
+        try:
+            for folder in folders:
+                folder_added, folder_updated, folder_removed, _ = catalog.refresh_folder(folder)
+                added.extend(folder_added)
+                updated.extend(folder_updated)
+                removed.extend(folder_removed)
+        except Exception as e:
+            logger.error(f"复核音乐库目录失败: {str(e)}")
+        self._refresh_done.emit(added, updated, removed, [])
+
+    def flush(self):
+        """防抖结束：在后台刷新变化的目录"""
+        if self.refreshing:
+            self.debounce_timer.start()
+            return
+        folders = sorted(self.dirty)
+        self.dirty.clear()
+        if not folders:
+            return
+        self.refreshing = True
+        self._executor.submit(self.refresh_folders, folders)
+
+    def refresh_folders(self, folders):
+        """工作线程：逐目录增量刷新，新出现的子目录整体扫描"""
+        catalog = get_library_catalog()
+        added, updated, removed, lyrics_dirs, new_folders = [], [], [], [], []
+        try:
+            for folder in folders:
+                if not self.is_library_folder(folder):
+                    # 仅歌词目录，不编入音乐库
+                    lyrics_dirs.append(folder)
+                    continue
+                folder_added, folder_updated, folder_removed, subfolders = catalog.refresh_folder(folder)
+                added.extend(folder_added)
+                updated.extend(folder_updated)
+                removed.extend(folder_removed)
+                for subfolder in subfolders:
+                    before = set(catalog.folders_under(subfolder))
+                    catalog.scan(subfolder)
+                    new_folders.extend(set(catalog.folders_under(subfolder)) - before)
+                    prefix = os.path.join(subfolder, "")
+                    added.extend(row[0] for row in catalog.query(
+                        "SELECT path FROM tracks WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+                    ))
+                lyrics_dirs.append(folder)
+        except Exception as e:
+            logger.error(f"刷新音乐库目录失败: {str(e)}")
+        self._refresh_done.emit(added, updated, removed, new_folders + lyrics_dirs)
+
+    def handle_refresh_done(self, added, updated, removed, folders):
+        self.refreshing = False
+        existing = [folder for folder in folders if os.path.isdir(folder)]
+        self.add_folders(existing)
+        self.remove_folders([folder for folder in folders if not os.path.isdir(folder)])
+        if added or updated or removed:
+            logger.info(f"音乐库变化: 新增 {len(added)}, 更新 {len(updated)}, 删除 {len(removed)}")
+            self.library_changed.emit(added, updated, removed)
+        self.lyrics_changed.emit(existing)
+        if self.dirty:
+            self.debounce_timer.start()
+
+    def shutdown(self):
+        self.debounce_timer.stop()
+        self.poll_timer.stop()
+        self.verify_timer.stop()
+        self._executor.shutdown(wait=False)
+
+
 # =============== 播放列表管理 ===============
+class PlaylistStore(QObject):
+    """播放列表存储：快照文件 + 追加写的操作日志。
+
+    每次编辑只向日志追加一行，防抖后（或退出时）把内存状态压缩成新快照，
+    通过临时文件和 os.replace 原子替换。日志首行记录它所基于的快照（大小和 mtime_ns），
+    与当前快照不符的日志说明压缩已完成但日志未清空，启动时直接丢弃。
+    """
+    MAX_LOG_OPS = 2000
+
+    def __init__(self, path, compact_delay_ms=3000, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.log_path = path + ".log"
+        self.playlists = {}
+        self._lock = threading.RLock()
+        self._log = None
+        self._log_ops = 0
+        self.compact_timer = QTimer(self)
+        self.compact_timer.setSingleShot(True)
+        self.compact_timer.setInterval(compact_delay_ms)
+        self.compact_timer.timeout.connect(self.compact)
+        self.load()
+
+    @staticmethod
+    def item_key(item):
+        """歌曲条目的唯一键：字典条目取路径，其余直接使用"""
+        return item.get("path", "") if isinstance(item, dict) else item
+
+    def snapshot_id(self):
+        try:
+            stat = os.stat(self.path)
+            return [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            return None
+
+    def load(self):
+        """读取快照并重放日志"""
+        with self._lock:
+            self.playlists = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.playlists = json.load(f)
+                except Exception as e:
+                    logger.error(f"加载播放列表失败: {str(e)}")
+                    self.playlists = {}
+            replayed = self.replay_log()
+            if replayed:
+                # 上次没有正常退出：立即把重放结果写成快照，顺带丢掉日志里可能残缺的末行
+                logger.info(f"重放播放列表日志: {replayed} 条操作")
+                self.compact()
+            else:
+                self.open_log(reset=True)
+            return self.playlists
+
+    def replay_log(self):
+        if not os.path.exists(self.log_path):
+            return 0
+        count = 0
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                header = f.readline()
+                try:
+                    base = json.loads(header).get("snapshot")
+                except (ValueError, AttributeError):
+                    return 0
+                if base != self.snapshot_id():
+                    logger.info("播放列表日志已合并到快照，丢弃")
+                    return 0
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行
+                        logger.warning("播放列表日志末尾不完整，已忽略")
+                        break
+                    self.apply(op)
+                    count += 1
+        except Exception as e:
+            logger.error(f"重放播放列表日志失败: {str(e)}")
+        self._log_ops = count
+        return count
+
+    def open_log(self, reset=False):
+        """打开日志用于追加；reset 时以当前快照为基准重写日志头"""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        try:
+            if reset or not os.path.exists(self.log_path):
+                self._log = open(self.log_path, 'w', encoding='utf-8')
+                self._log.write(json.dumps({"snapshot": self.snapshot_id()}) + "\n")
+                self._log.flush()
+                self._log_ops = 0
+            else:
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+        except Exception as e:
+            logger.error(f"打开播放列表日志失败: {str(e)}")
+
+    def apply(self, op):
+        """把一条操作应用到内存状态（重放时同样使用）"""
+        kind = op.get("op")
+        name = op.get("list")
+        if kind == "create":
+            self.playlists.setdefault(name, [])
+        elif kind == "add":
+            songs = self.playlists.setdefault(name, [])
+            keys = {self.item_key(song) for song in songs}
+            for item in op.get("items", []):
+                key = self.item_key(item)
+                if key and key not in keys:
+                    keys.add(key)
+                    songs.append(item)
+        elif kind == "remove":
+            keys = set(op.get("keys", []))
+            if name in self.playlists:
+                self.playlists[name][:] = [song for song in self.playlists[name] if self.item_key(song) not in keys]
+        elif kind == "clear":
+            self.playlists.setdefault(name, [])[:] = []
+        elif kind == "replace":
+            self.playlists.setdefault(name, [])[:] = op.get("items", [])
+        elif kind == "rename":
+            if name in self.playlists:
+                self.playlists[op["to"]] = self.playlists.pop(name)
+        elif kind == "delete":
+            self.playlists.pop(name, None)
+
+    def record(self, op):
+        """应用一条操作并追加到日志，I/O 与播放列表长度无关"""
+        with self._lock:
+            self.apply(op)
+            if self._log is None:
+                self.open_log()
+            try:
+                self._log.write(json.dumps(op, ensure_ascii=False) + "\n")
+                self._log.flush()
+                self._log_ops += 1
+            except Exception as e:
+                logger.error(f"写入播放列表日志失败: {str(e)}")
+                self._log_ops = self.MAX_LOG_OPS
+        if self._log_ops >= self.MAX_LOG_OPS:
+            self.compact()
+        else:
+            self.compact_timer.start()
+
+    def create(self, name):
+        self.record({"op": "create", "list": name})
+
+    def add(self, name, items):
+        self.record({"op": "add", "list": name, "items": list(items)})
+
+    def remove(self, name, keys):
+        self.record({"op": "remove", "list": name, "keys": list(keys)})
+
+    def clear(self, name):
+        self.record({"op": "clear", "list": name})
+
+    def replace(self, name, items):
+        self.record({"op": "replace", "list": name, "items": list(items)})
+
+    def rename(self, name, new_name):
+        self.record({"op": "rename", "list": name, "to": new_name})
+
+    def get(self, name):
+        return self.playlists.get(name, [])
+
+    def compact(self):
+        """把内存状态写成新快照（原子替换），然后重置日志"""
+        self.compact_timer.stop()
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.playlists, f, ensure_ascii=False, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.error(f"保存播放列表失败: {str(e)}")
+                return False
+            self.open_log(reset=True)
+        logger.info(f"播放列表已保存到: {self.path}")
+        return True
+
+    def close(self):
+        if self._log_ops or self.compact_timer.isActive():
+            self.compact()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+_playlist_stores = {}
+_playlist_stores_lock = threading.Lock()
+
+def get_playlist_store(path="playlists.json"):
+    """获取指定播放列表文件的共享存储（同一文件只有一个实例写日志）"""
+    key = os.path.abspath(path)
+    with _playlist_stores_lock:
+        store = _playlist_stores.get(key)
+        if store is None:
+            store = PlaylistStore(path)
+            _playlist_stores[key] = store
+        return store
+
+def close_playlist_stores():
+    """退出时压缩所有播放列表日志"""
+    with _playlist_stores_lock:
+        stores = list(_playlist_stores.values())
+    for store in stores:
+        store.close()
+
+
 class PlaylistManager:
     def __init__(self):
-        self.playlists = {}
         self.current_playlist = None
         self.playlist_file = "playlists.json"
+        self.store = get_playlist_store(self.playlist_file)
         self.load_playlists()
-        
+
     def load_playlists(self):
-        if os.path.exists(self.playlist_file):
-            try:
-                with open(self.playlist_file, 'r', encoding='utf-8') as f:
-                    self.playlists = json.load(f)
-                    logger.info(f"加载播放列表: {self.playlist_file}")
-            except Exception as e:
-                logger.error(f"加载播放列表失败: {str(e)}")
-                self.playlists = {}
-        else:
-            self.playlists = {"default": []}
-            self.save_playlists()
+        if not os.path.exists(self.playlist_file) and not self.store.playlists:
+            self.store.create("default")
+            self.store.compact()
             logger.info(f"创建新的播放列表文件: {self.playlist_file}")
-    
+        else:
+            logger.info(f"加载播放列表: {self.playlist_file}")
+        # 与存储共享同一个字典，保存时无需复制
+        self.playlists = self.store.playlists
+
     def save_playlists(self):
-        try:
-            with open(self.playlist_file, 'w', encoding='utf-8') as f:
-                json.dump(self.playlists, f, ensure_ascii=False, indent=4)
-            logger.info(f"播放列表已保存到: {self.playlist_file}")
-            return True
-        except Exception as e:
-            logger.error(f"保存播放列表失败: {str(e)}")
-            return False
-        
+        """立即写入快照（用于直接修改了 playlists 的调用方）"""
+        return self.store.compact()
+
     def create_playlist(self, name):
         if name not in self.playlists:
-            self.playlists[name] = []
-            self.save_playlists()
+            self.store.create(name)
             return True
         return False
-        
+
     def add_to_playlist(self, playlist_name, song_path):
         """添加歌曲到播放列表"""
         if playlist_name in self.playlists:
             # 确保只保存路径字符串
             if isinstance(song_path, dict):
                 song_path = song_path.get("path", "")
-            
+
             if song_path and song_path not in self.playlists[playlist_name]:
-                self.playlists[playlist_name].append(song_path)
-                self.save_playlists()
+                self.store.add(playlist_name, [song_path])
                 return True
         return False
-        
+
     def remove_from_playlist(self, playlist_name, song_path):
         if playlist_name in self.playlists and song_path in self.playlists[playlist_name]:
-            self.playlists[playlist_name].remove(song_path)
-            self.save_playlists()
+            self.store.remove(playlist_name, [song_path])
             return True
         return False
         
@@ -1271,158 +2645,228 @@ class PlaylistDialog(QDialog):
                 if self.playlist_manager.remove_from_playlist(playlist_name, song_path):
                     self.update_song_list(playlist_name)
 
+# =============== 歌词编译 ===============
+LRC_TIME_TAG = re.compile(r'\[(\d+):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+LRC_WORD_TAG = re.compile(r'<(\d+):(\d{1,2})(?:[.:](\d{1,3}))?>')
+LRC_OFFSET_TAG = re.compile(r'^\s*\[offset:\s*([+-]?\d+)\s*\]', re.IGNORECASE)
+LRC_LAST_LINE_DURATION = 10000  # 最后一行默认持续10秒
+LRC_CACHE_SIZE = 32
+
+
+def lrc_tag_to_ms(minutes, seconds, fraction):
+    """将时间标签各部分换算为毫秒（兼容 .x/.xx/.xxx 与 :xx 写法）"""
+    ms = int(fraction.ljust(3, "0")) if fraction else 0
+    return (int(minutes) * 60 + int(seconds)) * 1000 + ms
+
+
+class LyricsTimeline:
+    """编译后的歌词时间轴：开始/结束时间数组 + 文本表 + 逐字时间"""
+    __slots__ = ("starts", "ends", "texts", "char_times")
+
+    def __init__(self, starts=None, ends=None, texts=None, char_times=None):
+        self.starts = starts if starts is not None else array("i")
+        self.ends = ends if ends is not None else array("i")
+        self.texts = texts if texts is not None else ()
+        # 每行逐字开始时间（array），无逐字标签的行为 None
+        self.char_times = char_times if char_times is not None else ()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return self.starts[index], self.ends[index], self.texts[index]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def find_line(self, position):
+        """二分查找当前播放位置所在的行，未命中返回 -1"""
+        index = bisect.bisect_right(self.starts, position) - 1
+        if index >= 0 and position < self.ends[index]:
+            return index
+        return -1
+
+
+EMPTY_LYRICS_TIMELINE = LyricsTimeline()
+
+
+def compile_line_words(line_start, body):
+    """解析增强型LRC的 <mm:ss.xx> 逐字标签，返回 (纯文本, 每字开始时间)"""
+    if "<" not in body:
+        return body.strip(), None
+
+    chars = []
+    times = []
+    current = line_start
+    pos = 0
+    for match in LRC_WORD_TAG.finditer(body):
+        segment = body[pos:match.start()]
+        chars.append(segment)
+        times.append(current)
+        current = lrc_tag_to_ms(*match.groups())
+        pos = match.end()
+    if pos == 0:
+        return body.strip(), None
+    chars.append(body[pos:])
+    times.append(current)
+
+    text = []
+    char_times = array("i")
+    for segment, segment_start in zip(chars, times):
+        for char in segment:
+            text.append(char)
+            char_times.append(segment_start)
+
+    # 去掉首尾空白，逐字时间同步裁剪
+    joined = "".join(text)
+    left = len(joined) - len(joined.lstrip())
+    stripped = joined.strip()
+    return stripped, char_times[left:left + len(stripped)]
+
+
+def compile_lyrics_uncached(lyrics_text):
+    """单遍扫描LRC文本，支持多时间标签行、[offset:] 与逐字标签"""
+    offset = 0
+    entries = []
+    for line in lyrics_text.splitlines():
+        pos = 0
+        stamps = []
+        while True:
+            match = LRC_TIME_TAG.match(line, pos)
+            if not match:
+                break
+            stamps.append(lrc_tag_to_ms(*match.groups()))
+            pos = match.end()
+
+        if not stamps:
+            offset_match = LRC_OFFSET_TAG.match(line)
+            if offset_match:
+                offset = int(offset_match.group(1))
+            continue
+
+        body = line[pos:]
+        for stamp in stamps:
+            text, char_times = compile_line_words(stamp, body)
+            entries.append((stamp, len(entries), text, char_times))
+
+    if not entries:
+        return EMPTY_LYRICS_TIMELINE
+
+    # 按时间稳定排序；offset 为正表示歌词提前
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    count = len(entries)
+    starts = array("i", (max(0, entry[0] - offset) for entry in entries))
+    ends = array("i", starts[1:])
+    ends.append(starts[-1] + LRC_LAST_LINE_DURATION)
+    texts = tuple(entry[2] for entry in entries)
+    char_times = tuple(
+        None if entry[3] is None
+        else array("i", (max(0, t - offset) for t in entry[3]))
+        for entry in entries
+    )
+    logger.debug(f"歌词编译完成: {count} 行, offset={offset}ms")
+    return LyricsTimeline(starts, ends, texts, char_times)
+
+
+_lyrics_cache = OrderedDict()
+_lyrics_cache_lock = threading.Lock()
+
+
+def compile_lyrics(lyrics_text):
+    """编译歌词为时间轴（按歌词内容哈希缓存，重复加载不再解析）"""
+    if not lyrics_text:
+        return EMPTY_LYRICS_TIMELINE
+
+    key = hashlib.sha1(lyrics_text.encode("utf-8", "surrogatepass")).hexdigest()
+    with _lyrics_cache_lock:
+        timeline = _lyrics_cache.get(key)
+        if timeline is not None:
+            _lyrics_cache.move_to_end(key)
+            return timeline
+
+    timeline = compile_lyrics_uncached(lyrics_text)
+    with _lyrics_cache_lock:
+        _lyrics_cache[key] = timeline
+        while len(_lyrics_cache) > LRC_CACHE_SIZE:
+            _lyrics_cache.popitem(last=False)
+    return timeline
+
+
 # =============== 歌词同步 ===============
 class LyricsSync(QObject):
     def __init__(self, media_player, external_lyrics):
         super().__init__()
         self.media_player = media_player
         self.external_lyrics = external_lyrics
-        self.lyrics_data = []  # 存储(开始时间, 结束时间, 文本)
+        self.lyrics_data = EMPTY_LYRICS_TIMELINE  # 编译后的时间轴，按行索引得到(开始时间, 结束时间, 文本)
         self.current_line_index = -1
         self.enabled = True
         self.word_positions = []  # 存储每个字的开始和结束时间
+        self.word_starts = array("d")  # 每个字的开始时间，用于二分查找
         self.karaoke_progress = 0  # 当前进度
+        self.line_cleared = False  # 歌词窗口是否已清空
         self.normal_color = QColor("#FFFFFF")  # 白色
         self.highlight_color = QColor("#000000")  # 黑色
         self.next_line_color = QColor("#AAAAAA")  # 灰色
-        self.translation_data = []  # (开始时间, 结束时间, 翻译文本)
+        self.translation_data = EMPTY_LYRICS_TIMELINE  # (开始时间, 结束时间, 翻译文本)
         self.show_translation = True  # 是否显示翻译
         
     def parse_lyrics(self, lyrics_text):
         """解析歌词文本为结构化的歌词数据"""
-        if not lyrics_text:
-            return []
-            
-        lines = lyrics_text.splitlines()
-        lyrics_data = []
-        pattern = re.compile(r'\[(\d+):(\d+\.\d+)\](.*)')
-        
-        # 收集所有时间点
-        time_points = []
-        for line in lines:
-            match = pattern.match(line)
-            if match:
-                minutes = int(match.group(1))
-                seconds = float(match.group(2))
-                time_ms = int((minutes * 60 + seconds) * 1000)
-                text = match.group(3).strip()
-                time_points.append((time_ms, text))
-        
-        # 按时间排序
-        time_points.sort(key=lambda x: x[0])
-        
-        # 为每行计算结束时间（下一行的开始时间）
-        for i, (start_time, text) in enumerate(time_points):
-            if i < len(time_points) - 1:
-                end_time = time_points[i+1][0]
-            else:
-                # 最后一行：如果没有下一行，使用歌曲剩余时间或默认10秒
-                end_time = start_time + 10000  # 默认10秒
-            lyrics_data.append((start_time, end_time, text))
-        
-        return lyrics_data
+        return compile_lyrics(lyrics_text)
         
     def load_lyrics(self, lyrics_text, translation_text=""):
         """加载歌词文本并解析"""
-        self.lyrics_data = self.parse_lyrics(lyrics_text)
+        self.lyrics_data = compile_lyrics(lyrics_text)
         # 解析翻译歌词
-        if translation_text:
-            self.translation_data = self.parse_lyrics(translation_text)
-        else:
-            self.translation_data = []
+        self.translation_data = compile_lyrics(translation_text)
         self.current_line_index = -1
         self.word_positions = []
-        
-        if not lyrics_text:
-            return
-            
-        lines = lyrics_text.splitlines()
-        pattern = re.compile(r'\[(\d+):(\d+\.\d+)\](.*)')
-        
-        # 第一遍：收集所有时间戳
-        time_points = []
-        for line in lines:
-            match = pattern.match(line)
-            if match:
-                minutes = int(match.group(1))
-                seconds = float(match.group(2))
-                time_ms = int((minutes * 60 + seconds) * 1000)
-                text = match.group(3).strip()
-                time_points.append((time_ms, text))
-        
-        # 按时间排序
-        time_points.sort(key=lambda x: x[0])
-        
-        # 为每行计算结束时间（下一行的开始时间）
-        for i in range(len(time_points)):
-            start_time, text = time_points[i]
-            if i < len(time_points) - 1:
-                end_time = time_points[i+1][0]
-            else:
-                # 最后一行：如果没有下一行，使用歌曲剩余时间或默认10秒
-                end_time = start_time + 10000  # 默认10秒
-            self.lyrics_data.append((start_time, end_time, text))
+        self.word_starts = array("d")
+        self.line_cleared = False
     
     def update_position(self, position):
-        """根据播放位置更新歌词显示（添加渐变色效果）"""
+        """根据播放位置更新歌词显示（换行时布局一次，行内只推进进度）"""
         if not self.enabled or not self.lyrics_data:
             return
             
-        # 使用二分查找提高查找效率
-        low, high = 0, len(self.lyrics_data) - 1
-        current_line_idx = -1
-        
-        while low <= high:
-            mid = (low + high) // 2
-            start_time, end_time, text = self.lyrics_data[mid]
-            
-            if start_time <= position < end_time:
-                current_line_idx = mid
-                break
-            elif position < start_time:
-                high = mid - 1
-            else:
-                low = mid + 1
+        # 在编译好的时间轴上二分查找
+        current_line_idx = self.lyrics_data.find_line(position)
         
         # 如果没有找到匹配行
         if current_line_idx == -1:
-            self.external_lyrics.update_lyrics("", "", 0)  # 传递三个参数
+            if self.current_line_index != -1 or not self.line_cleared:
+                self.external_lyrics.update_lyrics("", "", "")
+                self.line_cleared = True
             self.current_line_index = -1
             return
             
-        # 如果是新行，重置卡拉OK效果
+        # 如果是新行，重置卡拉OK效果并把整行交给歌词窗口
         if current_line_idx != self.current_line_index:
             self.current_line_index = current_line_idx
-            self.calculate_word_positions(
-                self.lyrics_data[current_line_idx][2], 
-                self.lyrics_data[current_line_idx][0]
-            )
+            self.line_cleared = False
+            current_text = self.lyrics_data[current_line_idx][2]
+            self.calculate_word_positions(current_text, self.lyrics_data[current_line_idx][0])
+            
+            # 获取翻译行
+            translation_line = ""
+            if self.show_translation and self.translation_data and current_line_idx < len(self.translation_data):
+                translation_line = self.translation_data[current_line_idx][2]
+            
+            # 准备下一行歌词
+            next_text = ""
+            if current_line_idx + 1 < len(self.lyrics_data):
+                next_text = self.lyrics_data[current_line_idx + 1][2]
+            
+            self.external_lyrics.show_karaoke_line(current_text, self.word_positions, next_text, translation_line)
+            self.scroll_to_current_line()
         
-        # 更新当前行内的卡拉OK效果
+        # 更新当前行内的卡拉OK效果（重绘由歌词标签按帧率节流）
         self.update_karaoke_effect(position)
+        self.external_lyrics.update_karaoke_position(position)
 
-         # 获取翻译行
-        translation_line = ""
-        if self.show_translation and self.translation_data and current_line_idx < len(self.translation_data):
-            translation_line = self.get_styled_text(
-                self.translation_data[current_line_idx][2],  # 使用 current_line_idx
-                position
-            )
-        
-        # 准备下一行歌词
-        next_text = ""
-        if current_line_idx + 1 < len(self.lyrics_data):
-            next_text = self.lyrics_data[current_line_idx + 1][2]
-            
-        # 获取当前行的卡拉OK效果文本
-        current_text = self.get_styled_text(
-            self.lyrics_data[current_line_idx][2], 
-            position
-        )
-        
-        # 更新歌词窗口
-        self.external_lyrics.update_lyrics(current_text, next_text, translation_line)
-        # 在更新歌词后，确保当前行在视图中可见
+    def scroll_to_current_line(self):
+        """确保当前行在视图中可见"""
         if hasattr(self.external_lyrics, 'scroll_area') and self.external_lyrics.scroll_area:
             # 计算当前行在滚动区域中的位置
             label_pos = self.external_lyrics.current_line_label.pos()
@@ -1437,81 +2881,40 @@ class LyricsSync(QObject):
     def calculate_word_positions(self, text, position):
         """计算歌词中每个字的位置和持续时间（用于渐变色效果）"""
         self.word_positions = []
+        self.word_starts = array("d")
+        self.karaoke_progress = -1
         if not text:
             return
         
-        # 假设每个字平均分配时间
-        start_time = self.lyrics_data[self.current_line_index][0]
-        end_time = self.lyrics_data[self.current_line_index][1]
-        
-        total_chars = len(text)
-        duration_per_char = (end_time - start_time) / max(1, total_chars)
-        
-        for i in range(total_chars):
-            char_start = start_time + i * duration_per_char
-            char_end = char_start + duration_per_char
-            self.word_positions.append((char_start, char_end))
+        start_time, end_time, _ = self.lyrics_data[self.current_line_index]
+        char_times = self.lyrics_data.char_times[self.current_line_index]
+        if char_times is not None and len(char_times) == len(text):
+            # 增强型LRC：使用逐字时间标签
+            for i, char_start in enumerate(char_times):
+                char_end = char_times[i + 1] if i + 1 < len(char_times) else end_time
+                self.word_positions.append((char_start, max(char_start, char_end)))
+        else:
+            # 假设每个字平均分配时间
+            total_chars = len(text)
+            duration_per_char = (end_time - start_time) / max(1, total_chars)
+            
+            for i in range(total_chars):
+                char_start = start_time + i * duration_per_char
+                char_end = char_start + duration_per_char
+                self.word_positions.append((char_start, char_end))
+        self.word_starts = array("d", (char_start for char_start, _ in self.word_positions))
     
     def update_karaoke_effect(self, position):
-        """更新卡拉OK效果（渐变着色）"""
+        """更新卡拉OK效果（记录当前播放到的字符）"""
         if not self.word_positions:
             return
         
-        # 找出当前播放到的字符位置
-        current_char_idx = 0
-        for i, (char_start, char_end) in enumerate(self.word_positions):
-            if position >= char_start:
-                current_char_idx = i
-            else:
-                break
+        current_char_idx = max(0, bisect.bisect_right(self.word_starts, position) - 1)
+        if current_char_idx == self.karaoke_progress:
+            return
         
         # 保存当前字符索引
         self.karaoke_progress = current_char_idx
-    
-    def get_styled_text(self, text, position):
-        """获取带样式的歌词文本（卡拉OK效果）"""
-        if not self.word_positions or len(self.word_positions) != len(text):
-            return text
-        
-        # 找出当前播放到的字符位置
-        current_char_idx = 0
-        for i, (char_start, char_end) in enumerate(self.word_positions):
-            if position >= char_start:
-                current_char_idx = i
-            else:
-                break
-        
-        # 创建带样式的HTML
-        styled_text = ""
-        for i, char in enumerate(text):
-            if i < current_char_idx:
-                # 已播放部分 - 高亮颜色
-                styled_text += f'<span style="color: #000000;">{char}</span>'
-            elif i == current_char_idx:
-                # 当前播放字 - 添加过渡效果
-                # 计算当前字内的进度 (0-1)
-                char_start, char_end = self.word_positions[i]
-                if char_end > char_start:
-                    progress = (position - char_start) / (char_end - char_start)
-                    progress = max(0, min(1, progress))  # 限制在0-1范围
-                    
-                    # 创建渐变效果 (从高亮色到普通色)
-                    r1, g1, b1 = 255, 87, 34  # 橙色 (FF5722)
-                    r2, g2, b2 = 255, 255, 255  # 白色
-                    
-                    r = int(r1 + (r2 - r1) * progress)
-                    g = int(g1 + (g2 - g1) * progress)
-                    b = int(b1 + (b2 - b1) * progress)
-                    color = f"rgb({r},{g},{b})"
-                    
-                    styled_text += f'<span style="color: {color};">{char}</span>'
-                else:
-                    styled_text += f'<span style="color: #FF5722;">{char}</span>'
-            else:
-                # 未播放部分 - 普通颜色
-                styled_text += f'<span style="color: #FFFFFF;">{char}</span>'
-        
-        return styled_text
 
 # =============== 睡眠定时器 ===============
 class SleepTimerDialog(QDialog):
@@ -1776,7 +3179,7 @@ class NetEaseMusicAPI:
             "offset": 0
         }
         try:
-            response = requests.post(url, headers=self.header, cookies=self.cookies, data=data)
+            response = get_http_client().post(url, headers=self.header, cookies=self.cookies, data=data)
             response.encoding = 'utf-8' if 'utf-8' in response.headers.get('content-type', '').lower() else 'gbk'
             logger.debug(f"搜索响应状态码: {response.status_code}")
             result = response.json()
@@ -1807,7 +3210,7 @@ class NetEaseMusicAPI:
         logger.info(f"获取歌词: ID={song_id}")
         url = f"https://music.163.com/api/song/lyric?id={song_id}&lv=1&kv=1&tv=-1"
         try:
-            response = requests.get(url, headers=self.header, cookies=self.cookies)
+            response = get_http_client().get(url, headers=self.header, cookies=self.cookies)
             result = response.json()
             
             if "lrc" in result and "lyric" in result["lrc"]:
@@ -1828,7 +3231,7 @@ class NetEaseMusicAPI:
         logger.info(f"获取歌曲额外信息: ID={song_id}")
         url = f"https://music.163.com/api/song/detail?ids=[{song_id}]"
         try:
-            response = requests.get(url, headers=self.header, cookies=self.cookies)
+            response = get_http_client().get(url, headers=self.header, cookies=self.cookies)
             result = response.json()
             
             if result["code"] != 200 or not result["songs"]:
@@ -1852,7 +3255,7 @@ class NetEaseMusicAPI:
             logger.error(f"获取歌曲额外信息失败: {str(e)}")
             return {}
     
-    def download_song(self, audio_url: str, file_path: str) -> bool:
+    def download_song(self, audio_url: str, file_path: str, progress_callback=None, should_stop=None) -> bool:
         """下载歌曲文件"""
         logger.info(f"开始下载歌曲: {file_path}")
         try:
@@ -1862,23 +3265,12 @@ class NetEaseMusicAPI:
                 "Origin": "https://music.163.com"
             }
             
-            response = requests.get(audio_url, headers=headers, stream=True)
-            if response.status_code != 200:
-                logger.error(f"下载失败: HTTP状态码 {response.status_code}")
+            downloader = ResumableDownloader(
+                audio_url, file_path, headers=headers,
+                progress_callback=progress_callback, should_stop=should_stop
+            )
+            if not downloader.run():
                 return False
-                
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        progress = int(100 * downloaded / total_size) if total_size > 0 else 0
-                        
-                        self.download_progress.emit(progress)
             
             logger.info(f"歌曲下载完成: {file_path}")
             return True
@@ -1899,10 +3291,12 @@ class NetEaseWorker(QThread):
         self.mode = None
         self.keyword = None
         self.song_id = None
+        self.refresh = False
         
-    def search_songs(self, keyword):
+    def search_songs(self, keyword, refresh=False):
         self.mode = "search"
         self.keyword = keyword
+        self.refresh = refresh
         self.start()
         
     def fetch_details(self, song_id):
@@ -1913,7 +3307,16 @@ class NetEaseWorker(QThread):
     def run(self):
         try:
             if self.mode == "search":
-                songs = self.api.fetch_data(self.keyword)
+                cache_key = make_search_key(
+                    {"name": "NetEaseMusicAPI", "url": "https://music.163.com/api/cloudsearch/pc"},
+                    self.keyword, 1, 5
+                )
+                songs = None if self.refresh else get_search_cache().get(cache_key)
+                if songs is None:
+                    songs = self.api.fetch_data(self.keyword)
+                    get_search_cache().put(cache_key, songs)
+                else:
+                    logger.info(f"使用缓存的网易云搜索结果: {self.keyword}")
                 self.search_finished.emit(songs)
             elif self.mode == "details":
                 song_info = self.api.fetch_extra(self.song_id)
@@ -1923,10 +3326,16 @@ class NetEaseWorker(QThread):
             self.error_occurred.emit(error_msg)
 
 # =============== 音乐工作线程 ===============
+class SearchError(Exception):
+    """音源搜索失败（消息可直接显示给用户）"""
+    pass
+
 class MusicWorker(QThread):
     search_finished = pyqtSignal(list)
+    search_partial = pyqtSignal(list)
     error_occurred = pyqtSignal(str)
     download_progress = pyqtSignal(int)
+    download_speed = pyqtSignal(float, float)  # 字节/秒, 剩余秒数
     download_finished = pyqtSignal(str)
     
     def __init__(self):
@@ -1936,231 +3345,27 @@ class MusicWorker(QThread):
         self.song = None
         self.audio_url = None
         self.file_path = None
+        self.refresh = False
         
-    def search_songs(self, keyword):
+    def search_songs(self, keyword, refresh=False):
         self.mode = "search"
         self.keyword = keyword
+        self.refresh = refresh
         self.start()
         
     def download_song(self, audio_url, file_path):
-        self.mode = "download"
-        self.audio_url = audio_url
-        self.file_path = file_path
-        self.start()
-        
-    def run(self):
-        try:
-            if self.mode == "search":
-                ensure_settings_file_exists()
-                config = get_active_source_config()
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-                    "Accept": "application/json, text/javascript, */*; q=0.01",
-                    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                    "Connection": "keep-alive",
-                    "Referer": "https://music.163.com/",
-                    "Origin": "https://music.163.com",
-                    "X-Requested-With": "XMLHttpRequest",
-                    **config.get("headers", {})
-                }
-
-                params = config.get("params", {}).copy()
-                max_results = load_settings()["other"]["max_results"]
-                
-                # 替换查询参数中的占位符
-                for key, value in params.items():
-                    if isinstance(value, str) and "{query}" in value:
-                        params[key] = value.replace("{query}", self.keyword)
-                
-                api_key = config.get("api_key", "")
-                if api_key:
-                    if "Authorization" in headers:
-                        headers["Authorization"] = f"Bearer {api_key}"
-                    else:
-                        params["api_key"] = api_key
-                
-                method = config.get("method", "GET").upper()
-                url = config["url"]
-                timeout = 30
-                max_retries = 3
-                retry_count = 0
-                
-                while retry_count < max_retries:
-                    try:
-                        if method == "GET":
-                            response = requests.get(url, params=params, headers=headers, timeout=timeout)
-                        else:
-                            response = requests.post(url, data=params, headers=headers, timeout=timeout)
-
-                        # 检查响应状态码
-                        if response.status_code != 200:
-                            logger.warning(f"API返回非200状态码: {response.status_code}, 尝试重试...")
-                            retry_count += 1
-                            time.sleep(1)
-                            continue
-                            
-                        # 检查响应内容是否为空
-                        if not response.text.strip():
-                            logger.warning("API返回空响应, 尝试重试...")
-                            retry_count += 1
-                            time.sleep(1)
-                            continue
-
-                        # 检查是否被重定向到验证页面
-                        if "verify" in response.url or "captcha" in response.url:
-                            logger.error("API请求被重定向到验证页面")
-                            self.error_occurred.emit("请求被拦截，可能需要解决验证码")
-                            return
-                        
-                        # 检查内容类型
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'application/json' not in content_type:
-                            logger.warning(f"API返回非JSON内容: {content_type}, 原始内容: {response.text[:200]}")
-                            
-                            # 尝试解析可能的错误信息
-                            if 'text/html' in content_type:
-                                soup = BeautifulSoup(response.text, 'html.parser')
-                                title = soup.title.string if soup.title else "未知错误"
-                                self.error_occurred.emit(f"API返回HTML页面: {title}")
-                                return
-                            
-                        # 尝试解析JSON
-                        try:
-                            data = response.json()
-                        except json.JSONDecodeError:
-                            logger.error(f"无法解析JSON响应, 原始内容: {response.text[:200]}")
-                            self.error_occurred.emit(f"API返回了无效的JSON数据: {response.text[:100]}...")
-                            return
-                            
-                        # 成功获取数据，跳出重试循环
-                        break
-
-                    except requests.exceptions.Timeout:
-                        logger.warning(f"API请求超时, 尝试重试 ({retry_count+1}/{max_retries})")
-                        retry_count += 1
-                        time.sleep(2)
-                    except requests.exceptions.ConnectionError:
-                        logger.warning(f"网络连接错误, 尝试重试 ({retry_count+1}/{max_retries})")
-                        retry_count += 1
-                        time.sleep(2)
-                
-                # 如果重试后仍然失败
-                if retry_count >= max_retries:
-                    self.error_occurred.emit("API请求失败，请检查网络连接或稍后再试")
-                    return
-
-                # 根据音源名称使用不同的解析方式
-                active_source_name = config.get("name", "")
-                if active_source_name == "网易云音乐":
-                    if data["code"] == 200:
-                        songs = data["result"]["songs"]
-                        formatted_songs = []
-                        for song in songs:
-                            # 解析艺术家信息
-                            artists = "、".join([ar["name"] for ar in song.get("ar", [])])
-                            
-                            # 解析专辑信息
-                            album_info = song.get("al", {})
-                            album_name = album_info.get("name", "未知专辑")
-                            
-                            # 构建歌曲信息
-                            formatted_songs.append({
-                                "id": song["id"],
-                                "name": song["name"],
-                                "artists": artists,
-                                "duration": song["dt"],
-                                "album": album_name,
-                                "url": f"https://music.163.com/song/media/outer/url?id={song['id']}",
-                                "pic": album_info.get("picUrl", ""),
-                            })
-                        video_list = formatted_songs
-                    else:
-                        formatted_songs = []
-                        video_list = []
-
-                elif active_source_name == "酷狗音乐":
-                    search_response = response.json()
-                    if search_response.get("status") == 1 and search_response.get("data"):
-                        items = search_response["data"].get("lists", [])
-                        formatted_songs = []
-                    
-                        # 对于每个搜索结果，获取完整信息
-                        for item in items:
-                            # 获取歌曲hash
-                            song_hash = item.get("FileHash", "")
-                        
-                            # 使用hash获取完整信息
-                            if song_hash:
-                                # 构建获取完整信息的URL
-                                params = config.get("params", {}).copy()
-                                params["hash"] = song_hash
-                                full_info_url = config["url"] + "?" + urllib.parse.urlencode(params)
-                            
-                                # 请求完整信息
-                                full_info_response = requests.get(full_info_url, headers=headers, timeout=30)
-                                if full_info_response.status_code == 200:
-                                    full_info = full_info_response.json()
-                                
-                                    # 提取所需信息
-                                    if full_info.get("status") == 1 and full_info.get("data"):
-                                        song_data = full_info["data"]
-                                        formatted_songs.append({
-                                            "id": song_data.get("hash", ""),
-                                            "name": song_data.get("song_name", "未知歌曲"),
-                                            "artists": song_data.get("author_name", "未知艺术家"),
-                                            "duration": int(song_data.get("timelength", 0)),
-                                            "album": song_data.get("album_name", "未知专辑"),
-                                            "url": song_data.get("play_url", ""),
-                                            "pic": song_data.get("img", ""),
-                                            "lrc": song_data.get("lyrics", "")
-                                        })
-                        video_list = formatted_songs
-                    else:
-                        video_list = []
-
-                elif active_source_name == "公共音乐API":
-                    if data.get("code") == 200:
-                        error_msg = data.get("message", "未知错误")
-                        logger.error(f"公共音乐API错误: {error_msg}")
-                        self.error_occurred.emit(f"公共音乐API错误: {error_msg}")
-                        video_list = []
-                    else:
-                        # 成功获取数据
-                        video_list = data.get("data", [])
-                        # 确保所有歌曲都有必要字段
-                        for song in video_list:
-                            if "id" not in song:
-                                song["id"] = hashlib.md5(song["url"].encode()).hexdigest()
-                            if "duration" not in song:
-                                song["duration"] = 0
-                            if "artists" not in song:
-                                song["artists"] = "未知艺术家"
-                            if "album" not in song:
-                                song["album"] = "未知专辑"
-                else:
-                    video_list = data.get("data", [])
-                    if not isinstance(video_list, list):
-                        logger.warning(f"音源 {active_source_name} 返回的 data 字段不是列表")
-                        video_list = []
-                    
-                    formatted_songs = []
-                    for song in video_list:
-                        formatted_songs.append({
-                            "id": song.get("songid", ""),
-                            "name": song.get("title", "未知歌曲"),
-                            "artists": song.get("author", "未知艺术家"),
-                            "duration": self.parse_duration(song.get("duration", "00:00")),
-                            "album": song.get("album", "未知专辑"),
-                            "url": song.get("url", ""),
-                            "pic": song.get("pic", ""),
-                            "lrc": song.get("lrc", "")
-                        })
-                    video_list = formatted_songs
-                
-                # 限制结果数量
-                if len(video_list) > max_results:
-                    video_list = video_list[:max_results]
-                
+        self.mode = "download"
+        self.audio_url = audio_url
+        self.file_path = file_path
+        self.start()
+        
+    def run(self):
+        try:
+            if self.mode == "search":
+                ensure_settings_file_exists()
+                config = get_active_source_config()
+                max_results = get_settings_store().get()["other"]["max_results"]
+                video_list = self.search_source(config, self.keyword, max_results, self.refresh)
                 self.search_finished.emit(video_list)
 
             elif self.mode == "download":
@@ -2169,6 +3374,9 @@ class MusicWorker(QThread):
                     self.download_finished.emit(self.file_path)
                 else:
                     self.error_occurred.emit("歌曲下载失败")
+        except SearchError as e:
+            logger.error(str(e))
+            self.error_occurred.emit(str(e))
         except requests.exceptions.ConnectionError as e:
             error_msg = f"网络连接失败: {str(e)}。请检查网络连接或尝试更换音源。"
             logger.error(error_msg)
@@ -2178,6 +3386,248 @@ class MusicWorker(QThread):
             logger.error(error_msg)
             self.error_occurred.emit(error_msg)
     
+    def search_source(self, config, keyword, max_results, refresh=False):
+        """使用指定音源搜索，返回统一格式的歌曲列表，失败时抛出SearchError"""
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+            "Connection": "keep-alive",
+            "Referer": "https://music.163.com/",
+            "Origin": "https://music.163.com",
+            "X-Requested-With": "XMLHttpRequest",
+            **config.get("headers", {})
+        }
+
+        params = config.get("params", {}).copy()
+        cache_key = make_search_key(config, keyword, params.get("page", 1), max_results)
+        if not refresh:
+            cached = get_search_cache().get(cache_key)
+            if cached is not None:
+                logger.info(f"使用缓存的搜索结果: {keyword}")
+                return cached
+        
+        # 替换查询参数中的占位符
+        for key, value in params.items():
+            if isinstance(value, str) and "{query}" in value:
+                params[key] = value.replace("{query}", keyword)
+        
+        api_key = config.get("api_key", "")
+        if api_key:
+            if "Authorization" in headers:
+                headers["Authorization"] = f"Bearer {api_key}"
+            else:
+                params["api_key"] = api_key
+        
+        method = config.get("method", "GET").upper()
+        url = config["url"]
+        timeout = 30
+        max_retries = 3
+        retry_count = 0
+        
+        while retry_count < max_retries:
+            # 每次重试前检查是否已取消，避免取消后仍要等完所有重试
+            if self.isInterruptionRequested():
+                raise SearchError("搜索已取消")
+            try:
+                if method == "GET":
+                    response = get_http_client().get(url, params=params, headers=headers, timeout=timeout)
+                else:
+                    response = get_http_client().post(url, data=params, headers=headers, timeout=timeout)
+
+                # 检查响应状态码
+                if response.status_code != 200:
+                    logger.warning(f"API返回非200状态码: {response.status_code}, 尝试重试...")
+                    retry_count += 1
+                    time.sleep(1)
+                    continue
+                    
+                # 检查响应内容是否为空
+                if not response.text.strip():
+                    logger.warning("API返回空响应, 尝试重试...")
+                    retry_count += 1
+                    time.sleep(1)
+                    continue
+
+                # 检查是否被重定向到验证页面
+                if "verify" in response.url or "captcha" in response.url:
+                    logger.error("API请求被重定向到验证页面")
+                    raise SearchError("请求被拦截，可能需要解决验证码")
+                
+                # 检查内容类型
+                content_type = response.headers.get('Content-Type', '')
+                if 'application/json' not in content_type:
+                    logger.warning(f"API返回非JSON内容: {content_type}, 原始内容: {response.text[:200]}")
+                    
+                    # 尝试解析可能的错误信息
+                    if 'text/html' in content_type:
+                        soup = BeautifulSoup(response.text, 'html.parser')
+                        title = soup.title.string if soup.title else "未知错误"
+                        raise SearchError(f"API返回HTML页面: {title}")
+                    
+                # 尝试解析JSON
+                try:
+                    data = response.json()
+                except json.JSONDecodeError:
+                    logger.error(f"无法解析JSON响应, 原始内容: {response.text[:200]}")
+                    raise SearchError(f"API返回了无效的JSON数据: {response.text[:100]}...")
+                    
+                # 成功获取数据，跳出重试循环
+                break
+
+            except requests.exceptions.Timeout:
+                logger.warning(f"API请求超时, 尝试重试 ({retry_count+1}/{max_retries})")
+                retry_count += 1
+                time.sleep(2)
+            except requests.exceptions.ConnectionError:
+                logger.warning(f"网络连接错误, 尝试重试 ({retry_count+1}/{max_retries})")
+                retry_count += 1
+                time.sleep(2)
+        
+        # 如果重试后仍然失败
+        if retry_count >= max_retries:
+            raise SearchError("API请求失败，请检查网络连接或稍后再试")
+
+        # 根据音源名称使用不同的解析方式
+        active_source_name = config.get("name", "")
+        if active_source_name == "网易云音乐":
+            if data["code"] == 200:
+                songs = data["result"]["songs"]
+                formatted_songs = []
+                for song in songs:
+                    # 解析艺术家信息
+                    artists = "、".join([ar["name"] for ar in song.get("ar", [])])
+                    
+                    # 解析专辑信息
+                    album_info = song.get("al", {})
+                    album_name = album_info.get("name", "未知专辑")
+                    
+                    # 构建歌曲信息
+                    formatted_songs.append({
+                        "id": song["id"],
+                        "name": song["name"],
+                        "artists": artists,
+                        "duration": song["dt"],
+                        "album": album_name,
+                        "url": f"https://music.163.com/song/media/outer/url?id={song['id']}",
+                        "pic": album_info.get("picUrl", ""),
+                    })
+                video_list = formatted_songs
+            else:
+                formatted_songs = []
+                video_list = []
+
+        elif active_source_name == "酷狗音乐":
+            search_response = response.json()
+            if search_response.get("status") == 1 and search_response.get("data"):
+                items = search_response["data"].get("lists", [])[:max_results]
+                # 并发获取每个搜索结果的完整信息
+                formatted_songs = self.fetch_kugou_details(config, headers, items)
+                video_list = formatted_songs
+            else:
+                video_list = []
+
+        elif active_source_name == "公共音乐API":
+            if data.get("code") == 200:
+                error_msg = data.get("message", "未知错误")
+                logger.error(f"公共音乐API错误: {error_msg}")
+                raise SearchError(f"公共音乐API错误: {error_msg}")
+            else:
+                # 成功获取数据
+                video_list = data.get("data", [])
+                # 确保所有歌曲都有必要字段
+                for song in video_list:
+                    if "id" not in song:
+                        song["id"] = hashlib.md5(song["url"].encode()).hexdigest()
+                    if "duration" not in song:
+                        song["duration"] = 0
+                    if "artists" not in song:
+                        song["artists"] = "未知艺术家"
+                    if "album" not in song:
+                        song["album"] = "未知专辑"
+        else:
+            video_list = data.get("data", [])
+            if not isinstance(video_list, list):
+                logger.warning(f"音源 {active_source_name} 返回的 data 字段不是列表")
+                video_list = []
+            
+            formatted_songs = []
+            for song in video_list:
+                formatted_songs.append({
+                    "id": song.get("songid", ""),
+                    "name": song.get("title", "未知歌曲"),
+                    "artists": song.get("author", "未知艺术家"),
+                    "duration": self.parse_duration(song.get("duration", "00:00")),
+                    "album": song.get("album", "未知专辑"),
+                    "url": song.get("url", ""),
+                    "pic": song.get("pic", ""),
+                    "lrc": song.get("lrc", "")
+                })
+            video_list = formatted_songs
+        
+        # 限制结果数量
+        if len(video_list) > max_results:
+            video_list = video_list[:max_results]
+        
+        get_search_cache().put(cache_key, video_list)
+        return video_list
+
+    def fetch_kugou_details(self, config, headers, items, max_workers=6):
+        """并发获取酷狗歌曲的完整信息，保持搜索结果顺序，失败的条目跳过"""
+        hashes = [item.get("FileHash", "") for item in items]
+        slots = [None] * len(hashes)
+        if not any(hashes):
+            return []
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(hashes)))
+        try:
+            futures = {
+                executor.submit(self.fetch_kugou_detail, config, headers, song_hash): index
+                for index, song_hash in enumerate(hashes) if song_hash
+            }
+            for future in concurrent.futures.as_completed(futures):
+                if self.isInterruptionRequested():
+                    logger.info("酷狗详情获取被中断")
+                    break
+                song = future.result()
+                if song:
+                    slots[futures[future]] = song
+                    # 按原顺序推送已获取的结果
+                    self.search_partial.emit([s for s in slots if s])
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        return [s for s in slots if s]
+    
+    def fetch_kugou_detail(self, config, headers, song_hash):
+        """获取单首酷狗歌曲的完整信息"""
+        try:
+            params = config.get("params", {}).copy()
+            params["hash"] = song_hash
+            full_info_url = config["url"] + "?" + urllib.parse.urlencode(params)
+            
+            full_info_response = get_http_client().get(full_info_url, headers=headers, timeout=(5, 15))
+            if full_info_response.status_code != 200:
+                return None
+            full_info = full_info_response.json()
+            
+            # 提取所需信息
+            if full_info.get("status") == 1 and full_info.get("data"):
+                song_data = full_info["data"]
+                return {
+                    "id": song_data.get("hash", ""),
+                    "name": song_data.get("song_name", "未知歌曲"),
+                    "artists": song_data.get("author_name", "未知艺术家"),
+                    "duration": int(song_data.get("timelength", 0)),
+                    "album": song_data.get("album_name", "未知专辑"),
+                    "url": song_data.get("play_url", ""),
+                    "pic": song_data.get("img", ""),
+                    "lrc": song_data.get("lyrics", "")
+                }
+        except Exception as e:
+            logger.warning(f"获取酷狗歌曲详情失败 ({song_hash}): {str(e)}")
+        return None
+    
     def download_file(self, url, file_path):
         try:
             # 公共音乐API有特殊的下载URL结构
@@ -2194,24 +3644,15 @@ class MusicWorker(QThread):
                 "Referer": "https://music.163.com/",
                 "Origin": "https://music.163.com"
             }
-            response = requests.get(url, headers=headers, stream=True, timeout=30)
-            if response.status_code != 200:
-                logger.error(f"下载失败: HTTP状态码 {response.status_code}")
+            downloader = ResumableDownloader(
+                url, file_path, headers=headers,
+                progress_callback=ProgressReporter(self.report_download_progress).update,
+                should_stop=self.isInterruptionRequested
+            )
+            if not downloader.run():
+                if self.isInterruptionRequested():
+                    logger.info("下载被中断")
                 return False
-                
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if self.isInterruptionRequested():
-                        logger.info("下载被中断")
-                        return False
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        progress = int(100 * downloaded / total_size) if total_size > 0 else 0
-                        self.download_progress.emit(progress)
             
             logger.info(f"歌曲下载完成: {file_path}")
             return True
@@ -2219,6 +3660,11 @@ class MusicWorker(QThread):
             logger.error(f"下载歌曲失败: {str(e)}")
             return False
     
+    def report_download_progress(self, percent, downloaded, total, speed, eta):
+        """节流后的下载进度"""
+        self.download_progress.emit(percent)
+        self.download_speed.emit(speed, eta)
+    
     def parse_duration(self, duration_val):
         """解析不同格式的时长"""
         # 如果是整数，假设是毫秒
@@ -2241,6 +3687,142 @@ class MusicWorker(QThread):
         # 默认返回0
         return 0
 
+# =============== 聚合搜索 ===============
+NETEASE_API_SOURCE = "网易云API"
+
+def normalize_song_text(text):
+    """归一化歌名/歌手用于去重：转小写，去掉括号内容、空白和标点"""
+    text = str(text or "").lower()
+    text = re.sub(r"[\(（\[【].*?[\)）\]】]", "", text)
+    return re.sub(r"[\W_]+", "", text)
+
+def rank_songs(keyword, songs):
+    """排序：歌名匹配程度 > 音源数量 > 是否有播放链接 > 原始顺序"""
+    keyword = normalize_song_text(keyword)
+    
+    def score(item):
+        order, song = item
+        title = normalize_song_text(song.get("name"))
+        artists = normalize_song_text(song.get("artists"))
+        value = 0.0
+        if keyword and title == keyword:
+            value += 3
+        elif keyword and keyword in title:
+            value += 2
+        elif keyword and (keyword in artists or keyword in title + artists or keyword in artists + title):
+            value += 1
+        value += len(song.get("sources", [])) - 1 if song.get("sources") else 0
+        if song.get("url"):
+            value += 0.5
+        return (-value, order)
+    
+    return [song for _, song in sorted(enumerate(songs), key=score)]
+
+class FederatedSearchWorker(MusicWorker):
+    """聚合搜索：并发查询所有音源和网易云API，合并去重后排序"""
+    source_finished = pyqtSignal(str, int, float)  # 音源名称, 结果数量, 耗时(毫秒)
+    results_updated = pyqtSignal(list)
+    DURATION_TOLERANCE = 3000  # 去重时允许的时长误差（毫秒）
+    
+    def __init__(self):
+        super().__init__()
+        self.source_latency = {}
+        self.merged = []
+        self._index = {}  # (歌名, 歌手) -> [已合并的歌曲]
+        
+    def run(self):
+        try:
+            settings = get_settings_store().get()
+            max_results = settings["other"]["max_results"]
+            searches = {
+                config["name"]: (lambda c=config: self.search_source(c, self.keyword, max_results, self.refresh))
+                for config in copy.deepcopy(settings["sources"]["sources_list"])
+            }
+            searches[NETEASE_API_SOURCE] = lambda: self.search_netease(max_results)
+            
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(searches))
+            failed = []
+            try:
+                futures = {executor.submit(self.timed_search, search): name for name, search in searches.items()}
+                for future in concurrent.futures.as_completed(futures):
+                    if self.isInterruptionRequested():
+                        logger.info("聚合搜索被中断")
+                        return
+                    name = futures[future]
+                    songs, error, latency = future.result()
+                    self.source_latency[name] = latency
+                    if error is not None:
+                        logger.warning(f"音源 {name} 搜索失败 ({latency:.0f}ms): {str(error)}")
+                        failed.append(name)
+                    else:
+                        logger.info(f"音源 {name} 返回 {len(songs)} 首 ({latency:.0f}ms)")
+                        if songs:
+                            self.merge_results(name, songs)
+                            self.results_updated.emit(self.ranked_results())
+                    self.source_finished.emit(name, len(songs), latency)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+            
+            if len(failed) == len(searches):
+                self.error_occurred.emit("所有音源搜索失败，请检查网络连接或稍后再试")
+                return
+            self.search_finished.emit(self.ranked_results())
+        except Exception as e:
+            error_msg = f"聚合搜索发生错误: {str(e)}\n{traceback.format_exc()}"
+            logger.error(error_msg)
+            self.error_occurred.emit(error_msg)
+    
+    def timed_search(self, search):
+        """执行单个音源的搜索并计时，返回 (结果, 异常, 耗时毫秒)"""
+        start = time.perf_counter()
+        try:
+            songs = search()
+            return songs, None, (time.perf_counter() - start) * 1000
+        except Exception as e:
+            return [], e, (time.perf_counter() - start) * 1000
+    
+    def search_netease(self, max_results):
+        """通过网易云API搜索"""
+        cache_key = make_search_key(
+            {"name": "NetEaseMusicAPI", "url": "https://music.163.com/api/cloudsearch/pc"},
+            self.keyword, 1, max_results
+        )
+        if not self.refresh:
+            cached = get_search_cache().get(cache_key)
+            if cached is not None:
+                return cached
+        songs = NetEaseMusicAPI().fetch_data(self.keyword, limit=max_results)
+        for song in songs:
+            song.setdefault("url", f"https://music.163.com/song/media/outer/url?id={song['id']}")
+        get_search_cache().put(cache_key, songs)
+        return songs
+    
+    def merge_results(self, source_name, songs):
+        """按归一化的歌名+歌手+时长去重，合并来自多个音源的同一首歌"""
+        for song in songs:
+            key = (normalize_song_text(song.get("name")), normalize_song_text(song.get("artists")))
+            duration = int(song.get("duration") or 0)
+            for existing in self._index.setdefault(key, []):
+                other = int(existing.get("duration") or 0)
+                if not duration or not other or abs(duration - other) <= self.DURATION_TOLERANCE:
+                    if source_name not in existing["sources"]:
+                        existing["sources"].append(source_name)
+                    # 补全先到结果中缺失的字段
+                    for field in ("url", "pic", "lrc", "album"):
+                        if not existing.get(field) and song.get(field):
+                            existing[field] = song[field]
+                    break
+            else:
+                merged = dict(song)
+                merged["source"] = source_name
+                merged["sources"] = [source_name]
+                self._index[key].append(merged)
+                self.merged.append(merged)
+    
+    def ranked_results(self):
+        """返回排序后的合并结果副本"""
+        return [copy.deepcopy(song) for song in rank_songs(self.keyword, self.merged)]
+
 # =============== 设置对话框 ===============
 class SettingsDialog(QDialog):
     lyrics_settings_updated = pyqtSignal()
@@ -2472,7 +4054,7 @@ class SettingsDialog(QDialog):
         if config["name"] == "公共音乐API":
             test_url = "https://api.railgun.live/music/search?keyword=test&source=kugou&page=1&limit=1"
             try:
-                response = requests.get(test_url, timeout=5)
+                response = get_http_client().get(test_url, timeout=5)
                 if response.status_code == 200:
                     data = response.json()
                     if data.get("code") == 200 and data.get("data"):
@@ -2486,7 +4068,7 @@ class SettingsDialog(QDialog):
         else:
             # 其他音源的测试逻辑
             try:
-                response = requests.get(url, timeout=5)
+                response = get_http_client().get(url, timeout=5)
                 if response.status_code == 200:
                     QMessageBox.information(self, "测试成功", f"API连接正常: {url}")
                 else:
@@ -3031,43 +4613,308 @@ class ToolsDialog(QDialog):
             self.download_status.setText("批量下载已取消")
             
             
-class BatchDownloadWorker(QThread):
-    """批量下载歌曲的工作线程"""
+class BandwidthLimiter:
+    """全局带宽限制（令牌桶），多个下载线程共享"""
+    def __init__(self, bytes_per_second=0):
+        self.rate = bytes_per_second  # 0 表示不限速
+        self._lock = threading.Lock()
+        self._allowance = float(bytes_per_second)
+        self._last = time.monotonic()
+        
+    def consume(self, size, should_stop=None):
+        """消耗size字节的额度，不足时等待；should_stop返回True时立即返回False"""
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= size or self._allowance >= self.rate:
+                    self._allowance -= size
+                    return True
+                wait = (size - self._allowance) / self.rate
+            if should_stop and should_stop():
+                return False
+            time.sleep(min(wait, 0.1))
+
+class BatchDownloadWorker(MusicWorker):
+    """批量下载歌曲的工作线程：搜索最佳匹配并并发下载音频、歌词和封面"""
     progress_updated = pyqtSignal(int, int, str)
     
-    def __init__(self, song_names):
+    def __init__(self, song_names, save_dir=None):
         super().__init__()
-        self.song_names = song_names
+        self.song_names = [name.strip() for name in song_names if name.strip()]
+        settings = get_settings_store().get()
+        self.save_dir = save_dir or settings["save_paths"]["music"]
+        self.max_workers = max(1, settings["other"].get("batch_concurrency", 3))
+        self.max_retries = 3
+        self.limiter = BandwidthLimiter(settings["other"].get("batch_bandwidth_limit_kbps", 0) * 1024)
         self.success_count = 0
         self.fail_count = 0
+        self.completed_count = 0
+        self._count_lock = threading.Lock()
         self._stop_requested = False
         
     def run(self):
         self.success_count = 0
         self.fail_count = 0
+        self.completed_count = 0
+        os.makedirs(self.save_dir, exist_ok=True)
+        
+        config = get_active_source_config()
+        max_results = get_settings_store().get()["other"]["max_results"]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {
+                executor.submit(self.process_song, config, max_results, song_name): song_name
+                for song_name in self.song_names
+            }
+            for future in concurrent.futures.as_completed(futures):
+                song_name = futures[future]
+                success = False
+                try:
+                    success = future.result()
+                except Exception as e:
+                    logger.error(f"批量下载失败 [{song_name}]: {str(e)}")
+                with self._count_lock:
+                    if success:
+                        self.success_count += 1
+                    elif not self._stop_requested:
+                        self.fail_count += 1
+                    self.completed_count += 1
+                    completed = self.completed_count
+                self.progress_updated.emit(completed, len(self.song_names), song_name)
+                if self._stop_requested:
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        logger.info(f"批量下载结束: 成功 {self.success_count} 首, 失败 {self.fail_count} 首")
+    
+    def process_song(self, config, max_results, song_name):
+        """搜索单首歌曲并下载音频、歌词和封面"""
+        if self._stop_requested:
+            return False
+        with self._count_lock:
+            completed = self.completed_count
+        self.progress_updated.emit(completed, len(self.song_names), song_name)
         
-        for i, song_name in enumerate(self.song_names):
+        try:
+            songs = self.search_source(config, song_name, max_results)
+        except SearchError:
             if self._stop_requested:
-                break
-                
-            if not song_name.strip():
-                continue
-                
-            self.progress_updated.emit(i+1, len(self.song_names), song_name)
-            
-            try:
-                # 这里添加实际的下载逻辑
-                # 简化示例：模拟下载过程
-                self.msleep(1000)  # 模拟下载延迟
-                self.success_count += 1
-            except Exception:
-                self.fail_count += 1
+                return False
+            raise
+        song = next((s for s in rank_songs(song_name, songs) if s.get("url")), None)
+        if song is None:
+            logger.warning(f"批量下载: 未找到可下载的歌曲 [{song_name}]")
+            return False
+        
+        base_name = re.sub(r'[\\/*?:"<>|]', "_", f"{song.get('name', song_name)} - {song.get('artists', '未知艺术家')}")
+        base_path = os.path.join(self.save_dir, base_name)
+        headers = self.download_headers(config)
+        if not self.download_with_retry(song["url"], base_path + ".mp3", headers):
+            return False
+        
+        self.save_song_lyrics(song, base_path + ".lrc")
+        if song.get("pic"):
+            self.download_with_retry(song["pic"], base_path + ".jpg", headers)
+        logger.info(f"批量下载完成: {base_path}.mp3")
+        return True
+    
+    def save_song_lyrics(self, song, lrc_path):
+        """保存歌词：优先使用搜索结果中的歌词，网易云歌曲通过API获取"""
+        try:
+            lyrics = song.get("lrc", "")
+            if lyrics.startswith("http"):
+                lyrics = get_http_client().get(lyrics).text
+            elif not lyrics and "163.com" in song.get("url", ""):
+                result = NetEaseMusicAPI().fetch_lyrics(song["id"])
+                lyrics = result[0] if isinstance(result, tuple) else ""
+            if lyrics and "[" in lyrics:
+                with open(lrc_path, 'w', encoding='utf-8') as f:
+                    f.write(lyrics)
+        except Exception as e:
+            logger.warning(f"保存歌词失败: {lrc_path} - {str(e)}")
+    
+    @staticmethod
+    def download_headers(config):
+        """下载请求头：与单曲下载相同的默认头，再叠加音源配置的请求头（如网易云的Referer）"""
+        return {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+            "Referer": "https://music.163.com/",
+            "Origin": "https://music.163.com",
+            **config.get("headers", {})
+        }
+    
+    def download_with_retry(self, url, file_path, headers=None):
+        """下载单个文件，失败时按指数退避重试"""
+        for attempt in range(1, self.max_retries + 1):
+            if self._stop_requested:
+                return False
+            if self.transfer(url, file_path, headers):
+                return True
+            if attempt < self.max_retries:
+                logger.warning(f"下载失败，{attempt}/{self.max_retries} 次重试: {url}")
+                deadline = time.monotonic() + 2 ** (attempt - 1)
+                while time.monotonic() < deadline and not self._stop_requested:
+                    time.sleep(0.1)
+        return False
+    
+    def transfer(self, url, file_path, headers=None):
+        """通过共享下载器下载（重试时从.part续传），取消时立即中止"""
+        downloader = ResumableDownloader(
+            url, file_path, headers=headers,
+            should_stop=lambda: self._stop_requested,
+            limiter=self.limiter
+        )
+        return downloader.run()
                 
     def requestInterruption(self):
         """请求停止下载"""
         self._stop_requested = True
+        super().requestInterruption()
         
 # =============== 外置歌词窗口 ===============
+KARAOKE_MAX_FPS = 60
+KARAOKE_FEATHER_PX = 8.0
+
+
+class KaraokeLabel(QLabel):
+    """卡拉OK歌词标签：每行预先计算字形布局，按屏幕刷新率节流重绘"""
+    def __init__(self, text="", parent=None):
+        super().__init__(text, parent)
+        self.karaoke_text = None  # None 表示普通QLabel显示
+        self.char_starts = array("d")
+        self.char_ends = array("d")
+        self.char_edges = array("d")  # 每个字左边缘的x偏移，末尾为整行宽度
+        self.layout_key = None
+        self.karaoke_position = 0
+        self.painted_width = -1.0
+        self.sung_color = QColor("#000000")
+        self.unsung_color = QColor("#FFFFFF")
+        
+        # 帧定时器：不超过屏幕刷新率，进度无变化时不重绘
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.on_frame)
+
+    def frame_interval(self):
+        """按屏幕刷新率计算帧间隔（毫秒）"""
+        screen = QApplication.primaryScreen()
+        rate = screen.refreshRate() if screen else KARAOKE_MAX_FPS
+        rate = min(max(rate, 1.0), KARAOKE_MAX_FPS)
+        return max(1, int(round(1000 / rate)))
+
+    def set_karaoke_line(self, text, word_positions, sung_color, unsung_color):
+        """切换到新的一行（仅在换行时调用）"""
+        self.karaoke_text = text
+        self.char_starts = array("d", (start for start, _ in word_positions))
+        self.char_ends = array("d", (end for _, end in word_positions))
+        self.layout_key = None
+        self.painted_width = -1.0
+        self.sung_color = QColor(sung_color)
+        self.unsung_color = QColor(unsung_color)
+        self.setTextFormat(Qt.PlainText)
+        self.setText(text)
+        if text and len(self.char_starts) == len(text):
+            self.frame_timer.start(self.frame_interval())
+        else:
+            self.frame_timer.stop()
+        self.update()
+
+    def set_karaoke_position(self, position):
+        """记录播放位置，实际重绘交给帧定时器"""
+        self.karaoke_position = position
+        if self.karaoke_text and not self.frame_timer.isActive() and self.isVisible():
+            self.frame_timer.start(self.frame_interval())
+
+    def clear_karaoke(self):
+        """退出卡拉OK模式，恢复普通文本显示"""
+        if self.karaoke_text is None:
+            return
+        self.karaoke_text = None
+        self.frame_timer.stop()
+        self.setTextFormat(Qt.AutoText)
+
+    def ensure_layout(self):
+        """按当前字体预先计算每个字的位置（字体变化时才重新计算）"""
+        font = self.font()
+        key = (font.key(), self.karaoke_text)
+        if key != self.layout_key:
+            metrics = QFontMetricsF(font)
+            text = self.karaoke_text
+            self.char_edges = array("d", (metrics.horizontalAdvance(text[:i]) for i in range(len(text) + 1)))
+            self.layout_key = key
+        return self.char_edges
+
+    def highlight_width(self):
+        """计算已唱部分的像素宽度"""
+        edges = self.ensure_layout()
+        if not self.char_starts or len(edges) != len(self.char_starts) + 1:
+            return 0.0
+        index = bisect.bisect_right(self.char_starts, self.karaoke_position) - 1
+        if index < 0:
+            return 0.0
+        start, end = self.char_starts[index], self.char_ends[index]
+        ratio = 1.0 if end <= start else min(1.0, (self.karaoke_position - start) / (end - start))
+        return edges[index] + (edges[index + 1] - edges[index]) * ratio
+
+    def on_frame(self):
+        """帧回调：进度像素无变化时跳过重绘"""
+        if self.karaoke_text is None:
+            self.frame_timer.stop()
+            return
+        width = self.highlight_width()
+        if abs(width - self.painted_width) >= 0.5:
+            self.update()
+        elif width >= self.char_edges[-1]:
+            # 整行已唱完，等待下一行
+            self.frame_timer.stop()
+
+    def hideEvent(self, event):
+        self.frame_timer.stop()
+        super().hideEvent(event)
+
+    def paintEvent(self, event):
+        if self.karaoke_text is None:
+            super().paintEvent(event)
+            return
+        
+        edges = self.ensure_layout()
+        width = self.highlight_width()
+        self.painted_width = width
+        
+        rect = self.contentsRect()
+        alignment = self.alignment()
+        total = edges[-1]
+        if alignment & Qt.AlignLeft:
+            x0 = rect.x()
+        elif alignment & Qt.AlignRight:
+            x0 = rect.x() + rect.width() - total
+        else:
+            x0 = rect.x() + (rect.width() - total) / 2
+        
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.TextAntialiasing)
+        painter.setFont(self.font())
+        
+        # 未唱部分
+        painter.setPen(self.unsung_color)
+        painter.drawText(rect, alignment, self.karaoke_text)
+        
+        # 已唱部分：裁剪到进度位置，边缘用渐变过渡
+        if width > 0:
+            edge = x0 + width
+            gradient = QLinearGradient(edge - KARAOKE_FEATHER_PX, 0, edge, 0)
+            gradient.setColorAt(0, self.sung_color)
+            gradient.setColorAt(1, self.unsung_color)
+            painter.setClipRect(QRectF(rect.x(), rect.y(), edge - rect.x(), rect.height()))
+            painter.setPen(QPen(QBrush(gradient), 0))
+            painter.drawText(rect, alignment, self.karaoke_text)
+        painter.end()
+
+
 class ExternalLyricsWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -3098,7 +4945,7 @@ class ExternalLyricsWindow(QMainWindow):
         self.lyrics_layout.addWidget(self.translation_label)
         
         # 当前行标签
-        self.current_line_label = QLabel("")
+        self.current_line_label = KaraokeLabel("")
         self.current_line_label.setAlignment(Qt.AlignCenter)
         self.current_line_label.setStyleSheet("font-size: 48px; font-weight: bold; color: white;")
         
@@ -3126,7 +4973,7 @@ class ExternalLyricsWindow(QMainWindow):
         self.customContextMenuRequested.connect(self.show_context_menu)
 
         # 歌词数据
-        self.lyrics_data = []
+        self.lyrics_data = EMPTY_LYRICS_TIMELINE
         self.current_line_index = -1
         self.word_positions = []
         self.karaoke_progress = 0
@@ -3597,21 +5444,7 @@ class ExternalLyricsWindow(QMainWindow):
     
     def load_lyrics(self, lyrics_text):
         """加载歌词并解析时间标签"""
-        self.lyrics_data = []
-        lines = lyrics_text.splitlines()
-        pattern = re.compile(r'\[(\d+):(\d+\.\d+)\](.*)')
-        
-        for line in lines:
-            match = pattern.match(line)
-            if match:
-                minutes = int(match.group(1))
-                seconds = float(match.group(2))
-                time_ms = int((minutes * 60 + seconds) * 1000)
-                text = match.group(3).strip()
-                self.lyrics_data.append((time_ms, text))
-        
-        # 按时间排序
-        self.lyrics_data.sort(key=lambda x: x[0])
+        self.lyrics_data = compile_lyrics(lyrics_text)
         self.current_line_index = -1
         self.word_positions = []
 
@@ -3622,6 +5455,7 @@ class ExternalLyricsWindow(QMainWindow):
             return
             
         try:
+            self.current_line_label.clear_karaoke()
             self.current_line_label.setText(current_line)
             # 翻译行
             if translation_line:
@@ -3651,8 +5485,7 @@ class ExternalLyricsWindow(QMainWindow):
             return
         
         # 假设每个字平均分配时间
-        start_time = self.lyrics_data[self.current_line_index][0]
-        end_time = self.lyrics_data[self.current_line_index + 1][0] if self.current_line_index + 1 < len(self.lyrics_data) else start_time + 5000
+        start_time, end_time, _ = self.lyrics_data[self.current_line_index]
         
         total_chars = len(text)
         duration_per_char = (end_time - start_time) / max(1, total_chars)
@@ -3667,57 +5500,34 @@ class ExternalLyricsWindow(QMainWindow):
         if not self.word_positions:
             return
         
-        current_text = self.lyrics_data[self.current_line_index][1]
-        styled_text = self.get_styled_text(current_text, position)
-        self.current_line_label.setText(styled_text)
-    
-    def get_styled_text(self, text, position):
-        """获取带样式的歌词文本（卡拉OK效果）"""
-        if not self.word_positions or len(self.word_positions) != len(text):
-            return text
-        
-        # 找出当前播放到的字符位置
-        current_char_idx = 0
-        for i, (char_start, char_end) in enumerate(self.word_positions):
-            if position >= char_start:
-                current_char_idx = i
+        self.update_karaoke_position(position)
+
+    def show_karaoke_line(self, current_line, word_positions, next_line="", translation_line=""):
+        """切换到新的一行歌词（整行只布局一次，行内进度由标签自行绘制）"""
+        if not self.current_line_label or not self.next_line_label:
+            return
+            
+        try:
+            self.current_line_label.set_karaoke_line(
+                current_line, word_positions, self.highlight_color, self.normal_color
+            )
+            if translation_line:
+                self.translation_label.setText(translation_line)
+                self.translation_label.show()
             else:
-                break
-        
-        # 创建带样式的HTML
-        styled_text = ""
-        for i, char in enumerate(text):
-            if i < current_char_idx:
-                # 已播放部分 - 高亮颜色
-                styled_text += f'<span style="color: {self.highlight_color.name()};">{char}</span>'
-            elif i == current_char_idx:
-                # 当前播放字 - 添加过渡效果
-                # 计算当前字内的进度 (0-1)
-                char_start, char_end = self.word_positions[i]
-                if char_end > char_start:
-                    progress = (position - char_start) / (char_end - char_start)
-                    progress = max(0, min(1, progress))  # 限制在0-1范围
-                    
-                    # 创建渐变效果 (从高亮色到普通色)
-                    r1, g1, b1, _ = self.highlight_color.getRgb()
-                    r2, g2, b2, _ = self.normal_color.getRgb()
-                    
-                    r = int(r1 + (r2 - r1) * progress)
-                    g = int(g1 + (g2 - g1) * progress)
-                    b = int(b1 + (b2 - b1) * progress)
-                    color = QColor(r, g, b)
-                    
-                    styled_text += f'<span style="color: {color.name()};">{char}</span>'
-                else:
-                    styled_text += f'<span style="color: {self.highlight_color.name()};">{char}</span>'
+                self.translation_label.hide()
+            self.next_line_label.setText(next_line)
+            
+            if not current_line:
+                self.hide()
             else:
-                # 未播放部分 - 普通颜色
-                styled_text += f'<span style="color: {self.normal_color.name()};">{char}</span>'
-        
-        return styled_text
-        
-        # 设置更大的初始尺寸以容纳长歌词
-        self.setMinimumSize(1400, 200)
+                self.show()
+        except RuntimeError as e:
+            logger.error(f"更新歌词失败: {str(e)}")
+
+    def update_karaoke_position(self, position):
+        """推进当前行的卡拉OK进度"""
+        self.current_line_label.set_karaoke_position(position)
 
     # =============== 事件处理 ===============
     def mousePressEvent(self, event):
@@ -3798,6 +5608,11 @@ class UserBehaviorAnalyzer:
         """, (user_id,))
         return result
     
+FEATURE_DIM = 34  # tempo(1) + tonnetz(6) + rms(1) + tempogram(1) + mfcc(13) + chroma(12)
+FEATURE_SAMPLE_RATE = 22050
+FEATURE_ANALYSIS_SECONDS = 120  # 只分析前两分钟，控制单曲耗时
+
+
 class AudioFeatureExtractor:
     """音频特征提取器"""
     def extract_features(self, audio_path):
@@ -3805,17 +5620,34 @@ class AudioFeatureExtractor:
         if not AUDIO_FEATURES_ENABLED:
             return {}
         
-        # 使用librosa分析音频特征
-        y, sr = librosa.load(audio_path)
+        # 使用librosa分析音频特征，起音包络只计算一次供节奏相关特征复用
+        y, sr = librosa.load(audio_path, sr=FEATURE_SAMPLE_RATE, mono=True, duration=FEATURE_ANALYSIS_SECONDS)
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
         
         return {
-            "tempo": librosa.beat.tempo(y=y, sr=sr)[0],
+            "tempo": librosa.beat.tempo(onset_envelope=onset_env, sr=sr)[0],
             "key": librosa.feature.tonnetz(y=y, sr=sr).mean(axis=1),
             "energy": librosa.feature.rms(y=y).mean(),
-            "danceability": librosa.feature.tempogram(y=y, sr=sr).mean(),
+            "danceability": librosa.feature.tempogram(onset_envelope=onset_env, sr=sr).mean(),
+            "timbre": librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13).mean(axis=1),
+            "chroma": librosa.feature.chroma_stft(y=y, sr=sr).mean(axis=1),
             "mood": self.detect_mood(y, sr)
         }
     
+    def feature_vector(self, audio_path):
+        """提取定长 float32 特征向量（用于特征索引）"""
+        features = self.extract_features(audio_path)
+        if not features:
+            return None
+        return np.concatenate([
+            [features["tempo"] / 200.0],
+            features["key"],
+            [features["energy"]],
+            [features["danceability"]],
+            features["timbre"] / 100.0,
+            features["chroma"],
+        ]).astype(np.float32)
+    
     def detect_mood(self, audio, sr):
         """检测情绪"""
         if not AUDIO_FEATURES_ENABLED:
@@ -3823,45 +5655,293 @@ class AudioFeatureExtractor:
         
         # 简化实现，实际应使用预训练模型
         return "neutral"
-    
+
+
+def extract_feature_vector(audio_path):
+    """进程池任务：提取单曲特征向量，失败返回None"""
+    try:
+        return AudioFeatureExtractor().feature_vector(audio_path)
+    except Exception as e:
+        logging.getLogger("MusicApp").error(f"特征提取失败 {audio_path}: {str(e)}")
+        return None
+
+
+class AudioFeatureIndex:
+    """持久化音频特征索引：float32 内存映射矩阵 + 路径到行号的索引"""
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "features")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.matrix_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.lock = threading.RLock()
+        self.rows = {}  # 路径 -> [行号, mtime_ns, 文件大小]
+        self.row_paths = []  # 行号 -> 路径（已删除的行为 None）
+        self.free_rows = []  # 已删除、可复用的行号
+        self.matrix = None
+        self.capacity = 0
+        self.unit_matrix = None  # 标准化并单位化后的矩阵，索引变化后惰性重建
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.rows = json.load(f)
+        except Exception:
+            self.rows = {}
+        size = len(self.rows) and max(row for row, _, _ in self.rows.values()) + 1
+        self.row_paths = [None] * size
+        for path, (row, _, _) in self.rows.items():
+            self.row_paths[row] = path
+        self.free_rows = [row for row, path in enumerate(self.row_paths) if path is None]
+        self.open_matrix(max(size, 256))
+
+    def open_matrix(self, capacity):
+        """按容量打开（必要时扩展）内存映射矩阵"""
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        mode = 'r+b' if os.path.exists(self.matrix_path) else 'w+b'
+        with open(self.matrix_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            capacity = max(capacity, f.tell() // (FEATURE_DIM * 4))
+            f.truncate(capacity * FEATURE_DIM * 4)
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+', shape=(capacity, FEATURE_DIM))
+        self.capacity = capacity
+
+    def save(self):
+        """刷新矩阵并原子写入索引"""
+        with self.lock:
+            self.matrix.flush()
+            tmp_path = self.index_path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.rows, f)
+                os.replace(tmp_path, self.index_path)
+            except Exception as e:
+                logger.error(f"保存特征索引失败: {str(e)}")
+
+    def is_current(self, path, stat=None):
+        """索引中的特征是否仍对应当前文件"""
+        entry = self.rows.get(path)
+        if entry is None:
+            return False
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return False
+        return entry[1] == stat.st_mtime_ns and entry[2] == stat.st_size
+
+    def put(self, path, vector, stat):
+        """写入一行特征"""
+        with self.lock:
+            entry = self.rows.get(path)
+            if entry is not None:
+                row = entry[0]
+            elif self.free_rows:
+                row = self.free_rows.pop()
+                self.row_paths[row] = path
+            else:
+                row = len(self.row_paths)
+                if row >= self.capacity:
+                    self.open_matrix(self.capacity * 2)
+                self.row_paths.append(path)
+            self.matrix[row] = vector
+            self.rows[path] = [row, stat.st_mtime_ns, stat.st_size]
+            self.unit_matrix = None
+
+    def remove_paths(self, paths):
+        """删除歌曲的特征（行号留给之后的新歌曲复用），返回删除条数"""
+        removed = 0
+        with self.lock:
+            for path in paths:
+                entry = self.rows.pop(path, None)
+                if entry is None:
+                    continue
+                row = entry[0]
+                self.row_paths[row] = None
+                self.matrix[row] = 0.0
+                self.free_rows.append(row)
+                removed += 1
+            if removed:
+                self.unit_matrix = None
+                self.save()
+        return removed
+
+    def prune(self, keep_paths):
+        """删除不在 keep_paths 中的歌曲的特征（已从音乐库移除的文件）"""
+        keep = set(keep_paths)
+        with self.lock:
+            stale = [path for path in self.rows if path not in keep]
+        return self.remove_paths(stale)
+
+    def index_paths(self, paths, max_workers=None, progress_callback=None, should_stop=None):
+        """用进程池为尚未索引或已修改的文件提取特征，返回新增条数"""
+        pending = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not self.is_current(path, stat):
+                pending[path] = stat
+        if not pending or not AUDIO_FEATURES_ENABLED:
+            return 0
+        
+        logger.info(f"开始提取音频特征: {len(pending)} 首")
+        added = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(extract_feature_vector, path): path for path in pending}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                if should_stop and should_stop():
+                    for f in futures:
+                        f.cancel()
+                    break
+                path = futures[future]
+                vector = future.result()
+                if vector is not None and len(vector) == FEATURE_DIM:
+                    self.put(path, vector, pending[path])
+                    added += 1
+                if progress_callback:
+                    progress_callback(done, len(futures))
+        self.save()
+        return added
+
+    def vector_for(self, path):
+        """获取歌曲的特征向量，未索引时就地提取"""
+        with self.lock:
+            if self.is_current(path):
+                return np.array(self.matrix[self.rows[path][0]])
+        vector = extract_feature_vector(path)
+        if vector is None:
+            return None
+        try:
+            self.put(path, vector, os.stat(path))
+            self.save()
+        except OSError:
+            pass
+        return vector
+
+    def build_unit_matrix(self):
+        """按列标准化后单位化，使余弦相似度不被量纲大的特征主导"""
+        count = len(self.row_paths)
+        valid = np.array([p is not None for p in self.row_paths], dtype=bool)
+        data = np.asarray(self.matrix[:count])
+        mean = data[valid].mean(axis=0) if valid.any() else np.zeros(FEATURE_DIM, dtype=np.float32)
+        std = data[valid].std(axis=0) if valid.any() else np.ones(FEATURE_DIM, dtype=np.float32)
+        std[std == 0] = 1.0
+        unit = (data - mean) / std
+        norms = np.linalg.norm(unit, axis=1)
+        norms[norms == 0] = 1.0
+        unit /= norms[:, None]
+        unit[~valid] = 0.0
+        self.unit_matrix = (unit.astype(np.float32), mean, std)
+
+    def similar(self, vector, limit=10, exclude=None):
+        """一次矩阵向量乘积计算全部相似度，argpartition 取前 limit 个，返回 [(路径, 相似度)]"""
+        with self.lock:
+            if not self.row_paths:
+                return []
+            if self.unit_matrix is None:
+                self.build_unit_matrix()
+            unit, mean, std = self.unit_matrix
+            row_paths = self.row_paths
+        
+        query = (np.asarray(vector, dtype=np.float32) - mean) / std
+        query /= np.linalg.norm(query) or 1.0
+        scores = unit @ query
+        if exclude in self.rows:
+            scores[self.rows[exclude][0]] = -np.inf
+        
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(row_paths[i], float(scores[i])) for i in top if row_paths[i] is not None and np.isfinite(scores[i])]
+
+    def similar_to_path(self, path, limit=10):
+        """查找与指定歌曲相似的歌曲"""
+        vector = self.vector_for(path)
+        if vector is None:
+            return []
+        return self.similar(vector, limit, exclude=path)
+
+    def paths(self):
+        with self.lock:
+            return [p for p in self.row_paths if p is not None]
+
+
+_feature_index = None
+_feature_index_lock = threading.Lock()
+
+
+def get_feature_index():
+    """获取进程内共享的音频特征索引"""
+    global _feature_index
+    with _feature_index_lock:
+        if _feature_index is None:
+            _feature_index = AudioFeatureIndex(get_settings_store().get()["save_paths"]["cache"])
+        return _feature_index
+
+
+class FeatureIndexWorker(QThread):
+    """后台为整个音乐库批量提取音频特征（进程池，已是最新的歌曲跳过），并删除已移除歌曲的特征"""
+    index_finished = pyqtSignal(int, int)  # 新增, 删除
+
+    def run(self):
+        try:
+            paths = [row[0] for row in get_library_catalog().query("SELECT path FROM tracks")]
+            index = get_feature_index()
+            dropped = index.prune(paths)
+            # 留一半CPU给播放和界面
+            workers = max(1, (os.cpu_count() or 2) // 2)
+            added = index.index_paths(paths, max_workers=workers, should_stop=self.isInterruptionRequested)
+            self.index_finished.emit(added, dropped)
+        except Exception as e:
+            logger.error(f"音频特征索引失败: {str(e)}")
+
+
 class RecommendationEngine:
     def __init__(self):
         self.analyzer = UserBehaviorAnalyzer()
         self.feature_extractor = AudioFeatureExtractor()
+        self.feature_index = get_feature_index()
     
     def recommend_songs(self, user_id, current_song=None, limit=10):
         # 1. 基于用户偏好
-        preferences = self.analyzer.get_user_preferences(user_id)
+        try:
+            preferences = self.analyzer.get_user_preferences(user_id)
+        except sqlite3.Error as e:
+            logger.warning(f"读取用户偏好失败: {str(e)}")
+            preferences = []
         pref_recommendations = self.get_recommendations_by_preferences(preferences, limit//2)
         
         # 2. 基于当前歌曲
         context_recommendations = []
         if current_song:
-            current_features = self.feature_extractor.extract_features(current_song.path)
-            context_recommendations = self.get_similar_songs(current_features, limit//2)
+            context_recommendations = self.get_similar_songs(current_song, limit//2)
         
         # 3. 混合推荐结果
-        combined = list(set(pref_recommendations + context_recommendations))
+        combined = list(dict.fromkeys(pref_recommendations + context_recommendations))
         return combined[:limit]
     
     def get_recommendations_by_preferences(self, preferences, limit):
         # 根据用户偏好查询数据库
         # 实际实现应使用更复杂的算法
-        return random.sample(self.song_database, limit)
+        song_database = self.feature_index.paths()
+        return random.sample(song_database, min(limit, len(song_database)))
     
-    def get_similar_songs(self, features, limit):
-        # 使用余弦相似度查找相似歌曲
-        similarities = []
-        for song in self.song_database:
-            sim = cosine_similarity(features, song.features)
-            similarities.append((song, sim))
-        
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return [song for song, _ in similarities[:limit]]
+    def get_similar_songs(self, song_path, limit):
+        """基于特征索引查找相似歌曲（返回路径列表）"""
+        return [path for path, _ in self.feature_index.similar_to_path(song_path, limit)]
+
 
 class RecommendationTab(QWidget):
-    def __init__(self, parent):
+    """推荐列表：推荐结果是歌曲路径，显示的标题和艺术家取自音乐库目录"""
+    def __init__(self, parent, engine=None):
         super().__init__(parent)
+        self.main_window = parent
+        self.engine = engine or RecommendationEngine()
         self.layout = QVBoxLayout()
         
         # 推荐类型选择
@@ -3882,83 +5962,183 @@ class RecommendationTab(QWidget):
         self.setLayout(self.layout)
     
     def refresh_recommendations(self):
-        user_id = self.parent().current_user
-        recommendations = self.parent().recommend_engine.recommend_songs(user_id)
+        user_id = getattr(self.main_window, "current_user_id", None)
+        current_song = getattr(self.main_window, "current_song_path", None)
+        paths = self.engine.recommend_songs(user_id, current_song)
+        tracks = get_library_catalog().tracks_for_paths(paths)
         
         self.recommend_list.clear()
-        for song in recommendations:
-            item = QListWidgetItem(f"{song.name} - {song.artist}")
-            item.setData(Qt.UserRole, song)
+        for path in paths:
+            meta = tracks.get(path) or {}
+            title = meta.get("title") or os.path.splitext(os.path.basename(path))[0]
+            artist = meta.get("artist")
+            item = QListWidgetItem(f"{title} - {artist}" if artist else title)
+            item.setData(Qt.UserRole, path)
+            item.setToolTip(path)
             self.recommend_list.addItem(item)
     
     def play_recommended(self, item):
-        song = item.data(Qt.UserRole)
-        self.parent().play_song(song)
+        self.main_window.play_file_remote(item.data(Qt.UserRole))
 
-class SmartPlaylistManager:
+class SmartPlaylistManager(QObject):
     """智能播放列表管理器"""
+    playlist_updated = pyqtSignal(str)
+    tracks_changed = pyqtSignal(list, list, bool)  # 变化路径, 删除路径, 是否为播放记录变化
     
     class SmartPlaylist:
         """智能播放列表类"""
         def __init__(self, name, rules):
             self.name = name
-            self.rules = rules
+            self.rules = normalize_smart_rules(rules)
+            self.sql, self.params, self.fields = compile_smart_rules(self.rules)
+            self.where, self.where_params, _ = compile_smart_conditions(self.rules)
             self.songs = []
             self.last_updated = None
             
-        def update(self):
-            """根据规则更新播放列表"""
-            # 这里需要实现实际的查询逻辑
-            # 示例：从数据库查询符合条件的歌曲
-            query = "SELECT * FROM songs WHERE "
-            conditions = []
-            params = []
-            
-            for field, operator, value in self.rules:
-                if operator == "==":
-                    conditions.append(f"{field} = ?")
-                elif operator == ">":
-                    conditions.append(f"{field} > ?")
-                elif operator == "<":
-                    conditions.append(f"{field} < ?")
-                elif operator == "contains":
-                    conditions.append(f"{field} LIKE ?")
-                    value = f"%{value}%"
-                
-                params.append(value)
-            
-            query += " AND ".join(conditions)
-            # 实际应用中需要连接数据库执行查询
-            # self.songs = database.query(query, params)
-            self.last_updated = datetime.now()
+        def update(self, db=None):
+            """根据规则更新播放列表（一次参数化查询）"""
+            db = db or get_library_catalog()
+            self.songs = [row[0] for row in db.query(self.sql, self.params)]
+            self.last_updated = datetime.datetime.now()
+            return self.songs
+
+        def is_affected(self, history_changed):
+            """播放记录变化只影响引用了播放次数/最近播放的规则"""
+            return not history_changed or bool(self.fields & HISTORY_FIELDS)
+
+        def apply_changes(self, changed, removed, db=None, history_changed=False):
+            """增量重算：只对变化的歌曲求值；有数量限制或排序时才整体重查。返回是否有变化"""
+            if not self.is_affected(history_changed) or (not changed and not removed):
+                return False
+            db = db or get_library_catalog()
+            if self.rules["limit"] or self.rules["sort"] or self.last_updated is None:
+                before = self.songs
+                return self.update(db) != before
+            
+            removed = set(removed)
+            matched = set()
+            changed = list(changed)
+            for i in range(0, len(changed), 500):
+                batch = changed[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                matched.update(row[0] for row in db.query(
+                    f"SELECT tracks.path FROM tracks WHERE tracks.path IN ({placeholders}) AND ({self.where})",
+                    batch + self.where_params
+                ))
+            stale = removed | (set(changed) - matched)
+            songs = [path for path in self.songs if path not in stale]
+            present = set(songs)
+            songs.extend(sorted(path for path in matched if path not in present))
+            if songs == self.songs:
+                return False
+            self.songs = songs
+            self.last_updated = datetime.datetime.now()
+            return True
     
-    def __init__(self):
+    def __init__(self, parent=None):
+        super().__init__(parent)
         self.playlists = {}
         self.current_playlist = None
-        self.playlist_file = "playlists.json"
+        self.playlist_file = os.path.join(os.path.dirname(get_settings_path()), "smart_playlists.json")
         # 创建数据库连接
         self.db = self.create_database_connection()
         self.load_playlists()
         
     def create_database_connection(self):
-        """创建数据库连接"""
-        # 这里简化实现，实际应使用SQLite或其它数据库
-        return {
-            "query": lambda sql, params: []
-        }
+        """创建数据库连接（使用音乐库目录）"""
+        return get_library_catalog()
+
+    def load_playlists(self):
+        """加载保存的规则集，歌曲列表按需从目录计算"""
+        if not os.path.exists(self.playlist_file):
+            return
+        try:
+            with open(self.playlist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for name, rules in data.items():
+                try:
+                    self.playlists[name] = self.SmartPlaylist(name, rules)
+                except ValueError as e:
+                    logger.warning(f"忽略无效的智能播放列表 {name}: {str(e)}")
+        except Exception as e:
+            logger.error(f"加载智能播放列表失败: {str(e)}")
+
+    def save_playlists(self):
+        data = {name: playlist.rules for name, playlist in self.playlists.items()}
+        tmp_path = self.playlist_file + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.playlist_file)
+        except Exception as e:
+            logger.error(f"保存智能播放列表失败: {str(e)}")
         
     def create_smart_playlist(self, name, rules):
         """创建智能播放列表"""
         playlist = self.SmartPlaylist(name, rules)
+        playlist.update(self.db)
         self.playlists[name] = playlist
         self.save_playlists()
         return playlist
 
+    def create_temp_smart_playlist(self, name, rules):
+        """创建不保存的智能播放列表（用于预览）"""
+        return self.SmartPlaylist(name, rules)
+
+    def get_songs(self, name):
+        playlist = self.playlists.get(name)
+        if playlist is None:
+            return []
+        if playlist.last_updated is None:
+            playlist.update(self.db)
+        return playlist.songs
+
+    def handle_library_changed(self, added, updated, removed):
+        """音乐库变化时只重算受影响的智能播放列表"""
+        self.apply_changes(list(added) + list(updated), list(removed), False)
+
+    def record_play(self, path):
+        """记录播放并刷新依赖播放记录的智能播放列表"""
+        self.db.record_play(path)
+        self.apply_changes([path], [], True)
+
+    def apply_changes(self, changed, removed, history_changed):
+        for name, playlist in self.playlists.items():
+            if playlist.last_updated is not None and playlist.apply_changes(
+                changed, removed, self.db, history_changed
+            ):
+                self.playlist_updated.emit(name)
+        self.tracks_changed.emit(changed, removed, history_changed)
+
+
+_smart_playlist_manager = None
+
+
+def get_smart_playlist_manager():
+    """获取进程内共享的智能播放列表管理器"""
+    global _smart_playlist_manager
+    if _smart_playlist_manager is None:
+        _smart_playlist_manager = SmartPlaylistManager()
+    return _smart_playlist_manager
+
+
 class AdvancedPlaylistDialog(QDialog):
+    PREVIEW_DIFF_LIMIT = 200  # 增删行数超过此值时整体重建预览列表
+
     def __init__(self, playlist_manager):
         super().__init__()
         self.setWindowTitle("高级播放列表管理")
         self.setMinimumSize(800, 600)
+        self.playlist_manager = playlist_manager
+        self.smart_manager = get_smart_playlist_manager()
+        self.preview_playlist = None
+        
+        # 规则编辑防抖，停止输入后再刷新预览
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(250)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.smart_manager.tracks_changed.connect(self.apply_preview_changes)
         
         layout = QVBoxLayout()
         
@@ -4022,7 +6202,39 @@ class AdvancedPlaylistDialog(QDialog):
         self.add_rule_btn.clicked.connect(self.add_rule_row)
         layout.addWidget(self.add_rule_btn)
         
+        # 排序与数量限制
+        options_row = QHBoxLayout()
+        options_row.addWidget(QLabel("匹配:"))
+        self.match_combo = QComboBox()
+        self.match_combo.addItem("全部规则", "all")
+        self.match_combo.addItem("任一规则", "any")
+        options_row.addWidget(self.match_combo)
+        options_row.addWidget(QLabel("排序:"))
+        self.sort_combo = QComboBox()
+        for label, key in [("无", None), ("标题", "title"), ("艺术家", "artist"), ("专辑", "album"),
+                           ("年份", "year"), ("时长", "duration"), ("添加时间", "added"),
+                           ("播放次数", "play_count"), ("随机", "random")]:
+            self.sort_combo.addItem(label, key)
+        options_row.addWidget(self.sort_combo)
+        self.descending_check = QCheckBox("降序")
+        options_row.addWidget(self.descending_check)
+        options_row.addWidget(QLabel("数量上限:"))
+        self.limit_spin = QSpinBox()
+        self.limit_spin.setRange(0, 10000)
+        self.limit_spin.setSpecialValueText("不限")
+        options_row.addWidget(self.limit_spin)
+        self.save_smart_btn = QPushButton("保存为智能列表")
+        self.save_smart_btn.clicked.connect(self.save_smart_playlist)
+        options_row.addWidget(self.save_smart_btn)
+        layout.addLayout(options_row)
+        for signal in (self.match_combo.currentIndexChanged, self.sort_combo.currentIndexChanged,
+                       self.limit_spin.valueChanged):
+            signal.connect(self.schedule_preview)
+        self.descending_check.toggled.connect(self.schedule_preview)
+        
         # 智能列表预览
+        self.preview_status = QLabel("")
+        layout.addWidget(self.preview_status)
         self.preview_list = QListWidget()
         layout.addWidget(self.preview_list)
         
@@ -4035,22 +6247,26 @@ class AdvancedPlaylistDialog(QDialog):
         
         # 字段下拉框
         field_combo = QComboBox()
-        field_combo.addItems(["风格", "艺术家", "专辑", "年份", "播放次数", "评分"])
+        field_combo.addItems(list(SMART_FIELD_ALIASES))
         self.rules_table.setCellWidget(row, 0, field_combo)
         
         # 运算符下拉框
         op_combo = QComboBox()
-        op_combo.addItems(["==", "!=", ">", "<", "包含", "不包含"])
+        op_combo.addItems(["==", "!=", ">", "<", ">=", "<=", "包含", "不包含"])
         self.rules_table.setCellWidget(row, 1, op_combo)
         
         # 值输入框
         value_edit = QLineEdit()
         self.rules_table.setCellWidget(row, 2, value_edit)
         
-        # 删除按钮
+        # 删除按钮（按按钮当前所在行删除，避免删除其它行后行号错位）
         del_btn = QPushButton("删除")
-        del_btn.clicked.connect(lambda: self.delete_rule_row(row))
+        del_btn.clicked.connect(lambda: self.delete_rule_row(self.rules_table.indexAt(del_btn.pos()).row()))
         self.rules_table.setCellWidget(row, 3, del_btn)
+        
+        field_combo.currentIndexChanged.connect(self.schedule_preview)
+        op_combo.currentIndexChanged.connect(self.schedule_preview)
+        value_edit.textChanged.connect(self.schedule_preview)
 
     def on_playlist_double_clicked(self, item, column):
         """处理播放列表树的双击事件"""
@@ -4159,27 +6375,108 @@ class AdvancedPlaylistDialog(QDialog):
             path_edit.setText(file_path)
     
     def delete_rule_row(self, row):
-        self.rules_table.removeRow(row)
+        if row >= 0:
+            self.rules_table.removeRow(row)
+            self.schedule_preview()
     
-    def update_preview(self):
-        """根据当前规则更新预览列表"""
+    def schedule_preview(self, *args):
+        self.preview_timer.start()
+    
+    def current_rules(self):
+        """从界面收集规则集（值为空的规则忽略）"""
         rules = []
         for row in range(self.rules_table.rowCount()):
             field = self.rules_table.cellWidget(row, 0).currentText()
             op = self.rules_table.cellWidget(row, 1).currentText()
-            value = self.rules_table.cellWidget(row, 2).text()
-            rules.append((field, op, value))
-        
-        playlist = self.playlist_manager.create_temp_smart_playlist("预览", rules)
-        playlist.update()
+            value = self.rules_table.cellWidget(row, 2).text().strip()
+            if value:
+                rules.append((field, op, value))
+        return {
+            "match": self.match_combo.currentData(),
+            "rules": rules,
+            "sort": self.sort_combo.currentData(),
+            "descending": self.descending_check.isChecked(),
+            "limit": self.limit_spin.value(),
+        }
+    
+    def update_preview(self):
+        """根据当前规则更新预览列表"""
+        try:
+            playlist = self.smart_manager.create_temp_smart_playlist("预览", self.current_rules())
+            playlist.update()
+        except ValueError as e:
+            self.preview_status.setText(f"规则无效: {str(e)}")
+            return
         
-        self.preview_list.clear()
-        for song in playlist.songs:
-            self.preview_list.addItem(f"{song.name} - {song.artist}")
+        self.preview_playlist = playlist
+        self.show_preview(playlist.songs)
+    
+    def apply_preview_changes(self, changed, removed, history_changed):
+        """音乐库或播放记录变化时增量刷新预览，无需整体重查"""
+        if self.preview_playlist and self.preview_playlist.apply_changes(
+            changed, removed, history_changed=history_changed
+        ):
+            self.show_preview(self.preview_playlist.songs)
+    
+    def show_preview(self, songs):
+        """更新预览列表：保留行的顺序不变且变化不多时只增删变化的行，
+        否则（排序变化、随机排序、大量增删）按新顺序一次重建"""
+        current = [self.preview_list.item(row).data(Qt.UserRole) for row in range(self.preview_list.count())]
+        present = set(current)
+        wanted = set(songs)
+        kept = [path for path in current if path in wanted]
+        new_paths = [path for path in songs if path not in present]
+        changes = len(current) - len(kept) + len(new_paths)
+        incremental = changes <= self.PREVIEW_DIFF_LIMIT and kept == [path for path in songs if path in present]
+        tracks = get_library_catalog().tracks_for_paths(new_paths if incremental else songs)
+        
+        if incremental:
+            for row in reversed(range(len(current))):
+                if current[row] not in wanted:
+                    self.preview_list.takeItem(row)
+            # 按目标位置从前往后插入新行，插入后前面的行已与结果一致
+            for row, path in enumerate(songs):
+                if path not in present:
+                    self.preview_list.insertItem(row, self.preview_item(path, tracks.get(path, {})))
+        else:
+            self.preview_list.setUpdatesEnabled(False)
+            self.preview_list.clear()
+            for path in songs:
+                self.preview_list.addItem(self.preview_item(path, tracks.get(path, {})))
+            self.preview_list.setUpdatesEnabled(True)
+        self.preview_status.setText(f"匹配 {len(songs)} 首")
+    
+    @staticmethod
+    def preview_item(path, track):
+        title = track.get("title") or os.path.splitext(os.path.basename(path))[0]
+        item = QListWidgetItem(f"{title} - {track['artist']}" if track.get("artist") else title)
+        item.setData(Qt.UserRole, path)
+        return item
+    
+    def save_smart_playlist(self):
+        """把当前规则保存为智能播放列表"""
+        name, ok = QInputDialog.getText(self, "保存智能列表", "播放列表名称:")
+        if not ok or not name.strip():
+            return
+        try:
+            playlist = self.smart_manager.create_smart_playlist(name.strip(), self.current_rules())
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", f"规则无效: {str(e)}")
+            return
+        QMessageBox.information(self, "成功", f"智能播放列表“{playlist.name}”已保存，共 {len(playlist.songs)} 首")
 
 # =============== 音乐室功能实现 ===============
 class MusicRoomManager:
     """音乐室管理器"""
+    TIME_SYNC_BURST = 5             # 连接后快速采样的次数
+    TIME_SYNC_BURST_MS = 200
+    TIME_SYNC_INTERVAL_MS = 10000
+    DRIFT_CHECK_MS = 500
+    SYNC_DEADBAND_MS = 25           # 误差小于此值不修正
+    HARD_SEEK_MS = 400              # 误差超过此值直接跳转
+    MAX_RATE_NUDGE = 0.05           # 播放速率微调上限 ±5%
+    NUDGE_HORIZON_MS = 2000         # 计划在这段时间内用变速消除误差
+
     def __init__(self, parent):
         self.parent = parent
         self.current_room = None
@@ -4187,7 +6484,25 @@ class MusicRoomManager:
         self.websocket = None
         self.connected = False
         self.room_list = []
+        self.room_list_version = None  # 本地房间目录对应的服务器版本，None 表示未订阅
+        self.room_list_resyncing = False  # 已请求完整快照，收到之前丢弃增量事件
+        self.encoding = "json"         # 与服务器协商的线路编码，收到 hello 之前用 JSON
         self.user_list = []
+        # 时钟同步：保留最近的 (往返时间, 偏移) 样本，取往返时间最短的一个
+        self.clock_samples = deque(maxlen=8)
+        self.clock_offset = None  # 服务器时钟 - 本地时钟（毫秒）
+        self.clock_rtt = None
+        self.time_sync_burst = 0
+        self.time_sync_timer = QTimer(parent)
+        self.time_sync_timer.timeout.connect(self.send_time_sync)
+        # 房间的权威播放状态和漂移修正
+        self.room_state = None
+        self.applying_remote_state = False  # 正在应用房间状态/远程命令，期间本地播放器的变化不发回服务器
+        self.sync_error = None
+        self.drift_timer = QTimer(parent)
+        self.drift_timer.setInterval(self.DRIFT_CHECK_MS)
+        self.drift_timer.timeout.connect(self.correct_drift)
+        parent.media_player.currentMediaChanged.connect(self.on_local_media_changed)
         
     def connect_to_server(self):
         """连接到音乐室服务器"""
@@ -4205,7 +6520,9 @@ class MusicRoomManager:
                 self.websocket = QWebSocket()
                 
             self.websocket.connected.connect(self.on_connected)
-            # ...其他连接设置
+            self.websocket.disconnected.connect(self.on_disconnected)
+            self.websocket.textMessageReceived.connect(self.on_message_received)
+            self.websocket.binaryMessageReceived.connect(self.on_binary_message_received)
             self.websocket.open(QUrl(self.server_url))
             return True
         except Exception as e:
@@ -4222,13 +6539,25 @@ class MusicRoomManager:
         user_id = self.parent.settings.get("user_id", "anonymous")
         message = {
             "type": "auth",
-            "user_id": user_id
+            "user_id": user_id,
+            "encodings": RoomWireProtocol.supported_encodings()
         }
-        self.send_message(json.dumps(message))
+        self.send_message(message)
+        
+        # 先快速采样几次估计时钟偏移，之后定期校准
+        self.clock_samples.clear()
+        self.time_sync_burst = self.TIME_SYNC_BURST
+        self.time_sync_timer.start(self.TIME_SYNC_BURST_MS)
+        self.send_time_sync()
     
     def on_disconnected(self):
         """连接断开回调"""
         self.connected = False
+        self.room_list_version = None
+        self.room_list_resyncing = False
+        self.encoding = "json"
+        self.time_sync_timer.stop()
+        self.clear_room_state()
         logger.warning("与音乐室服务器的连接已断开")
         self.parent.status_bar.showMessage("音乐室连接已断开")
     
@@ -4238,77 +6567,259 @@ class MusicRoomManager:
         self.parent.status_bar.showMessage(f"音乐室错误: {str(error)}")
     
     def on_message_received(self, message):
-        """处理接收到的消息"""
+        """处理接收到的文本消息（JSON）"""
         try:
-            data = json.loads(message)
-            message_type = data.get("type")
-            
-            if message_type == "room_list":
-                self.room_list = data.get("rooms", [])
-                self.parent.update_room_list(self.room_list)
-                
-            elif message_type == "user_list":
-                self.user_list = data.get("users", [])
-                self.parent.update_user_list(self.user_list)
-                
-            elif message_type == "room_update":
-                self.handle_room_update(data)
-                
-            elif message_type == "chat":
-                self.parent.add_chat_message(
-                    data.get("user_id", "未知用户"),
-                    data.get("message", ""),
-                    data.get("timestamp", int(time.time()))
-                )
-                
-            elif message_type == "playback":
-                self.handle_playback_command(data)
-                
-            elif message_type == "error":
-                logger.error(f"音乐室错误: {data.get('message', '未知错误')}")
-                self.parent.status_bar.showMessage(f"音乐室错误: {data.get('message', '未知错误')}")
-                
+            self.handle_message(json.loads(message))
         except Exception as e:
             logger.error(f"处理音乐室消息失败: {str(e)}")
     
-    def handle_room_update(self, data):
-        """处理房间更新"""
-        room_id = data.get("room_id")
-        action = data.get("action")
+    def on_binary_message_received(self, frame):
+        """处理接收到的二进制帧（一帧可能包含多条消息）"""
+        try:
+            messages = RoomWireProtocol.decode_frame(bytes(frame))
+        except Exception as e:
+            logger.error(f"解码音乐室消息失败: {str(e)}")
+            return
+        for data in messages:
+            try:
+                self.handle_message(data)
+            except Exception as e:
+                logger.error(f"处理音乐室消息失败: {str(e)}")
+    
+    def handle_message(self, data):
+        """处理一条消息"""
+        message_type = data.get("type")
         
-        if action == "created":
-            self.room_list.append({
-                "id": room_id,
-                "name": data.get("name", "未命名房间"),
-                "owner": data.get("owner", "未知"),
-                "users": data.get("users", [])
-            })
-            self.parent.update_room_list(self.room_list)
+        if message_type == "hello":
+            # 服务器选定的编码，之后双方都用它收发
+            self.encoding = data.get("encoding", "json")
             
-        elif action == "closed":
-            self.room_list = [r for r in self.room_list if r["id"] != room_id]
+        elif message_type == "room_list":
+            # 完整快照：连接、订阅或重新同步时收到
+            self.room_list = data.get("rooms", [])
+            self.room_list_version = data.get("version")
+            self.room_list_resyncing = False
             self.parent.update_room_list(self.room_list)
             
+        elif message_type in ("room_added", "room_removed", "member_count_changed"):
+            self.apply_room_delta(data)
+            
+        elif message_type == "user_list":
+            self.user_list = data.get("users", [])
+            self.parent.update_user_list(self.user_list)
+            
+        elif message_type == "room_update":
+            self.handle_room_update(data)
+            
+        elif message_type == "chat":
+            self.parent.add_chat_message(
+                data.get("user_id", "未知用户"),
+                data.get("message", ""),
+                data.get("timestamp", int(time.time()))
+            )
+            
+        elif message_type == "playback":
+            self.handle_playback_command(data)
+            
+        elif message_type == "playback_state":
+            self.apply_playback_state(data)
+            
+        elif message_type == "time_sync":
+            self.handle_time_sync(data)
+            
+        elif message_type == "error":
+            logger.error(f"音乐室错误: {data.get('message', '未知错误')}")
+            self.parent.status_bar.showMessage(f"音乐室错误: {data.get('message', '未知错误')}")
+    
+    def apply_room_delta(self, data):
+        """把房间目录的增量事件应用到本地 room_list，版本不连续时请求一次完整快照"""
+        if self.room_list_version is None or self.room_list_resyncing:
+            return
+        version = data.get("version")
+        if version != self.room_list_version + 1:
+            logger.info(f"房间目录版本不连续（本地 {self.room_list_version}，收到 {version}），重新同步")
+            self.room_list_resyncing = True
+            self.request_room_list()
+            return
+        self.room_list_version = version
+        
+        message_type = data.get("type")
+        if message_type == "room_added":
+            room = data.get("room", {})
+            self.room_list = [r for r in self.room_list if r["id"] != room.get("id")]
+            self.room_list.append(room)
+        elif message_type == "room_removed":
+            self.room_list = [r for r in self.room_list if r["id"] != data.get("room_id")]
+        elif message_type == "member_count_changed":
+            for room in self.room_list:
+                if room["id"] == data.get("room_id"):
+                    room["member_count"] = data.get("member_count", 0)
+                    break
+        self.parent.update_room_list(self.room_list)
+    
+    def request_room_list(self):
+        """订阅房间目录并请求完整快照"""
+        self.send_message({"type": "subscribe_rooms"})
+    
+    def unsubscribe_room_list(self):
+        """不再浏览房间列表时退订目录更新"""
+        if self.room_list_version is None:
+            return
+        self.room_list_version = None
+        self.room_list_resyncing = False
+        self.send_message({"type": "unsubscribe_rooms"})
+    
+    def handle_room_update(self, data):
+        """处理所在房间的更新（房间目录的变化由增量事件处理）"""
+        room_id = data.get("room_id")
+        action = data.get("action")
+        
+        if action == "closed":
             # 如果当前房间关闭
             if self.current_room and self.current_room["id"] == room_id:
                 self.current_room = None
+                self.clear_room_state()
                 self.parent.leave_room()
                 
-        elif action == "user_joined":
-            for room in self.room_list:
-                if room["id"] == room_id:
-                    if data["user_id"] not in room["users"]:
-                        room["users"].append(data["user_id"])
-                    self.parent.update_room_list(self.room_list)
-                    break
-                    
-        elif action == "user_left":
-            for room in self.room_list:
-                if room["id"] == room_id:
-                    if data["user_id"] in room["users"]:
-                        room["users"].remove(data["user_id"])
-                    self.parent.update_room_list(self.room_list)
-                    break
+        elif action in ("user_joined", "user_left"):
+            if self.current_room and self.current_room["id"] == room_id:
+                self.current_room["users"] = data.get("users", [])
+                self.parent.update_user_list(self.current_room["users"])
+    
+    @staticmethod
+    def local_ms():
+        return time.monotonic() * 1000
+    
+    def server_now(self):
+        """按估计的偏移换算出的服务器时间（毫秒）"""
+        return self.local_ms() + (self.clock_offset or 0)
+    
+    def send_time_sync(self):
+        if not self.connected:
+            return
+        self.send_message({"type": "time_sync", "t0": self.local_ms()})
+        if self.time_sync_burst > 0:
+            self.time_sync_burst -= 1
+            if self.time_sync_burst == 0:
+                self.time_sync_timer.setInterval(self.TIME_SYNC_INTERVAL_MS)
+    
+    def handle_time_sync(self, data):
+        """NTP 式估计：offset = ((t1 - t0) + (t2 - t3)) / 2，rtt = (t3 - t0) - (t2 - t1)"""
+        t3 = self.local_ms()
+        t0, t1, t2 = data.get("t0"), data.get("t1"), data.get("t2")
+        if t0 is None or t1 is None or t2 is None:
+            return
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.clock_samples.append((rtt, offset))
+        # 往返时间最短的样本受排队延迟影响最小，偏移最可信
+        self.clock_rtt, self.clock_offset = min(self.clock_samples)
+    
+    def expected_position(self):
+        """按房间状态推算此刻应处的播放位置（毫秒）"""
+        state = self.room_state
+        elapsed = max(0, self.server_now() - state["server_time"])
+        return state["position"] + elapsed * state.get("rate", 1.0)
+    
+    def load_room_song(self, song_path):
+        """载入房间正在播放的歌曲（不加入播放列表），歌词在媒体加载完成后自动载入"""
+        self.parent.current_song_path = song_path
+        self.parent.media_player.setMedia(QMediaContent(QUrl.fromLocalFile(song_path)))
+    
+    def apply_playback_state(self, data):
+        """应用服务器下发的权威播放状态"""
+        if not self.current_room or self.current_room["id"] != data.get("room_id"):
+            return
+        if self.room_state and data.get("version", 0) <= self.room_state.get("version", 0):
+            return
+        self.room_state = data
+        self.applying_remote_state = True
+        try:
+            player = self.parent.media_player
+            
+            song_path = data.get("song_path")
+            if song_path and song_path != self.parent.current_song_path:
+                if not os.path.exists(song_path):
+                    self.parent.status_bar.showMessage(f"房间正在播放的歌曲在本机不存在: {os.path.basename(song_path)}")
+                    return
+                self.load_room_song(song_path)
+            
+            if data.get("state") == "playing":
+                if player.state() != QMediaPlayer.PlayingState:
+                    player.setPosition(int(self.expected_position()))
+                    player.play()
+                self.drift_timer.start()
+                self.correct_drift()
+            else:
+                self.drift_timer.stop()
+                player.setPlaybackRate(data.get("rate", 1.0))
+                if data.get("state") == "paused":
+                    player.pause()
+                    player.setPosition(int(data.get("position", 0)))
+                else:
+                    player.stop()
+        finally:
+            self.applying_remote_state = False
+    
+    def correct_drift(self):
+        """比较本地播放位置和房间状态：小误差用播放速率微调追赶，大误差才跳转"""
+        state = self.room_state
+        player = self.parent.media_player
+        if (not state or state.get("state") != "playing" or self.clock_offset is None
+                or player.state() != QMediaPlayer.PlayingState):
+            return
+        expected = self.expected_position()
+        if 0 < player.duration() <= expected:
+            return
+        error = player.position() - expected  # 正数表示本地超前
+        base_rate = state.get("rate", 1.0)
+        
+        if abs(error) > self.HARD_SEEK_MS:
+            player.setPosition(int(expected))
+            rate = base_rate
+        elif abs(error) > self.SYNC_DEADBAND_MS:
+            nudge = max(-self.MAX_RATE_NUDGE, min(self.MAX_RATE_NUDGE, -error / self.NUDGE_HORIZON_MS))
+            rate = base_rate * (1 + nudge)
+        else:
+            rate = base_rate
+        if abs(player.playbackRate() - rate) > 1e-3:
+            player.setPlaybackRate(rate)
+        
+        self.sync_error = error
+        self.parent.update_room_sync_status(error, self.clock_rtt)
+    
+    def clear_room_state(self):
+        """离开房间或断线：停止修正并恢复正常速率"""
+        self.drift_timer.stop()
+        if self.room_state:
+            self.parent.media_player.setPlaybackRate(self.parent.speed_control.current_speed)
+        self.room_state = None
+        self.sync_error = None
+    
+    def on_local_state_changed(self, state):
+        """本地播放器状态变化：只把用户操作引起的变化发给房间"""
+        if not self.current_room or self.applying_remote_state:
+            return
+        if state == QMediaPlayer.PlayingState:
+            self.send_playback_command("play")
+        elif state == QMediaPlayer.PausedState:
+            self.send_playback_command("pause")
+        elif state == QMediaPlayer.StoppedState:
+            # 切歌时 setMedia 会先停止播放器再开始播放，事件循环处理完后仍处于停止状态才算真正停止
+            QTimer.singleShot(0, self.confirm_local_stop)
+    
+    def confirm_local_stop(self):
+        if self.parent.media_player.state() == QMediaPlayer.StoppedState:
+            self.send_playback_command("stop")
+    
+    def on_local_media_changed(self, media):
+        """在房间中切换到别的歌曲时通知房间"""
+        file_path = media.canonicalUrl().toLocalFile()
+        if not self.current_room or not file_path:
+            return
+        if self.room_state and self.room_state.get("song_path") == file_path:
+            return  # 正是房间状态要求载入的歌曲
+        self.send_playback_command("load_song", song_path=file_path)
     
     def handle_playback_command(self, data):
         """处理播放控制命令"""
@@ -4321,31 +6832,39 @@ class MusicRoomManager:
         if user_id == self.parent.settings.get("user_id"):
             return  # 忽略自己发送的命令
             
-        if command == "play":
-            self.parent.media_player.play()
-        elif command == "pause":
-            self.parent.media_player.pause()
-        elif command == "stop":
-            self.parent.media_player.stop()
-        elif command == "next":
-            self.parent.play_next()
-        elif command == "prev":
-            self.parent.play_previous()
-        elif command == "seek":
-            position = data.get("position", 0)
-            self.parent.media_player.setPosition(position)
-        elif command == "volume":
-            volume = data.get("volume", 50)
-            self.parent.media_player.setVolume(volume)
-        elif command == "load_song":
-            song_path = data.get("song_path")
-            if song_path and os.path.exists(song_path):
-                self.parent.play_file(song_path)
+        self.applying_remote_state = True
+        try:
+            if command == "play":
+                self.parent.media_player.play()
+            elif command == "pause":
+                self.parent.media_player.pause()
+            elif command == "stop":
+                self.parent.media_player.stop()
+            elif command == "next":
+                self.parent.play_next()
+            elif command == "prev":
+                self.parent.play_previous()
+            elif command == "seek":
+                position = data.get("position", 0)
+                self.parent.media_player.setPosition(position)
+            elif command == "volume":
+                volume = data.get("volume", 50)
+                self.parent.media_player.setVolume(volume)
+            elif command == "load_song":
+                song_path = data.get("song_path")
+                if song_path and os.path.exists(song_path):
+                    self.load_room_song(song_path)
+                    self.parent.media_player.play()
+        finally:
+            self.applying_remote_state = False
     
     def send_message(self, message):
-        """发送消息到服务器"""
+        """按协商的编码发送消息到服务器"""
         if self.connected and self.websocket:
-            self.websocket.sendTextMessage(message)
+            if self.encoding == "msgpack":
+                self.websocket.sendBinaryMessage(QByteArray(RoomWireProtocol.encode_frame([message])))
+            else:
+                self.websocket.sendTextMessage(json.dumps(message))
     
     def create_room(self, room_name):
         """创建听歌房"""
@@ -4357,7 +6876,7 @@ class MusicRoomManager:
             "name": room_name,
             "user_id": self.parent.settings.get("user_id", "anonymous")
         }
-        self.send_message(json.dumps(message))
+        self.send_message(message)
         return True
     
     def join_room(self, room_id):
@@ -4375,10 +6894,11 @@ class MusicRoomManager:
             "room_id": room_id,
             "user_id": self.parent.settings.get("user_id", "anonymous")
         }
-        self.send_message(json.dumps(message))
+        self.send_message(message)
         
-        # 更新当前房间
-        self.current_room = room
+        # 更新当前房间（目录条目只有人数，成员列表由 room_update 填充）
+        self.clear_room_state()
+        self.current_room = dict(room, users=[])
         return True
     
     def leave_room(self):
@@ -4391,9 +6911,10 @@ class MusicRoomManager:
             "room_id": self.current_room["id"],
             "user_id": self.parent.settings.get("user_id", "anonymous")
         }
-        self.send_message(json.dumps(message))
+        self.send_message(message)
         
         self.current_room = None
+        self.clear_room_state()
         return True
     
     def send_chat_message(self, message):
@@ -4408,13 +6929,23 @@ class MusicRoomManager:
             "message": message,
             "timestamp": int(time.time())
         }
-        self.send_message(json.dumps(msg_data))
+        self.send_message(msg_data)
         return True
     
     def send_playback_command(self, command, **kwargs):
         """发送播放控制命令"""
-        if not self.connected or not self.current_room:
+        if not self.connected or not self.current_room or self.applying_remote_state:
             return False
+        
+        target_state = {"play": "playing", "pause": "paused", "stop": "stopped"}.get(command)
+        if target_state and self.room_state and self.room_state.get("state") == target_state:
+            return False  # 房间已处于该状态（通常是应用远程状态引起的本地状态变化）
+        if command in ("play", "pause", "seek"):
+            # 附上采样位置及对应的服务器时间，服务器据此确定权威状态
+            kwargs.setdefault("position", self.parent.media_player.position())
+            kwargs.setdefault("rate", self.parent.speed_control.current_speed)
+            if self.clock_offset is not None:
+                kwargs.setdefault("at", self.server_now())
             
         msg_data = {
             "type": "playback",
@@ -4423,7 +6954,7 @@ class MusicRoomManager:
             "command": command
         }
         msg_data.update(kwargs)
-        self.send_message(json.dumps(msg_data))
+        self.send_message(msg_data)
         return True
 
 
@@ -4479,6 +7010,9 @@ class MusicRoomDialog(QDialog):
         self.room_name_label = QLabel("未加入房间")
         room_info_layout.addWidget(self.room_name_label)
         
+        self.sync_label = QLabel("同步误差: --")
+        room_info_layout.addWidget(self.sync_label)
+        
         self.user_list = QListWidget()
         room_info_layout.addWidget(self.user_list)
         
@@ -4568,7 +7102,7 @@ class MusicRoomDialog(QDialog):
         """更新房间列表"""
         self.room_list.clear()
         for room in rooms:
-            item = QListWidgetItem(f"{room['name']} (用户数: {len(room['users'])})")
+            item = QListWidgetItem(f"{room['name']} (用户数: {room.get('member_count', len(room.get('users', [])))})")
             item.setData(Qt.UserRole, room["id"])
             self.room_list.addItem(item)
         if hasattr(self, 'music_room_dialog') and self.music_room_dialog:
@@ -4577,8 +7111,25 @@ class MusicRoomDialog(QDialog):
     
     def update_user_list(self, users):
         """更新用户列表"""
-        if hasattr(self, 'music_room_dialog') and self.music_room_dialog:
-            self.music_room_dialog.update_user_list(users)
+        self.user_list.clear()
+        for user in users:
+            self.user_list.addItem(user)
+    
+    def update_sync_status(self, error_ms, rtt_ms):
+        """显示与房间播放状态的同步误差和到服务器的往返时间"""
+        rtt_text = f"{rtt_ms:.0f} ms" if rtt_ms is not None else "--"
+        self.sync_label.setText(f"同步误差: {error_ms:+.0f} ms（往返 {rtt_text}）")
+    
+    def showEvent(self, event):
+        """重新打开时订阅房间目录（收到完整快照）"""
+        if self.room_manager.connected and self.room_manager.room_list_version is None:
+            self.room_manager.request_room_list()
+        super().showEvent(event)
+    
+    def hideEvent(self, event):
+        """不再浏览房间列表时退订目录更新"""
+        self.room_manager.unsubscribe_room_list()
+        super().hideEvent(event)
     
     def add_chat_message(self, user_id, message, timestamp):
         """添加聊天消息"""
@@ -4588,10 +7139,7 @@ class MusicRoomDialog(QDialog):
     def refresh_room_list(self):
         """刷新房间列表"""
         if self.room_manager.connected:
-            message = {
-                "type": "request_room_list"
-            }
-            self.room_manager.send_message(json.dumps(message))
+            self.room_manager.request_room_list()
     
     def create_room(self):
         """创建新房间"""
@@ -4621,7 +7169,7 @@ class MusicRoomDialog(QDialog):
                 self.leave_btn.setEnabled(True)
                 # 更新用户列表
                 self.user_list.clear()
-                for user in self.current_room["users"]:
+                for user in self.current_room.get("users", []):
                     self.user_list.addItem(user)
     
     def leave_room(self):
@@ -4629,6 +7177,7 @@ class MusicRoomDialog(QDialog):
         if self.room_manager.leave_room():
             self.current_room = None
             self.room_name_label.setText("未加入房间")
+            self.sync_label.setText("同步误差: --")
             self.leave_btn.setEnabled(False)
             self.user_list.clear()
     
@@ -4704,6 +7253,8 @@ class SyncServer(QThread):
         self.port = port
         self.running = False
         self.clients = {}
+        self.client_encodings = {}  # client_id -> 该客户端能解码的编码（收到 hello 之前用 JSON）
+        self.send_locks = {}  # client_id -> 锁：各客户端线程都会广播，同一客户端的帧不能交错
         self.server_socket = None
     
     def run(self):
@@ -4739,12 +7290,14 @@ class SyncServer(QThread):
         """处理客户端连接"""
         try:
             client_id = f"client_{len(self.clients) + 1}"
+            self.send_locks[client_id] = threading.Lock()
             self.clients[client_id] = client_socket
             
-            # 通知客户端连接成功
+            # 通知客户端连接成功，并列出服务器支持的编码
             self.send_to_client(client_id, {
                 'type': 'connected',
-                'client_id': client_id
+                'client_id': client_id,
+                'encodings': RoomWireProtocol.supported_encodings()
             })
             
             # 广播新客户端连接
@@ -4753,19 +7306,26 @@ class SyncServer(QThread):
                 'client_id': client_id
             }, exclude=client_id)
             
-            # 接收消息
+            # 接收消息（长度前缀分帧，一次可能收到多帧或半帧）
+            buffer = b""
             while self.running:
-                data = client_socket.recv(1024)
+                data = client_socket.recv(65536)
                 if not data:
                     break
                 
-                message = json.loads(data.decode('utf-8'))
-                if message.get('type') == 'sync':
-                    # 广播同步消息给所有其他客户端
-                    self.broadcast(message, exclude=client_socket)
-                else:
-                    # 转发给主程序
-                    self.message_received.emit(message)
+                messages, buffer = RoomWireProtocol.read_stream(buffer + data)
+                sync_messages = []
+                for message in messages:
+                    if message.get('type') == 'sync':
+                        sync_messages.append(message)
+                    elif message.get('type') == 'hello':
+                        self.client_encodings[client_id] = RoomWireProtocol.negotiate(message.get('encodings'))
+                    else:
+                        # 转发给主程序
+                        self.message_received.emit(message)
+                if sync_messages:
+                    # 同一批收到的同步消息合并成一帧广播给所有其他客户端
+                    self.broadcast(sync_messages, exclude=client_id)
         
         except Exception as e:
             self.message_received.emit({
@@ -4776,17 +7336,32 @@ class SyncServer(QThread):
             # 客户端断开处理
             if client_id in self.clients:
                 del self.clients[client_id]
+                self.client_encodings.pop(client_id, None)
+                self.send_locks.pop(client_id, None)
                 self.broadcast({
                     'type': 'client_left',
                     'client_id': client_id
                 })
             client_socket.close()
     
+    @staticmethod
+    def encode(messages, encoding):
+        return RoomWireProtocol.stream_frame(RoomWireProtocol.encode_frame(messages, encoding))
+    
+    def send_frame(self, client_id, client_socket, frame):
+        """按客户端加锁发送：只与发给同一客户端的帧串行，发给不同客户端的帧不再争用同一把锁"""
+        lock = self.send_locks.get(client_id)
+        if lock is None:
+            return
+        with lock:
+            client_socket.sendall(frame)
+    
     def send_to_client(self, client_id, message):
         """发送消息给特定客户端"""
         if client_id in self.clients:
             try:
-                self.clients[client_id].sendall(json.dumps(message).encode('utf-8'))
+                frame = self.encode([message], self.client_encodings.get(client_id, "json"))
+                self.send_frame(client_id, self.clients[client_id], frame)
             except Exception as e:
                 self.message_received.emit({
                     'type': 'error',
@@ -4794,11 +7369,16 @@ class SyncServer(QThread):
                 })
     
     def broadcast(self, message, exclude=None):
-        """广播消息给所有客户端"""
+        """广播消息给所有客户端（message 为列表时合并成一帧），每种编码只编码一次"""
+        messages = message if isinstance(message, list) else [message]
+        frames = {}
         for client_id, client_socket in list(self.clients.items()):
-            if client_socket != exclude:
+            if exclude not in (client_id, client_socket):
                 try:
-                    client_socket.sendall(json.dumps(message).encode('utf-8'))
+                    encoding = self.client_encodings.get(client_id, "json")
+                    if encoding not in frames:
+                        frames[encoding] = self.encode(messages, encoding)
+                    self.send_frame(client_id, client_socket, frames[encoding])
                 except Exception as e:
                     self.message_received.emit({
                         'type': 'error',
@@ -4814,6 +7394,7 @@ class SyncClient(QObject):
         self.client_socket = None
         self.running = False
         self.thread = None
+        self.encoding = "json"  # 发送用的编码，收到服务器的 connected 后协商
     
     def connect_to_server(self, ip, port):
         """连接到同步服务器"""
@@ -4837,14 +7418,23 @@ class SyncClient(QObject):
     
     def receive_messages(self):
         """接收服务器消息"""
+        buffer = b""
         while self.running:
             try:
-                data = self.client_socket.recv(1024)
+                data = self.client_socket.recv(65536)
                 if not data:
                     break
                 
-                message = json.loads(data.decode('utf-8'))
-                self.message_received.emit(message)
+                messages, buffer = RoomWireProtocol.read_stream(buffer + data)
+                for message in messages:
+                    if message.get('type') == 'connected':
+                        # 按服务器支持的编码选定发送编码，并告诉服务器本端能解码哪些编码
+                        self.encoding = RoomWireProtocol.negotiate(message.get('encodings'))
+                        self.send_message({
+                            'type': 'hello',
+                            'encodings': RoomWireProtocol.supported_encodings()
+                        })
+                    self.message_received.emit(message)
             except:
                 break
     
@@ -4852,7 +7442,8 @@ class SyncClient(QObject):
         """发送消息到服务器"""
         if self.client_socket:
             try:
-                self.client_socket.sendall(json.dumps(message).encode('utf-8'))
+                frame = RoomWireProtocol.encode_frame([message], self.encoding)
+                self.client_socket.sendall(RoomWireProtocol.stream_frame(frame))
             except Exception as e:
                 self.message_received.emit({
                     'type': 'error',
@@ -5132,14 +7723,144 @@ class LoginDialog(QDialog):
         else:
             QMessageBox.warning(self, "错误", "用户名或密码错误")
 
+class SpectrumAnalyzer(QThread):
+    """频谱分析线程：环形缓冲 + Hann窗 + rfft + 对数频段 + 起落平滑"""
+    frame_ready = pyqtSignal()
+
+    def __init__(self, bar_count=60, fft_size=2048, frame_rate=30, parent=None):
+        super().__init__(parent)
+        self.bar_count = bar_count
+        self.fft_size = fft_size
+        self.frame_interval = 1.0 / frame_rate
+        self.min_freq = 30.0
+        self.max_freq = 16000.0
+        self.floor_db = -70.0
+        self.attack = 0.6
+        self.decay = 0.15
+        
+        # 预分配缓冲区
+        self.ring = np.zeros(fft_size, dtype=np.float32)
+        self.ring_pos = 0
+        self.scratch = np.zeros(fft_size, dtype=np.float32)
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.scale = np.float32(2.0 / self.window.sum())
+        self.smoothed = np.zeros(bar_count, dtype=np.float32)
+        self.latest = np.zeros(bar_count, dtype=np.float32)  # 供界面读取的最新帧
+        
+        self.sample_rate = 0
+        self.bin_starts = None
+        self.bin_stop = 0
+        self.pending = False  # 自上次分析后是否有新样本
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def build_bin_map(self, sample_rate):
+        """预先计算对数频段到FFT频点的索引表"""
+        freqs = np.fft.rfftfreq(self.fft_size, 1.0 / sample_rate)
+        top = min(self.max_freq, sample_rate / 2)
+        edges = np.geomspace(self.min_freq, top, self.bar_count + 1)
+        starts = np.maximum(np.searchsorted(freqs, edges[:-1]), 1)
+        # 低频段频点不足时保证每个频段至少一个频点且严格递增
+        for i in range(1, self.bar_count):
+            if starts[i] <= starts[i - 1]:
+                starts[i] = starts[i - 1] + 1
+        self.bin_stop = min(len(freqs), int(np.searchsorted(freqs, top)) + 1)
+        self.bin_starts = np.minimum(starts, self.bin_stop - 1)
+        self.sample_rate = sample_rate
+
+    def push_samples(self, samples, channels, sample_rate):
+        """写入一段归一化的交错样本（在界面线程调用，只做拷贝）"""
+        if channels > 1:
+            usable = len(samples) - len(samples) % channels
+            samples = samples[:usable].reshape(-1, channels).mean(axis=1)
+        samples = samples[-self.fft_size:]
+        count = len(samples)
+        if count == 0:
+            return
+        
+        with self.lock:
+            if sample_rate != self.sample_rate:
+                self.build_bin_map(sample_rate)
+            end = self.ring_pos + count
+            if end <= self.fft_size:
+                self.ring[self.ring_pos:end] = samples
+            else:
+                split = self.fft_size - self.ring_pos
+                self.ring[self.ring_pos:] = samples[:split]
+                self.ring[:count - split] = samples[split:]
+            self.ring_pos = end % self.fft_size
+            self.pending = True
+        
+        if not self.isRunning():
+            self.start()
+        self.wakeup.set()
+
+    def analyze(self):
+        """对环形缓冲做一次频谱分析，返回各频段目标值(0-1)"""
+        with self.lock:
+            pos = self.ring_pos
+            self.scratch[:self.fft_size - pos] = self.ring[pos:]
+            self.scratch[self.fft_size - pos:] = self.ring[:pos]
+            self.pending = False
+            bin_starts = self.bin_starts
+            bin_stop = self.bin_stop
+        
+        self.scratch *= self.window
+        spectrum = np.abs(np.fft.rfft(self.scratch)[:bin_stop]) * self.scale
+        peaks = np.maximum.reduceat(spectrum, bin_starts)
+        levels = 20.0 * np.log10(peaks + 1e-9)
+        return np.clip((levels - self.floor_db) / -self.floor_db, 0.0, 1.0).astype(np.float32)
+
+    def run(self):
+        """分析循环：有新样本时按帧率分析，静音后柱形衰减到零即休眠"""
+        silence = np.zeros(self.bar_count, dtype=np.float32)
+        while not self.isInterruptionRequested():
+            if not self.pending and not self.smoothed.any():
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            
+            started = time.monotonic()
+            target = self.analyze() if self.pending and self.bin_starts is not None else silence
+            
+            # 起落平滑：上升快、下降慢
+            rate = np.where(target > self.smoothed, self.attack, self.decay).astype(np.float32)
+            self.smoothed += (target - self.smoothed) * rate
+            self.smoothed[self.smoothed < 0.002] = 0.0
+            
+            with self.lock:
+                changed = not np.array_equal(self.latest, self.smoothed)
+                if changed:
+                    self.latest[:] = self.smoothed
+            if changed:
+                self.frame_ready.emit()
+            
+            remaining = self.frame_interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def latest_frame(self):
+        """读取最新一帧（拷贝）"""
+        with self.lock:
+            return self.latest.copy()
+
+    def stop(self):
+        """停止分析线程"""
+        self.requestInterruption()
+        self.wakeup.set()
+        self.wait(1000)
+
+
 class SpectrumWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumSize(300, 150)
-        self.bars = []
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update)
-        self.timer.start(30)  # 30ms刷新一次
+        self.bars = np.zeros(0, dtype=np.float32)
+        self.probe = None
+        
+        # 分析在后台线程完成，有新帧时才重绘
+        self.analyzer = SpectrumAnalyzer(parent=self)
+        self.analyzer.frame_ready.connect(self.update)
         
     def set_audio_probe(self, media_player):
         """设置音频探测器"""
@@ -5148,46 +7869,50 @@ class SpectrumWidget(QWidget):
         self.probe.audioBufferProbed.connect(self.process_buffer)
     
     def process_buffer(self, buffer):
-        """处理音频缓冲区"""
-        # 获取音频数据
-        if buffer.format().sampleType() == QAudioFormat.SignedInt:
-            # 转换为numpy数组
-            ptr = buffer.data()
-            if buffer.sampleType() == QAudioFormat.SignedInt:
-                dtype = np.int16
-            else:
-                dtype = np.float32
-                
-            samples = np.frombuffer(ptr, dtype=dtype, count=buffer.sampleCount())
-            
-            # 计算FFT
-            fft_data = np.abs(fft(samples))
-            
-            # 取前一半数据（对称）
-            fft_data = fft_data[:len(fft_data)//2]
-            
-            # 分组显示（将频谱分为60组）
-            group_size = max(1, len(fft_data) // 60)
-            grouped = []
-            for i in range(0, len(fft_data), group_size):
-                group = fft_data[i:i+group_size]
-                grouped.append(np.max(group))
-            
-            # 归一化并保存
-            max_value = np.max(grouped) if np.max(grouped) > 0 else 1
-            self.bars = [min(1.0, v / max_value) for v in grouped]
+        """处理音频缓冲区（只做格式转换和入队，FFT在分析线程）"""
+        audio_format = buffer.format()
+        sample_type = audio_format.sampleType()
+        sample_size = audio_format.sampleSize()
+        
+        if sample_type == QAudioFormat.SignedInt and sample_size == 16:
+            dtype, scale, bias = np.int16, 1 / 32768.0, 0.0
+        elif sample_type == QAudioFormat.SignedInt and sample_size == 32:
+            dtype, scale, bias = np.int32, 1 / 2147483648.0, 0.0
+        elif sample_type == QAudioFormat.UnSignedInt and sample_size == 8:
+            dtype, scale, bias = np.uint8, 1 / 128.0, -128.0
+        elif sample_type == QAudioFormat.Float and sample_size == 32:
+            dtype, scale, bias = np.float32, 1.0, 0.0
+        else:
+            return
+        
+        ptr = buffer.constData()
+        ptr.setsize(buffer.byteCount())
+        samples = np.frombuffer(ptr, dtype=dtype, count=buffer.sampleCount()).astype(np.float32)
+        if bias:
+            samples += bias
+        samples *= scale
+        self.analyzer.push_samples(samples, audio_format.channelCount(), audio_format.sampleRate())
+    
+    def shutdown(self):
+        """停止频谱分析"""
+        if self.probe:
+            self.probe.setSource(None)
+        self.analyzer.stop()
     
     def paintEvent(self, event):
         """绘制频谱"""
         painter = QPainter(self)
         painter.fillRect(self.rect(), QColor(0, 0, 0, 180))
         
-        if not self.bars:
+        self.bars = self.analyzer.latest_frame()
+        if not self.bars.any():
             return
             
         bar_width = self.width() / len(self.bars)
+        heights = self.bars * self.height()
         for i, value in enumerate(self.bars):
-            height = value * self.height()
+            if value <= 0:
+                continue
             
             # 创建渐变颜色（低值蓝色，高值红色）
             if value < 0.3:
@@ -5198,13 +7923,11 @@ class SpectrumWidget(QWidget):
                 color = QColor(255, 0, 0, 200)
             
             painter.fillRect(
-                i * bar_width, 
-                self.height() - height,
-                bar_width,
-                height,
+                QRectF(i * bar_width, self.height() - float(heights[i]), bar_width, float(heights[i])),
                 color
             )
 
+
 class SpeedControl:
     def __init__(self, media_player):
         self.media_player = media_player
@@ -5276,7 +7999,7 @@ class PhonePlayer(QObject):
             "position": position
         }
         
-        response = requests.post(url, json=data)
+        response = get_http_client().post(url, json=data)
         if response.status_code != 200:
             raise Exception(f"播放命令失败: {response.text}")
         
@@ -5290,7 +8013,7 @@ class PhonePlayer(QObject):
         url = f"http://{self.server_ip}:5000/api/upload"
         files = {'file': open(file_path, 'rb')}
         
-        response = requests.post(url, files=files)
+        response = get_http_client().post(url, files=files)
         if response.status_code != 200:
             raise Exception(f"上传歌曲失败: {response.text}")
     
@@ -5300,7 +8023,7 @@ class PhonePlayer(QObject):
             return
             
         url = f"http://{self.server_ip}:5000/api/play"
-        response = requests.post(url)
+        response = get_http_client().post(url)
         if response.status_code != 200:
             raise Exception(f"播放命令失败: {response.text}")
         
@@ -5312,7 +8035,7 @@ class PhonePlayer(QObject):
             return
             
         url = f"http://{self.server_ip}:5000/api/pause"
-        response = requests.post(url)
+        response = get_http_client().post(url)
         if response.status_code != 200:
             raise Exception(f"暂停命令失败: {response.text}")
         
@@ -5321,7 +8044,7 @@ class PhonePlayer(QObject):
     def stop(self):
         """停止播放"""
         url = f"http://{self.server_ip}:5000/api/stop"
-        response = requests.post(url)
+        response = get_http_client().post(url)
         if response.status_code != 200:
             raise Exception(f"停止命令失败: {response.text}")
         
@@ -5332,7 +8055,7 @@ class PhonePlayer(QObject):
         """跳转到指定位置"""
         url = f"http://{self.server_ip}:5000/api/seek"
         data = {"position": position}
-        response = requests.post(url, json=data)
+        response = get_http_client().post(url, json=data)
         if response.status_code != 200:
             raise Exception(f"跳转命令失败: {response.text}")
         
@@ -5342,18 +8065,643 @@ class PhonePlayer(QObject):
         """设置音量"""
         url = f"http://{self.server_ip}:5000/api/volume"
         data = {"volume": volume}
-        response = requests.post(url, json=data)
+        response = get_http_client().post(url, json=data)
         if response.status_code != 200:
             raise Exception(f"音量设置失败: {response.text}")
 
-class SwitchDeviceEvent(QEvent):
-    event_type = QEvent.Type(QEvent.registerEventType())
-    
-    def __init__(self, device):
-        super().__init__(SwitchDeviceEvent.event_type)
-        self.device = device
-        
-# =============== 主应用程序 ===============
+class SwitchDeviceEvent(QEvent):
+    event_type = QEvent.Type(QEvent.registerEventType())
+    
+    def __init__(self, device):
+        super().__init__(SwitchDeviceEvent.event_type)
+        self.device = device
+        
+# =============== 波形概览 ===============
+WAVEFORM_MAGIC = b"MWF1"
+WAVEFORM_HEADER = struct.Struct("<4sIqq")  # 魔数, 点数, 文件大小, mtime_ns
+WAVEFORM_POINTS = 2000
+WAVEFORM_SAMPLE_RATE = 8000  # 解码采样率（只用于包络，无需高采样率）
+WAVEFORM_BLOCK = 1024  # 每个统计块的样本数
+WAVEFORM_CHUNK_BYTES = 64 * 1024
+
+
+class WaveformWorker(QThread):
+    """后台流式解码音频，计算峰值/RMS包络并写入二进制旁路缓存"""
+    waveform_ready = pyqtSignal(str, object, object)
+
+    def __init__(self, file_path, cache_dir, points=WAVEFORM_POINTS, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.cache_dir = os.path.join(cache_dir, "waveforms")
+        self.points = points
+        self.process = None
+
+    def stop(self):
+        """请求中断，并结束正在运行的ffmpeg，让阻塞中的读取立即返回"""
+        self.requestInterruption()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def cache_path(self):
+        key = hashlib.sha1(os.path.abspath(self.file_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.wf")
+
+    def load_cache(self, stat):
+        """读取缓存，文件大小或修改时间不一致时视为失效"""
+        try:
+            with open(self.cache_path(), "rb") as f:
+                magic, points, size, mtime_ns = WAVEFORM_HEADER.unpack(f.read(WAVEFORM_HEADER.size))
+                if magic != WAVEFORM_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                    return None
+                data = np.frombuffer(f.read(points * 2), dtype=np.uint8)
+            if len(data) != points * 2:
+                return None
+            return data[:points] / 255.0, data[points:] / 255.0
+        except (OSError, struct.error):
+            return None
+
+    def save_cache(self, stat, peaks, rms):
+        """以 uint8 量化保存包络（每点2字节），原子替换"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path()
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(WAVEFORM_HEADER.pack(WAVEFORM_MAGIC, len(peaks), stat.st_size, stat.st_mtime_ns))
+                f.write(np.round(peaks * 255).astype(np.uint8).tobytes())
+                f.write(np.round(rms * 255).astype(np.uint8).tobytes())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"保存波形缓存失败: {str(e)}")
+
+    def decode_blocks(self):
+        """用ffmpeg流式解码为单声道PCM，逐块统计峰值和均方值，内存占用与时长无关"""
+        command = [
+            "ffmpeg", "-v", "quiet", "-i", self.file_path,
+            "-f", "s16le", "-ac", "1", "-ar", str(WAVEFORM_SAMPLE_RATE), "-"
+        ]
+        creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, creationflags=creationflags
+        )
+        self.process = process
+        block_peaks = []
+        block_power = []
+        carry = np.zeros(0, dtype=np.float32)
+        pending_byte = b""
+        try:
+            while not self.isInterruptionRequested():
+                chunk = process.stdout.read(WAVEFORM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunk = pending_byte + chunk
+                usable = len(chunk) - len(chunk) % 2
+                pending_byte = chunk[usable:]
+                samples = np.frombuffer(chunk[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+                if len(carry):
+                    samples = np.concatenate((carry, samples))
+                full = len(samples) - len(samples) % WAVEFORM_BLOCK
+                blocks = samples[:full].reshape(-1, WAVEFORM_BLOCK)
+                block_peaks.append(np.abs(blocks).max(axis=1))
+                block_power.append(np.square(blocks).mean(axis=1))
+                carry = samples[full:]
+            if self.isInterruptionRequested():
+                return None
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        
+        if len(carry):
+            block_peaks.append(np.abs(carry).max(keepdims=True))
+            block_power.append(np.square(carry).mean(keepdims=True))
+        if not block_peaks:
+            return None
+        return np.concatenate(block_peaks), np.concatenate(block_power)
+
+    def build_envelope(self, block_peaks, block_power):
+        """把逐块统计归并为固定点数的峰值/RMS包络（0-1）"""
+        points = min(self.points, len(block_peaks))
+        starts = (np.arange(points) * len(block_peaks)) // points
+        peaks = np.maximum.reduceat(block_peaks, starts)
+        counts = np.diff(np.append(starts, len(block_power)))
+        rms = np.sqrt(np.add.reduceat(block_power, starts) / counts)
+        scale = peaks.max() or 1.0
+        return np.clip(peaks / scale, 0, 1), np.clip(rms / scale, 0, 1)
+
+    def run(self):
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return
+        
+        cached = self.load_cache(stat)
+        if cached is not None:
+            self.waveform_ready.emit(self.file_path, *cached)
+            return
+        
+        try:
+            started = time.monotonic()
+            blocks = self.decode_blocks()
+            if blocks is None:
+                return
+            peaks, rms = self.build_envelope(*blocks)
+            self.save_cache(stat, peaks, rms)
+            logger.debug(f"波形分析完成: {os.path.basename(self.file_path)} ({time.monotonic() - started:.1f}s)")
+            self.waveform_ready.emit(self.file_path, peaks, rms)
+        except FileNotFoundError:
+            logger.warning("未找到ffmpeg，无法生成波形概览")
+        except Exception as e:
+            logger.error(f"波形分析失败: {str(e)}")
+
+
+class WaveformSlider(QSlider):
+    """在滑块背后绘制波形概览的进度条"""
+    def __init__(self, orientation=Qt.Horizontal, parent=None):
+        super().__init__(orientation, parent)
+        self.peaks = None
+        self.rms = None
+        self.played_pixmap = None
+        self.remaining_pixmap = None
+        self.played_color = QColor(74, 35, 90)
+        self.remaining_color = QColor(150, 150, 150)
+
+    def set_waveform(self, peaks, rms):
+        self.peaks = peaks
+        self.rms = rms
+        self.played_pixmap = None
+        self.update()
+
+    def clear_waveform(self):
+        self.set_waveform(None, None)
+
+    def render_waveform(self, color):
+        """按当前尺寸把包络预先绘制成位图（尺寸变化时才重绘）"""
+        width, height = max(1, self.width()), max(1, self.height())
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.transparent)
+        
+        # 每个像素列取对应区间的最大值
+        starts = (np.arange(width) * len(self.peaks)) // width
+        peaks = np.maximum.reduceat(self.peaks, starts) if width <= len(self.peaks) else self.peaks[starts]
+        rms = np.maximum.reduceat(self.rms, starts) if width <= len(self.rms) else self.rms[starts]
+        middle = height / 2
+        
+        painter = QPainter(pixmap)
+        faded = QColor(color)
+        faded.setAlpha(110)
+        painter.setPen(faded)
+        for x, value in enumerate(peaks):
+            half = value * middle
+            painter.drawLine(QPoint(x, int(middle - half)), QPoint(x, int(middle + half)))
+        painter.setPen(color)
+        for x, value in enumerate(rms):
+            half = value * middle
+            painter.drawLine(QPoint(x, int(middle - half)), QPoint(x, int(middle + half)))
+        painter.end()
+        return pixmap
+
+    def resizeEvent(self, event):
+        self.played_pixmap = None
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        if self.peaks is None or not len(self.peaks):
+            super().paintEvent(event)
+            return
+        
+        if self.played_pixmap is None:
+            self.played_pixmap = self.render_waveform(self.played_color)
+            self.remaining_pixmap = self.render_waveform(self.remaining_color)
+        
+        span = self.maximum() - self.minimum()
+        played_x = int(self.width() * (self.value() - self.minimum()) / span) if span > 0 else 0
+        
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.remaining_pixmap)
+        painter.drawPixmap(0, 0, self.played_pixmap, 0, 0, played_x, self.height())
+        
+        # 只绘制滑块手柄，保留原有交互
+        option = QStyleOptionSlider()
+        self.initStyleOption(option)
+        option.subControls = QStyle.SC_SliderHandle
+        self.style().drawComplexControl(QStyle.CC_Slider, option, painter, self)
+        painter.end()
+
+
+# =============== 主应用程序 ===============
+# =============== 专辑封面加载 ===============
+class CoverLoader(QObject):
+    """专辑封面异步加载器：并发下载、后台缩放、按内容哈希的磁盘缓存和QPixmap内存LRU缓存"""
+    image_loaded = pyqtSignal(str, int, QImage)
+    
+    def __init__(self, cache_dir, max_workers=6, memory_size=256, parent=None):
+        super().__init__(parent)
+        self.cache_dir = os.path.join(cache_dir, "thumbs")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.memory_size = memory_size
+        self._memory = OrderedDict()   # (url, size) -> QPixmap
+        self._pending = {}             # (url, size) -> [callback, ...]
+        self._index_lock = threading.Lock()
+        self._index_dirty = False
+        self._index = self._load_index()  # sha1(url) -> sha1(图片内容)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="CoverLoader"
+        )
+        self.image_loaded.connect(self._on_image_loaded)
+        
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+        
+    def _save_index(self):
+        """原子写入URL到内容哈希的索引"""
+        with self._index_lock:
+            if not self._index_dirty:
+                return
+            data = dict(self._index)
+            self._index_dirty = False
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"保存封面索引失败: {str(e)}")
+        
+    def request(self, url, size, callback):
+        """请求指定尺寸的封面，加载完成后在GUI线程中调用callback(pixmap)"""
+        if not url:
+            return
+        key = (url, size)
+        pixmap = self._memory.get(key)
+        if pixmap is not None:
+            self._memory.move_to_end(key)
+            callback(pixmap)
+            return
+        if key in self._pending:
+            self._pending[key].append(callback)
+            return
+        self._pending[key] = [callback]
+        self._executor.submit(self._load, url, size)
+        
+    def _source_path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.img")
+        
+    def _thumb_path(self, content_hash, size):
+        return os.path.join(self.cache_dir, f"{content_hash}_{size}.png")
+        
+    def _load(self, url, size):
+        """工作线程：查缓存、下载、解码并缩放（只使用QImage，不能在此创建QPixmap）"""
+        image = QImage()
+        try:
+            url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+            with self._index_lock:
+                content_hash = self._index.get(url_hash)
+            
+            data = None
+            if content_hash:
+                thumb_path = self._thumb_path(content_hash, size)
+                if os.path.exists(thumb_path) and image.load(thumb_path):
+                    self.image_loaded.emit(url, size, image)
+                    return
+                source_path = self._source_path(content_hash)
+                if os.path.exists(source_path):
+                    with open(source_path, 'rb') as f:
+                        data = f.read()
+            
+            if data is None:
+                response = get_http_client().get(url, timeout=(5, 10))
+                if response.status_code != 200:
+                    logger.warning(f"封面下载失败: HTTP {response.status_code}")
+                    self.image_loaded.emit(url, size, image)
+                    return
+                data = response.content
+                content_hash = hashlib.sha1(data).hexdigest()
+                source_path = self._source_path(content_hash)
+                if not os.path.exists(source_path):
+                    tmp_path = f"{source_path}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                    os.replace(tmp_path, source_path)
+                with self._index_lock:
+                    self._index[url_hash] = content_hash
+                    self._index_dirty = True
+            
+            source = QImage()
+            if source.loadFromData(data):
+                image = source.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                thumb_path = self._thumb_path(content_hash, size)
+                tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+                if image.save(tmp_path, "PNG"):
+                    os.replace(tmp_path, thumb_path)
+            else:
+                logger.warning(f"无效的封面图片: {url}")
+        except Exception as e:
+            logger.error(f"加载专辑封面失败: {str(e)}")
+        self.image_loaded.emit(url, size, image)
+        
+    def _on_image_loaded(self, url, size, image):
+        """GUI线程：转换为QPixmap，放入内存缓存并通知等待者"""
+        key = (url, size)
+        callbacks = self._pending.pop(key, [])
+        if not image.isNull():
+            pixmap = QPixmap.fromImage(image)
+            self._memory[key] = pixmap
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+            for callback in callbacks:
+                try:
+                    callback(pixmap)
+                except Exception as e:
+                    logger.error(f"设置封面失败: {str(e)}")
+        if not self._pending:
+            self._save_index()
+        
+    def shutdown(self):
+        """停止加载并保存索引"""
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._save_index()
+
+# =============== 播放列表模型 ===============
+class PlaylistModel(QAbstractListModel):
+    """播放列表数据模型：路径到行号的哈希索引去重，批量插入，封面和元数据只为可见行按需加载"""
+    COVER_SIZE = 40
+
+    def __init__(self, cover_loader=None, parent=None):
+        super().__init__(parent)
+        self.cover_loader = cover_loader
+        self._entries = []   # [{"path", "name", "pic", "icon", "meta", "missing"}, ...]
+        self._rows = {}      # 路径 -> 行号
+        self._lazy_paths = set()
+        self._lazy_timer = QTimer(self)
+        self._lazy_timer.setSingleShot(True)
+        self._lazy_timer.setInterval(0)
+        self._lazy_timer.timeout.connect(self._populate_visible)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._entries):
+            return None
+        entry = self._entries[index.row()]
+        if role == Qt.DisplayRole:
+            # 只有视图实际绘制的行才会请求显示数据，借此触发延迟加载
+            if not entry["missing"] and (entry["meta"] is None or (entry["pic"] and entry["icon"] is None)):
+                self._queue_lazy(entry["path"])
+            return entry["name"]
+        if role == Qt.ForegroundRole:
+            return QColor("#808080") if entry["missing"] else None
+        if role == Qt.UserRole:
+            return entry["path"]
+        if role == Qt.DecorationRole:
+            # icon 为 False 表示封面正在加载
+            return entry["icon"] if isinstance(entry["icon"], QIcon) else None
+        if role == Qt.ToolTipRole:
+            return self._tooltip(entry)
+        return None
+
+    def _tooltip(self, entry):
+        if entry["missing"]:
+            return f"文件不存在: {entry['path']}"
+        meta = entry["meta"]
+        if not meta:
+            return entry["path"]
+        lines = [" - ".join(part for part in (meta.get("title"), meta.get("artist")) if part) or entry["name"]]
+        if meta.get("album"):
+            lines.append(meta["album"])
+        if meta.get("duration"):
+            seconds = int(meta["duration"]) // 1000  # 音乐库目录中的时长单位为毫秒
+            lines.append(f"{seconds // 60:02d}:{seconds % 60:02d}")
+        lines.append(entry["path"])
+        return "\n".join(lines)
+
+    def _queue_lazy(self, path):
+        if path in self._lazy_paths:
+            return
+        self._lazy_paths.add(path)
+        if not self._lazy_timer.isActive():
+            self._lazy_timer.start()
+
+    def _populate_visible(self):
+        """批量补全可见行的元数据，并请求封面"""
+        paths = [path for path in self._lazy_paths if path in self._rows]
+        self._lazy_paths.clear()
+        if not paths:
+            return
+
+        need_meta = [path for path in paths if self._entries[self._rows[path]]["meta"] is None]
+        if need_meta:
+            tracks = get_library_catalog().tracks_for_paths(os.path.normpath(path) for path in need_meta)
+            for path in need_meta:
+                # 未编目的歌曲记为空字典，避免反复查询
+                self._entries[self._rows[path]]["meta"] = tracks.get(os.path.normpath(path), {})
+
+        for path in paths:
+            entry = self._entries[self._rows[path]]
+            if entry["pic"] and entry["icon"] is None and self.cover_loader is not None:
+                entry["icon"] = False  # 标记为加载中
+                self.cover_loader.request(
+                    entry["pic"], self.COVER_SIZE,
+                    lambda pixmap, path=path: self.set_icon(path, pixmap)
+                )
+
+    @staticmethod
+    def make_entry(path, name, pic=None):
+        return {"path": path, "name": name, "pic": pic, "icon": None, "meta": None, "missing": False}
+
+    def count(self):
+        return len(self._entries)
+
+    def contains(self, path):
+        return path in self._rows
+
+    def row_of(self, path):
+        return self._rows.get(path, -1)
+
+    def path_at(self, row):
+        return self._entries[row]["path"]
+
+    def name_at(self, row):
+        return self._entries[row]["name"]
+
+    def paths(self):
+        return [entry["path"] for entry in self._entries]
+
+    def entries(self):
+        """返回 [{"name", "path"}, ...]，用于保存和远程接口"""
+        return [{"name": entry["name"], "path": entry["path"]} for entry in self._entries]
+
+    def append(self, path, name, pic=None):
+        """添加单首歌曲，已存在时返回 False"""
+        return self.extend([(path, name, pic)]) == 1
+
+    def extend(self, songs):
+        """批量添加 [(路径, 名称[, 封面URL]), ...]，只发出一次插入通知，返回实际添加数量"""
+        new_entries = []
+        seen = set()
+        for song in songs:
+            path = song[0]
+            if not path or path in self._rows or path in seen:
+                continue
+            seen.add(path)
+            new_entries.append(self.make_entry(path, song[1], song[2] if len(song) > 2 else None))
+        if not new_entries:
+            return 0
+
+        first = len(self._entries)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_entries) - 1)
+        self._entries.extend(new_entries)
+        for row, entry in enumerate(new_entries, first):
+            self._rows[entry["path"]] = row
+        self.endInsertRows()
+        return len(new_entries)
+
+    def _reindex(self, start=0):
+        for row in range(start, len(self._entries)):
+            self._rows[self._entries[row]["path"]] = row
+
+    def remove_row(self, row):
+        if not 0 <= row < len(self._entries):
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row)
+        entry = self._entries.pop(row)
+        del self._rows[entry["path"]]
+        self._reindex(row)
+        self.endRemoveRows()
+        return True
+
+    def remove_paths(self, paths):
+        """批量移除，返回被移除的行号（升序）"""
+        rows = sorted(self._rows[path] for path in set(paths) if path in self._rows)
+        if not rows:
+            return []
+        # 从后往前按连续区间移除，最后统一重建索引
+        end = len(rows) - 1
+        while end >= 0:
+            start = end
+            while start > 0 and rows[start - 1] == rows[start] - 1:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), rows[start], rows[end])
+            for entry in self._entries[rows[start]:rows[end] + 1]:
+                del self._rows[entry["path"]]
+            del self._entries[rows[start]:rows[end] + 1]
+            self.endRemoveRows()
+            end = start - 1
+        self._reindex(rows[0])
+        return rows
+
+    def clear(self):
+        self.beginResetModel()
+        self._entries = []
+        self._rows = {}
+        self._lazy_paths.clear()
+        self.endResetModel()
+
+    def set_metadata(self, tracks):
+        """填入后台预取的元数据 {路径: 行字典}，可见时不再查询"""
+        for path, track in tracks.items():
+            row = self._rows.get(path)
+            if row is not None and self._entries[row]["meta"] is None:
+                self._entries[row]["meta"] = track
+
+    def mark_missing(self, paths):
+        """把文件不存在的歌曲标记为缺失（灰色显示），只发出一次范围更新"""
+        rows = [self._rows[path] for path in paths if path in self._rows]
+        if not rows:
+            return
+        for row in rows:
+            self._entries[row]["missing"] = True
+        self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), [Qt.ForegroundRole, Qt.ToolTipRole])
+
+    def is_missing(self, row):
+        return self._entries[row]["missing"]
+
+    def set_icon(self, path, pixmap):
+        row = self._rows.get(path)
+        if row is None:
+            return
+        self._entries[row]["icon"] = QIcon(pixmap)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+class PlaylistValidator(QObject):
+    """在后台线程池中分块检查播放列表文件是否存在并预取元数据，避免网络盘/慢速U盘阻塞界面"""
+    chunk_validated = pyqtSignal(list, dict)       # 缺失路径, {路径: 元数据}
+    finished = pyqtSignal(int, int, float)         # 总数, 缺失数, 耗时(ms)
+    _chunk_done = pyqtSignal(int, list, dict)
+
+    def __init__(self, max_workers=8, chunk_size=128, parent=None):
+        super().__init__(parent)
+        self.chunk_size = chunk_size
+        self.generation = 0
+        self._pending = 0
+        self._total = 0
+        self._missing = 0
+        self._started = 0.0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="PlaylistValidator"
+        )
+        self._chunk_done.connect(self._on_chunk_done)
+
+    def validate(self, paths):
+        """开始校验；再次调用会使上一轮的结果作废"""
+        self.generation += 1
+        paths = list(paths)
+        self._total = len(paths)
+        self._missing = 0
+        self._started = time.perf_counter()
+        chunks = [paths[i:i + self.chunk_size] for i in range(0, len(paths), self.chunk_size)]
+        self._pending = len(chunks)
+        if not chunks:
+            self.finished.emit(0, 0, 0.0)
+            return
+        for chunk in chunks:
+            self._executor.submit(self._check, self.generation, chunk)
+
+    def _check(self, generation, chunk):
+        """工作线程：检查存在性，并为存在的文件批量查询音乐库元数据"""
+        missing, tracks = [], {}
+        try:
+            if generation != self.generation:
+                return
+            existing = []
+            for path in chunk:
+                if os.path.exists(path):
+                    existing.append(path)
+                else:
+                    missing.append(path)
+            catalog_rows = get_library_catalog().tracks_for_paths(os.path.normpath(path) for path in existing)
+            for path in existing:
+                # 未编目的歌曲记为空字典，避免再查询
+                tracks[path] = catalog_rows.get(os.path.normpath(path), {})
+        except Exception as e:
+            logger.error(f"校验播放列表失败: {str(e)}")
+        finally:
+            self._chunk_done.emit(generation, missing, tracks)
+
+    def _on_chunk_done(self, generation, missing, tracks):
+        if generation != self.generation:
+            return
+        self._pending -= 1
+        self._missing += len(missing)
+        self.chunk_validated.emit(missing, tracks)
+        if self._pending == 0:
+            self.finished.emit(self._total, self._missing, (time.perf_counter() - self._started) * 1000)
+
+    def shutdown(self):
+        self.generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 class MusicPlayerApp(QMainWindow):
     def __init__(self):
         try:
@@ -5362,6 +8710,8 @@ class MusicPlayerApp(QMainWindow):
             self.current_song = None
             self.current_song_info = None
             self.search_results = []
+            self.search_generation = 0
+            self.source_latency = {}
             self.settings = load_settings()
             self.media_player = QMediaPlayer()
             self.media_player.setNotifyInterval(10)
@@ -5387,6 +8737,10 @@ class MusicPlayerApp(QMainWindow):
         
             # 初始化频谱可视化
             self.spectrum_widget = SpectrumWidget()
+            self.waveform_worker = None  # 当前歌曲的波形分析线程
+            self.waveform_workers = []   # 仍在运行的波形线程（包括已被新歌曲取代、正在退出的）
+            self.feature_index_worker = None  # 音乐库特征索引线程
+            self.feature_index_pending = False
         
             # 初始化速度控制
             self.speed_control = SpeedControl(self.media_player)
@@ -5408,9 +8762,20 @@ class MusicPlayerApp(QMainWindow):
             self.is_random_play = False
             self.repeat_mode = "none"
             self.create_necessary_dirs()  
+            self.cover_loader = CoverLoader(self.settings["save_paths"]["cache"], parent=self)
+            self.library_watcher = LibraryWatcher(parent=self)
+            self.library_watcher.library_changed.connect(self.handle_library_changed)
+            self.library_watcher.lyrics_changed.connect(self.handle_lyrics_folders_changed)
+            self.playlist_validator = PlaylistValidator(parent=self)
+            self.playlist_validator.chunk_validated.connect(self.handle_playlist_validated)
+            self.playlist_validator.finished.connect(self.handle_playlist_validation_finished)
+            self.start_library_scan()
             self.netease_worker = NetEaseWorker()  # 网易云专用worker
             self.setup_netease_connections()  # 连接网易云信号
             self.init_ui()
+            # 播放列表第一次绘制时输出启动耗时
+            self.startup_reported = False
+            self.playlist_widget.viewport().installEventFilter(self)
             self.setup_connections()
             # 加载设备设置
             self.load_device_setting()
@@ -5418,6 +8783,7 @@ class MusicPlayerApp(QMainWindow):
             logger.info("应用程序启动")
             self.playlist_file = "playlists.json"
             self.ensure_playlist_exists()
+            self.playlist_store = get_playlist_store(self.playlist_file)
             self.load_playlist_on_startup()
             self.results_list.setAutoFillBackground(True)
             self.song_info.setAutoFillBackground(True)
@@ -5490,7 +8856,7 @@ class MusicPlayerApp(QMainWindow):
             self.lyrics_sync.load_lyrics("")
         
             # 初始化播放列表
-            self.playlist_widget.setCurrentRow(-1)
+            self.playlist_widget.setCurrentIndex(QModelIndex())
 
             # 添加远程控制服务器
             self.remote_server = self.RemoteControlServer(self, port=5000)
@@ -5531,6 +8897,8 @@ class MusicPlayerApp(QMainWindow):
         self.media_player.stateChanged.connect(self.on_player_state_changed)
         self.media_player.positionChanged.connect(self.on_position_changed)
         self.media_player.volumeChanged.connect(self.on_volume_changed)
+        self.media_player.currentMediaChanged.connect(self.request_waveform)
+        self.media_player.currentMediaChanged.connect(self.record_library_play)
         
 
     def setup_speed_control_ui(self):
@@ -5673,38 +9041,61 @@ class MusicPlayerApp(QMainWindow):
                 QMessageBox.critical(self, "错误", f"无法创建播放列表文件:\n{str(e)}")
     
     def load_playlist_on_startup(self):
-        """启动时加载播放列表"""
+        """启动时加载播放列表（快照 + 操作日志重放），文件校验在后台进行"""
         if os.path.exists(self.playlist_file):
             try:
-                with open(self.playlist_file, 'r', encoding='utf-8') as f:
-                    playlists = json.load(f)
-                
+                start = time.perf_counter()
                 # 加载默认播放列表
-                default_playlist = playlists.get("default", [])
-                self.playlist_widget.clear()
-                
-                for song_info in default_playlist:
-                    song_path = song_info.get("path", "")
-                    song_name = song_info.get("name", os.path.basename(song_path))
-                    
-                    if os.path.exists(song_path):
-                        item = QListWidgetItem(song_name)
-                        item.setData(Qt.UserRole, song_path)
-                        self.playlist_widget.addItem(item)
-                        try:
-                            logger.info(f"加载到播放列表: {song_name}")
-                        except UnicodeEncodeError:
-                            logger.info("加载到播放列表: [包含非ASCII字符的歌曲名称]")
-                    else:
-                        logger.warning(f"文件不存在，跳过加载: {song_path}")
+                self.load_store_playlist(self.playlist_store)
                 
-                self.status_bar.showMessage(f"已加载 {self.playlist_widget.count()} 首歌曲")
-                logger.info(f"成功加载播放列表: {self.playlist_file}")
+                self.status_bar.showMessage(f"已加载 {self.playlist_model.count()} 首歌曲")
+                logger.info(f"成功加载播放列表: {self.playlist_file}（{(time.perf_counter() - start) * 1000:.0f} ms）")
                 
             except Exception as e:
                 logger.error(f"加载播放列表失败: {str(e)}")
                 QMessageBox.critical(self, "错误", f"加载播放列表失败:\n{str(e)}")
 
+    def load_store_playlist(self, store):
+        """直接用保存的名称填充模型，文件存在性和元数据交给后台校验"""
+        default_playlist = store.get("default")
+        self.playlist_model.clear()
+        self.playlist_model.extend(self.collect_playlist_songs(default_playlist))
+        if self.playlist_model.count() != len(default_playlist):
+            # 去掉重复或无效的条目
+            store.replace("default", self.playlist_model.entries())
+        self.playlist_validator.validate(self.playlist_model.paths())
+
+    def collect_playlist_songs(self, songs):
+        """把保存的播放列表条目转换为 (路径, 名称) 列表（不访问文件系统）"""
+        result = []
+        for song_info in songs:
+            if isinstance(song_info, str):
+                song_info = {"path": song_info}
+            song_path = song_info.get("path", "")
+            result.append((song_path, song_info.get("name", os.path.basename(song_path))))
+        return result
+
+    def handle_playlist_validated(self, missing, tracks):
+        """后台校验完成一块：填入元数据，标记缺失的歌曲"""
+        self.playlist_model.set_metadata(tracks)
+        self.playlist_model.mark_missing(missing)
+
+    def handle_playlist_validation_finished(self, total, missing, elapsed_ms):
+        logger.info(f"播放列表校验完成: {total} 首，缺失 {missing} 首，耗时 {elapsed_ms:.0f} ms")
+        if missing:
+            self.status_bar.showMessage(f"播放列表中有 {missing} 首歌曲的文件不存在", 5000)
+
+    def eventFilter(self, watched, event):
+        if (not self.startup_reported and event.type() == QEvent.Paint
+                and watched is self.playlist_widget.viewport()):
+            self.startup_reported = True
+            watched.removeEventFilter(self)
+            logger.info(
+                f"启动耗时: 首次绘制 {(time.perf_counter() - APP_START_TIME) * 1000:.0f} ms"
+                f"（播放列表 {self.playlist_model.count()} 首）"
+            )
+        return super().eventFilter(watched, event)
+
     def setup_netease_connections(self):
         """设置网易云专用信号连接"""
         self.netease_worker.search_finished.connect(self.display_netease_search_results)
@@ -5972,6 +9363,8 @@ class MusicPlayerApp(QMainWindow):
         if self.media_player.duration() > 0:
             position = int(value * self.media_player.duration() / 1000)
             self.media_player.setPosition(position)
+            # 音乐室中的跳转由服务器更新权威状态后同步给其他成员
+            self.room_manager.send_playback_command("seek", position=position)
 
     def get_file_browser_content(self, path):
         """获取文件浏览器内容"""
@@ -5991,22 +9384,9 @@ class MusicPlayerApp(QMainWindow):
                 })
             
             # 遍历目录内容
-            for entry in os.listdir(path):
-                full_path = os.path.join(path, entry)
-                if os.path.isdir(full_path):
-                    items.append({
-                        "name": entry,
-                        "path": full_path,
-                        "type": "directory",
-                        "icon": "fas fa-folder"
-                    })
-                elif entry.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
-                    items.append({
-                        "name": entry,
-                        "path": full_path,
-                        "type": "file",
-                        "icon": "fas fa-file-audio"
-                    })
+            for item in self.list_directory(path):
+                item["icon"] = "fas fa-folder" if item["type"] == "directory" else "fas fa-file-audio"
+                items.append(item)
             
             return {
                 "current_path": path,
@@ -6019,19 +9399,16 @@ class MusicPlayerApp(QMainWindow):
     def get_playlist_content(self):
         """获取当前播放列表内容"""
         playlist = []
-        for i in range(self.playlist_widget.count()):
-            item = self.playlist_widget.item(i)
-            file_path = item.data(Qt.UserRole)
-            
-            # 尝试获取歌曲元数据
-            try:
-                media = QMediaContent(QUrl.fromLocalFile(file_path))
-                metadata = self.media_player.metaData(media)
-                
-                title = metadata.get(QMediaMetaData.Title, os.path.basename(file_path))
-                artist = metadata.get(QMediaMetaData.AlbumArtist, "未知艺术家")
-                duration = metadata.get(QMediaMetaData.Duration, 0)
-            except:
+        paths = self.playlist_model.paths()
+        # 一次查询音乐库目录获取全部元数据
+        tracks = get_library_catalog().tracks_for_paths(os.path.normpath(path) for path in paths)
+        for i, file_path in enumerate(paths):
+            track = tracks.get(os.path.normpath(file_path))
+            if track:
+                title = track["title"] or os.path.splitext(os.path.basename(file_path))[0]
+                artist = track["artist"] or "未知艺术家"
+                duration = track["duration"]
+            else:
                 title = os.path.splitext(os.path.basename(file_path))[0]
                 artist = "未知艺术家"
                 duration = 0
@@ -6132,7 +9509,7 @@ class MusicPlayerApp(QMainWindow):
                 border: 1px solid solid rgba(63, 63, 70, 100);  /* 边框半透明 */
                 border-radius: 4px;
             }
-            QListWidget#playlistWidget {
+            QListView#playlistWidget {
                 background-color: rgba(45, 45, 48, 150);  /* 添加透明度 */
                 color: #e0e0e0;
                 border: 1px solid rgba(63, 63, 70, 100);  /* 边框半透明 */
@@ -6309,10 +9686,18 @@ class MusicPlayerApp(QMainWindow):
         search_button.setIcon(QIcon.fromTheme("system-search"))
         search_button.setCursor(QCursor(Qt.PointingHandCursor))
         search_button.setMinimumHeight(36)
+        refresh_search_button = QPushButton("刷新")
+        refresh_search_button.setToolTip("忽略缓存，重新搜索")
+        refresh_search_button.setCursor(QCursor(Qt.PointingHandCursor))
+        refresh_search_button.setMinimumHeight(36)
     
         search_layout.addWidget(self.search_input, 5)
+        self.federated_check = QCheckBox("聚合搜索")
+        self.federated_check.setToolTip("同时搜索所有音源并合并结果")
         search_layout.addWidget(self.source_combo, 1)
+        search_layout.addWidget(self.federated_check)
         search_layout.addWidget(search_button, 1)
+        search_layout.addWidget(refresh_search_button, 1)
     
         # 工具按钮区域
         tools_layout = QHBoxLayout()
@@ -6649,8 +10034,9 @@ class MusicPlayerApp(QMainWindow):
         time_layout.addWidget(self.total_time_label)
     
         # 进度条
-        self.progress_slider = QSlider(Qt.Horizontal)
+        self.progress_slider = WaveformSlider(Qt.Horizontal)
         self.progress_slider.setRange(0, 1000)
+        self.progress_slider.setMinimumHeight(36)
     
         progress_layout.addLayout(time_layout)
         progress_layout.addWidget(self.progress_slider)
@@ -6704,10 +10090,17 @@ class MusicPlayerApp(QMainWindow):
         playlist_controls.addWidget(save_button)
     
         # 播放列表内容
-        self.playlist_widget = QListWidget()
+        self.playlist_model = PlaylistModel(self.cover_loader, parent=self)
+        self.playlist_widget = QListView()
         self.playlist_widget.setObjectName("playlistWidget") 
+        self.playlist_widget.setModel(self.playlist_model)
         self.playlist_widget.setAlternatingRowColors(True)
         self.playlist_widget.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.playlist_widget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # 所有行同高，视图无需逐行计算尺寸；大列表分批布局
+        self.playlist_widget.setUniformItemSizes(True)
+        self.playlist_widget.setLayoutMode(QListView.Batched)
+        self.playlist_widget.setBatchSize(200)
     
         playlist_layout.addLayout(playlist_controls)
         playlist_layout.addWidget(self.playlist_widget)
@@ -6771,7 +10164,8 @@ class MusicPlayerApp(QMainWindow):
         self.timer.start(60000)  # 每分钟更新一次
     
         # 连接信号
-        search_button.clicked.connect(self.start_search)
+        search_button.clicked.connect(lambda: self.start_search())
+        refresh_search_button.clicked.connect(lambda: self.start_search(refresh=True))
         settings_button.clicked.connect(self.open_settings)
         log_button.clicked.connect(self.open_log_console)
         self.bilibili_audio_button.clicked.connect(self.open_bilibili_audio_search)
@@ -6787,7 +10181,7 @@ class MusicPlayerApp(QMainWindow):
         clear_button.clicked.connect(self.clear_playlist)
         save_button.clicked.connect(self.save_playlist)
         self.results_list.itemClicked.connect(self.song_selected)
-        self.playlist_widget.itemDoubleClicked.connect(self.play_playlist_item)
+        self.playlist_widget.doubleClicked.connect(lambda index: self.play_playlist_row(index.row()))
         self.set_background()
         # 设备切换按钮
         device_layout = QHBoxLayout()
@@ -6853,6 +10247,21 @@ class MusicPlayerApp(QMainWindow):
         self.music_room_dialog.show()
         self.music_room_dialog.activateWindow()
 
+    def update_room_list(self, rooms):
+        """音乐室房间目录变化：转发给音乐室对话框"""
+        if getattr(self, 'music_room_dialog', None):
+            self.music_room_dialog.update_room_list(rooms)
+
+    def update_user_list(self, users):
+        """当前房间成员变化：转发给音乐室对话框"""
+        if getattr(self, 'music_room_dialog', None):
+            self.music_room_dialog.update_user_list(users)
+
+    def update_room_sync_status(self, error_ms, rtt_ms):
+        """音乐室播放同步误差：转发给音乐室对话框"""
+        if getattr(self, 'music_room_dialog', None):
+            self.music_room_dialog.update_sync_status(error_ms, rtt_ms)
+
     def show_login_dialog(self):
         """显示用户登录对话框"""
         dialog = QDialog(self)
@@ -7500,11 +10909,9 @@ class MusicPlayerApp(QMainWindow):
             return
             
         # 检查是否已在播放列表中
-        for i in range(self.playlist_widget.count()):
-            item = self.playlist_widget.item(i)
-            if item.data(Qt.UserRole) == song_path:
-                logger.info(f"歌曲已在播放列表中: {song_path}")
-                return
+        if self.playlist_model.contains(song_path):
+            logger.info(f"歌曲已在播放列表中: {song_path}")
+            return
                 
         if song_info is None:
             # 从文件路径解析歌曲信息
@@ -7514,70 +10921,19 @@ class MusicPlayerApp(QMainWindow):
         else:
             song_name = f"{song_info.get('name', '未知歌曲')} - {song_info.get('artists', '未知艺术家')}"
         
-        item = QListWidgetItem(song_name)
-        item.setData(Qt.UserRole, song_path)
-        
-        # 尝试加载专辑封面
-        if song_info and song_info.get("pic"):
-            cache_dir = self.settings["save_paths"]["cache"]
-            pic_url = song_info["pic"]
-            try:
-                songid = song_info.get("id", f"song_{hashlib.md5(song_path.encode()).hexdigest()}")
-                safe_songid = re.sub(r'[\\/*?:"<>|]', "", songid)
-                image_path = os.path.join(cache_dir, f"{safe_songid}.jpg")
-                
-                if not os.path.exists(image_path):
-                    logger.info(f"下载专辑封面: {pic_url}")
-                    response = requests.get(pic_url, stream=True, timeout=10)
-                    if response.status_code == 200:
-                        with open(image_path, 'wb') as f:
-                            for chunk in response.iter_content(1024):
-                                f.write(chunk)
-                        logger.info(f"封面保存到: {image_path}")
-                    else:
-                        logger.warning(f"封面下载失败: HTTP {response.status_code}")
-                
-                if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
-                    pixmap = QPixmap(image_path)
-                    if not pixmap.isNull():
-                        pixmap = pixmap.scaled(40, 40, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                        item.setIcon(QIcon(pixmap))
-            except Exception as e:
-                logger.error(f"加载专辑封面失败: {str(e)}")
+        # 专辑封面在该行可见时由模型异步加载
+        self.playlist_model.append(song_path, song_name, song_info.get("pic"))
         
-        self.playlist_widget.addItem(item)
         logger.info(f"已添加到播放列表: {song_name}")
-        self.save_playlist_to_json()
+        self.playlist_store.add("default", [{"name": song_name, "path": song_path}])
+
+    def set_playlist_item_icon(self, song_path, pixmap):
+        """为播放列表中的歌曲设置封面"""
+        self.playlist_model.set_icon(song_path, pixmap)
 
-    def save_playlist_to_json(self):
-        """保存播放列表到JSON文件"""
-        try:
-            playlist_data = {"default": []}
-            
-            # 收集当前播放列表中的所有歌曲
-            for i in range(self.playlist_widget.count()):
-                item = self.playlist_widget.item(i)
-                song_path = item.data(Qt.UserRole)
-                song_name = item.text()
-                playlist_data["default"].append({
-                    "name": song_name,
-                    "path": song_path
-                })
-            
-            # 保存到文件
-            with open(self.playlist_file, 'w', encoding='utf-8') as f:
-                json.dump(playlist_data, f, ensure_ascii=False, indent=4)
-                
-            logger.info(f"播放列表已保存到: {self.playlist_file}")
-            return True
-        except Exception as e:
-            logger.error(f"保存播放列表失败: {str(e)}")
-            QMessageBox.critical(self, "错误", f"保存播放列表失败:\n{str(e)}")
-            return False
-        
     def save_playlist(self):
         """保存播放列表到文件"""
-        if self.playlist_widget.count() == 0:
+        if self.playlist_model.count() == 0:
             QMessageBox.information(self, "提示", "播放列表为空")
             return
             
@@ -7594,17 +10950,7 @@ class MusicPlayerApp(QMainWindow):
             return
             
         try:
-            playlist_data = {"default": []}
-            
-            # 收集当前播放列表中的所有歌曲
-            for i in range(self.playlist_widget.count()):
-                item = self.playlist_widget.item(i)
-                song_path = item.data(Qt.UserRole)
-                song_name = item.text()
-                playlist_data["default"].append({
-                    "name": song_name,
-                    "path": song_path
-                })
+            playlist_data = {"default": self.playlist_model.entries()}
             
             # 保存到文件
             with open(file_path, 'w', encoding='utf-8') as f:
@@ -7619,11 +10965,12 @@ class MusicPlayerApp(QMainWindow):
             
     def clear_playlist(self):
         """清空播放列表"""
-        self.playlist_widget.clear()
+        self.playlist_model.clear()
+        self.current_play_index = -1
         self.media_player.stop()
         self.status_bar.showMessage("播放列表已清空")
         logger.info("播放列表已清空")
-        self.save_playlist_to_json()
+        self.playlist_store.clear("default")
     
     def open_playlist_file(self):
         """打开播放列表文件对话框"""
@@ -7640,45 +10987,31 @@ class MusicPlayerApp(QMainWindow):
             return
             
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                playlists = json.load(f)
+            store = get_playlist_store(file_path)
             
             # 加载播放列表
-            default_playlist = playlists.get("default", [])
-            self.playlist_widget.clear()
-            
-            for song_info in default_playlist:
-                song_path = song_info.get("path", "")
-                song_name = song_info.get("name", os.path.basename(song_path))
-                
-                if os.path.exists(song_path):
-                    item = QListWidgetItem(song_name)
-                    item.setData(Qt.UserRole, song_path)
-                    self.playlist_widget.addItem(item)
-                    try:
-                        logger.info(f"加载到播放列表: {song_name}")
-                    except UnicodeEncodeError:
-                        logger.info("加载到播放列表: [包含非ASCII字符的歌曲名称]")
-                else:
-                    logger.warning(f"文件不存在，跳过加载: {song_path}")
+            self.load_store_playlist(store)
             
-            self.status_bar.showMessage(f"已加载 {self.playlist_widget.count()} 首歌曲")
+            self.status_bar.showMessage(f"已加载 {self.playlist_model.count()} 首歌曲")
             QMessageBox.information(self, "成功", f"播放列表已加载:\n{file_path}")
             logger.info(f"成功加载播放列表: {file_path}")
             
-            # 设置当前播放列表文件
+            # 设置当前播放列表文件，之后的编辑记录到它的日志里
             self.playlist_file = file_path
+            self.playlist_store = store
             
         except Exception as e:
             logger.error(f"加载播放列表失败: {str(e)}")
             QMessageBox.critical(self, "错误", f"加载播放列表失败:\n{str(e)}")
     
     
-    def play_playlist_item(self, item):
+    def play_playlist_row(self, row):
         """播放播放列表中的歌曲"""
-        # 获取行号并保存为当前播放索引
-        self.current_play_index = self.playlist_widget.row(item)
-        song_path = item.data(Qt.UserRole)
+        if not 0 <= row < self.playlist_model.count():
+            return
+        # 保存为当前播放索引
+        self.current_play_index = row
+        song_path = self.playlist_model.path_at(row)
         self.update_current_playlist()
         # 重置进度条
         self.progress_slider.setValue(0)
@@ -7687,8 +11020,8 @@ class MusicPlayerApp(QMainWindow):
         self.reset_lyrics()
         if not os.path.exists(song_path):
             QMessageBox.warning(self, "错误", "文件不存在，可能已被移动或删除")
-            self.playlist_widget.takeItem(self.playlist_widget.row(item))
-            self.save_playlist_to_json()
+            self.playlist_model.remove_row(row)
+            self.playlist_store.remove("default", [song_path])
             return
             
         try:
@@ -7716,7 +11049,7 @@ class MusicPlayerApp(QMainWindow):
             self.song_info.setText(f"<b>正在播放:</b> {song_name}")
 
             # 高亮当前播放项
-            self.playlist_widget.setCurrentRow(self.current_play_index)
+            self.playlist_widget.setCurrentIndex(self.playlist_model.index(self.current_play_index))
 
             # 设置当前歌曲信息
             self.current_song_info = {
@@ -7740,31 +11073,26 @@ class MusicPlayerApp(QMainWindow):
 
     def update_current_playlist(self):
         """更新当前播放列表状态"""
-        self.playlist = []
-        for i in range(self.playlist_widget.count()):
-            item = self.playlist_widget.item(i)
-            song_path = item.data(Qt.UserRole)
-            song_name = item.text()
-            self.playlist.append({
-                'path': song_path,
-                'name': song_name,
-                'artists': "未知艺术家"  # 播放列表中的歌曲可能没有艺术家信息
-            })
+        # 播放列表中的歌曲可能没有艺术家信息
+        self.playlist = [
+            {'path': entry["path"], 'name': entry["name"], 'artists': "未知艺术家"}
+            for entry in self.playlist_model.entries()
+        ]
 
     def get_next_song_index(self):
         """根据播放模式获取下一首歌曲的索引"""
-        if self.playlist_widget.count() == 0:
+        if self.playlist_model.count() == 0:
             return -1
         
         if self.play_mode == 2:  # 单曲循环
             return self.current_play_index
         if self.play_mode == 1:  # 随机播放
-            return random.randint(0, self.playlist_widget.count() - 1)
+            return random.randint(0, self.playlist_model.count() - 1)
         # 顺序播放模式 - 直接递增索引
         next_index = self.current_play_index + 1
     
         # 检查是否超出范围
-        if next_index >= self.playlist_widget.count():
+        if next_index >= self.playlist_model.count():
             # 根据设置决定是否循环播放
             if self.settings["other"]["repeat_mode"] == "all":
                 next_index = 0  # 循环到第一首
@@ -7775,37 +11103,35 @@ class MusicPlayerApp(QMainWindow):
         
     def get_prev_song_index(self):
         """根据播放模式获取上一首歌曲的索引"""
-        if self.playlist_widget.count() == 0:
+        if self.playlist_model.count() == 0:
             return -1
         
         if self.play_mode == 2:  # 单曲循环
             return self.current_play_index
         elif self.play_mode == 1:  # 随机播放
-            return random.randint(0, self.playlist_widget.count() - 1)
+            return random.randint(0, self.playlist_model.count() - 1)
         else:  # 顺序播放
             prev_index = self.current_play_index - 1
-            return prev_index if prev_index >= 0 else self.playlist_widget.count() - 1
+            return prev_index if prev_index >= 0 else self.playlist_model.count() - 1
         
     def play_previous(self):
         """播放上一首歌曲"""
-        if self.playlist_widget.count() == 0:
+        if self.playlist_model.count() == 0:
             return
             
         prev_index = self.get_prev_song_index()
-        if 0 <= prev_index < self.playlist_widget.count():
-            item = self.playlist_widget.item(prev_index)
-            self.play_playlist_item(item)
+        if 0 <= prev_index < self.playlist_model.count():
+            self.play_playlist_row(prev_index)
 
     
     def play_next(self):
         """播放下一首歌曲"""
-        if self.playlist_widget.count() == 0:
+        if self.playlist_model.count() == 0:
             return
             
         next_index = self.get_next_song_index()
-        if 0 <= next_index < self.playlist_widget.count():
-            item = self.playlist_widget.item(next_index)
-            self.play_playlist_item(item)
+        if 0 <= next_index < self.playlist_model.count():
+            self.play_playlist_row(next_index)
 
     def handle_media_status_changed(self, status):
         """处理媒体状态变化"""
@@ -7907,9 +11233,10 @@ class MusicPlayerApp(QMainWindow):
 
     def show_playlist_menu(self, pos):
         """显示播放列表的右键菜单"""
-        item = self.playlist_widget.itemAt(pos)
-        if not item:
+        index = self.playlist_widget.indexAt(pos)
+        if not index.isValid():
             return
+        song_path = self.playlist_model.path_at(index.row())
             
         menu = QMenu(self)
         menu.setStyleSheet("""
@@ -7924,31 +11251,37 @@ class MusicPlayerApp(QMainWindow):
         """)
         
         play_action = QAction("播放", self)
-        play_action.triggered.connect(lambda: self.play_playlist_item(item))
+        play_action.triggered.connect(lambda: self.play_playlist_row(self.playlist_model.row_of(song_path)))
         menu.addAction(play_action)
         
         remove_action = QAction("移除", self)
-        remove_action.triggered.connect(lambda: self.remove_playlist_item(item))
+        remove_action.triggered.connect(lambda: self.remove_playlist_item(song_path))
         menu.addAction(remove_action)
         
         menu.addSeparator()
         
         open_folder_action = QAction("打开所在文件夹", self)
-        open_folder_action.triggered.connect(lambda: self.open_song_folder(item))
+        open_folder_action.triggered.connect(lambda: self.open_song_folder(song_path))
         menu.addAction(open_folder_action)
         
         menu.exec_(self.playlist_widget.mapToGlobal(pos))
     
-    def remove_playlist_item(self, item):
+    def remove_playlist_item(self, song_path):
         """从播放列表中移除歌曲"""
-        row = self.playlist_widget.row(item)
-        self.playlist_widget.takeItem(row)
-        logger.info(f"从播放列表移除: {item.text()}")
-        self.save_playlist_to_json()
+        row = self.playlist_model.row_of(song_path)
+        if row < 0:
+            return
+        song_name = self.playlist_model.name_at(row)
+        self.playlist_model.remove_row(row)
+        if row < self.current_play_index:
+            self.current_play_index -= 1
+        elif row == self.current_play_index:
+            self.current_play_index = -1
+        logger.info(f"从播放列表移除: {song_name}")
+        self.playlist_store.remove("default", [song_path])
     
-    def open_song_folder(self, item):
+    def open_song_folder(self, song_path):
         """打开歌曲所在文件夹"""
-        song_path = item.data(Qt.UserRole)
         folder_path = os.path.dirname(song_path)
         
         if os.path.exists(folder_path):
@@ -8059,9 +11392,23 @@ class MusicPlayerApp(QMainWindow):
         if hasattr(self, 'log_console') and self.log_console:
             self.log_console.close()
      
-        # 保存播放列表
-        self.save_playlist_to_json()
-    
+        # 把播放列表日志压缩为快照
+        close_playlist_stores()
+
+        # 停止封面加载
+        self.cover_loader.shutdown()
+
+        # 停止频谱分析线程、目录监视和播放列表校验
+        self.spectrum_widget.shutdown()
+        self.library_watcher.shutdown()
+        self.playlist_validator.shutdown()
+        for worker in list(self.waveform_workers):
+            worker.stop()
+            worker.wait()
+
+        # 将延迟写入的设置立即写盘
+        flush_settings()
+
         event.accept()
    
     def terminate_all_threads(self):
@@ -8185,7 +11532,7 @@ class MusicPlayerApp(QMainWindow):
                     border-radius: 4px;
                 }}
             
-                QListWidget#playlistWidget {{
+                QListView#playlistWidget {{
                     background-color: rgba(45, 45, 48, 150);
                     color: #e0e0e0;
                     border: 1px solid rgba(63, 63, 70, 100);
@@ -8294,16 +11641,20 @@ class MusicPlayerApp(QMainWindow):
             self.remove_thread(self.search_worker)
             self.search_worker = None
 
-    def start_search(self):
+    def start_search(self, refresh=False):
+        """开始搜索，refresh为True时忽略缓存；命中缓存时返回True"""
         keyword = self.search_input.text().strip()
         self.status_bar.showMessage("搜索中...")
         if not keyword:
             self.status_bar.showMessage("请输入歌曲名称")
             logger.warning("搜索请求: 未输入关键词")
             return
+        if self.federated_check.isChecked():
+            self.start_federated_search(keyword, refresh)
+            return False
         if self.source_combo.currentText() == "网易云音乐":
             self.status_bar.showMessage("网易云搜索中...")
-            self.netease_worker.search_songs(keyword)
+            self.netease_worker.search_songs(keyword, refresh)
         else:
             pass
         if not keyword:
@@ -8313,6 +11664,14 @@ class MusicPlayerApp(QMainWindow):
         self.playlist = self.search_results if self.search_results else []
         self.settings["sources"]["active_source"] = self.source_combo.currentText()
         save_settings(self.settings)
+        if not refresh:
+            cached = get_search_cache().get(active_source_search_key(keyword))
+            if cached is not None:
+                logger.info(f"使用缓存的搜索结果: {keyword}")
+                self.song_info.clear()
+                self.download_button.setEnabled(False)
+                self.display_search_results(cached)
+                return True
         logger.info(f"开始搜索: {keyword}")
         self.status_bar.showMessage("搜索中...")
         self.results_list.clear()
@@ -8322,16 +11681,47 @@ class MusicPlayerApp(QMainWindow):
         self.search_worker = MusicWorker()
         self.active_threads.append(self.search_worker)
         self.search_worker.search_finished.connect(self.display_search_results)
+        self.search_worker.search_partial.connect(self.display_partial_search_results)
         self.search_worker.error_occurred.connect(self.display_error)
         self.search_worker.finished.connect(lambda: self.remove_thread(self.search_worker)) 
-        self.search_worker.search_songs(keyword)
+        self.search_worker.search_songs(keyword, refresh)
+        return False
+
+    def start_federated_search(self, keyword, refresh=False):
+        """在所有音源中并发搜索，结果按音源陆续显示"""
+        logger.info(f"开始聚合搜索: {keyword}")
+        self.status_bar.showMessage("聚合搜索中...")
+        self.results_list.clear()
+        self.song_info.clear()
+        self.download_button.setEnabled(False)
+        self.source_latency = {}
+        worker = FederatedSearchWorker()
+        self.search_worker = worker
+        self.active_threads.append(worker)
+        worker.results_updated.connect(self.display_search_results)
+        worker.source_finished.connect(self.handle_source_finished)
+        worker.search_finished.connect(self.handle_federated_search_finished)
+        worker.error_occurred.connect(self.display_error)
+        worker.finished.connect(lambda: self.remove_thread(worker))
+        worker.search_songs(keyword, refresh)
+
+    def handle_source_finished(self, source_name, count, latency):
+        """记录单个音源的耗时"""
+        self.source_latency[source_name] = latency
+        self.status_bar.showMessage(
+            f"聚合搜索中... {source_name}: {count} 首 ({latency:.0f}ms)，"
+            f"已完成 {len(self.source_latency)} 个音源"
+        )
+
+    def handle_federated_search_finished(self, songs):
+        """聚合搜索完成，显示各音源耗时"""
+        latency_text = "，".join(
+            f"{name} {latency:.0f}ms" for name, latency in sorted(self.source_latency.items(), key=lambda x: x[1])
+        )
+        self.status_bar.showMessage(f"找到 {len(songs)} 首歌曲（{latency_text}）")
 
     def update_progress(self, position):
         """更新进度条显示"""
-        if self.room_manager.current_room:
-            # 每5秒同步一次进度
-            if position % 5000 < 100:
-                self.room_manager.send_playback_command("seek", position=position)
         if self.media_player.duration() > 0:
             # 计算当前播放进度的百分比（0-1000）
             progress = int(1000 * position / self.media_player.duration())
@@ -8341,7 +11731,141 @@ class MusicPlayerApp(QMainWindow):
             self.current_time_label.setText(self.format_time(position))
             self.total_time_label.setText(self.format_time(self.media_player.duration()))
 
+    def request_waveform(self, media):
+        """切换歌曲时在后台生成（或从缓存读取）本地文件的波形概览"""
+        self.progress_slider.clear_waveform()
+        if self.waveform_worker and self.waveform_worker.isRunning():
+            self.waveform_worker.stop()
+        self.waveform_worker = None
+        
+        file_path = media.canonicalUrl().toLocalFile()
+        if not file_path or not os.path.isfile(file_path):
+            return
+        
+        worker = WaveformWorker(file_path, self.settings["save_paths"]["cache"], parent=self)
+        worker.waveform_ready.connect(self.handle_waveform_ready)
+        worker.finished.connect(lambda: self.handle_waveform_worker_finished(worker))
+        self.waveform_workers.append(worker)
+        self.waveform_worker = worker
+        worker.start(QThread.LowPriority)
+
+    def handle_waveform_worker_finished(self, worker):
+        """波形线程结束后释放"""
+        if worker in self.waveform_workers:
+            self.waveform_workers.remove(worker)
+        if self.waveform_worker is worker:
+            self.waveform_worker = None
+        worker.deleteLater()
+
+    def start_library_scan(self):
+        """后台增量扫描音乐目录，更新音乐库目录"""
+        music_dir = self.settings["save_paths"]["music"]
+        if not os.path.isdir(music_dir):
+            return
+        worker = LibraryScanWorker(music_dir, parent=self)
+        worker.scan_finished.connect(self.handle_library_scan_finished)
+        worker.finished.connect(lambda: self.active_threads.remove(worker) if worker in self.active_threads else None)
+        self.active_threads.append(worker)
+        worker.start(QThread.LowPriority)
+
+    def handle_library_scan_finished(self, added, updated, removed):
+        if added or updated or removed:
+            self.status_bar.showMessage(f"音乐库已更新：新增 {added}，更新 {updated}，删除 {removed}", 5000)
+        
+        # 全量扫描后改为监视目录变化，只处理增量
+        music_dir = self.settings["save_paths"]["music"]
+        self.library_watcher.watch(music_dir, get_library_catalog().folders_under(music_dir))
+        lyrics_path = self.settings.get("lyrics", {}).get("lyrics_path")
+        if lyrics_path:
+            self.library_watcher.watch_lyrics(os.path.dirname(lyrics_path))
+        self.index_library_features()
+
+    def index_library_features(self):
+        """后台更新音乐库的音频特征索引，运行中再次请求时在结束后重跑一次；
+        只在设置中开启音频推荐时运行，特征提取会占用一半CPU"""
+        if not AUDIO_FEATURES_ENABLED or not self.settings["other"].get("audio_recommendations", False):
+            return
+        if self.feature_index_worker is not None:
+            self.feature_index_pending = True
+            return
+        self.feature_index_pending = False
+        worker = FeatureIndexWorker(parent=self)
+        worker.index_finished.connect(self.handle_feature_index_finished)
+        worker.finished.connect(lambda: self.handle_feature_index_worker_finished(worker))
+        self.active_threads.append(worker)
+        self.feature_index_worker = worker
+        worker.start(QThread.LowPriority)
+
+    def handle_feature_index_finished(self, added, dropped):
+        if added or dropped:
+            logger.info(f"音频特征索引已更新：新增 {added}，删除 {dropped}")
+
+    def handle_feature_index_worker_finished(self, worker):
+        if worker in self.active_threads:
+            self.active_threads.remove(worker)
+        worker.deleteLater()
+        self.feature_index_worker = None
+        if self.feature_index_pending and not worker.isInterruptionRequested():
+            self.index_library_features()
+
+    def handle_library_changed(self, added, updated, removed):
+        """音乐目录发生变化：同步播放列表（新文件加入，已删除文件移出）"""
+        get_smart_playlist_manager().handle_library_changed(added, updated, removed)
+        if added or updated or removed:
+            self.index_library_features()
+        removed_rows = self.playlist_model.remove_paths(removed)
+        if self.current_play_index in removed_rows:
+            self.current_play_index = -1
+        elif removed_rows:
+            self.current_play_index -= bisect.bisect_left(removed_rows, self.current_play_index)
+        
+        new_paths = [path for path in added if not self.playlist_model.contains(path)]
+        tracks = get_library_catalog().tracks_for_paths(new_paths)
+        songs = []
+        for path in new_paths:
+            track = tracks.get(path, {})
+            title = track.get("title") or os.path.splitext(os.path.basename(path))[0]
+            songs.append((path, f"{title} - {track['artist']}" if track.get("artist") else title))
+        added_count = self.playlist_model.extend(songs)
+        
+        if removed_rows:
+            self.playlist_store.remove("default", removed)
+        if added_count:
+            self.playlist_store.add("default", [{"name": name, "path": path} for path, name in songs])
+        if removed_rows or added_count:
+            self.status_bar.showMessage(f"音乐库变化：新增 {len(added)}，删除 {len(removed)}", 5000)
+
+    def handle_lyrics_folders_changed(self, folders):
+        """歌词目录变化：当前歌曲尚无歌词时重新尝试加载"""
+        if not self.current_song_path or self.lyrics_sync.lyrics_data:
+            return
+        if os.path.dirname(os.path.normpath(self.current_song_path)) in folders:
+            self.load_lyrics_for_song(self.current_song_path)
+
+    def record_library_play(self, media):
+        """记录本地歌曲的播放历史（供智能播放列表使用）"""
+        file_path = media.canonicalUrl().toLocalFile()
+        if file_path:
+            get_smart_playlist_manager().record_play(os.path.normpath(file_path))
+
+    def handle_waveform_ready(self, file_path, peaks, rms):
+        """波形计算完成，只显示当前歌曲的结果"""
+        if self.media_player.currentMedia().canonicalUrl().toLocalFile() == file_path:
+            self.progress_slider.set_waveform(peaks, rms)
+
         
+    def display_partial_search_results(self, songs):
+        """显示陆续到达的部分搜索结果（不加载封面）"""
+        self.search_generation += 1
+        self.search_results = songs
+        self.results_list.clear()
+        for i, song in enumerate(songs):
+            duration = self.format_time(song["duration"])
+            item = QListWidgetItem(f"{i+1}. {song['name']} - {song['artists']} ({duration})")
+            item.setData(Qt.UserRole, i)
+            self.results_list.addItem(item)
+        self.status_bar.showMessage(f"搜索中... 已获取 {len(songs)} 首")
+
     def display_search_results(self, songs):
         if not songs:
             self.status_bar.showMessage("未找到相关歌曲")
@@ -8354,8 +11878,11 @@ class MusicPlayerApp(QMainWindow):
 
         # 获取当前音源
         current_source = self.source_combo.currentText()
+        # 封面在后台加载，过期的回调通过结果代数丢弃
+        self.search_generation += 1
+        generation = self.search_generation
 
-        if current_source == "网易云音乐":
+        if current_source == "网易云音乐" and not self.federated_check.isChecked():
             logger.info("网易云音源 - 跳过专辑封面获取")
             for i, song in enumerate(songs):
                 duration = self.format_time(song["duration"])
@@ -8364,44 +11891,28 @@ class MusicPlayerApp(QMainWindow):
                 item.setData(Qt.UserRole, i)
                 self.results_list.addItem(item)
         else:
-
-            cache_dir = self.settings["save_paths"]["cache"]
-            if not os.path.exists(cache_dir):
-                os.makedirs(cache_dir, exist_ok=True)
-                logger.info(f"创建缓存目录: {cache_dir}")
             for i, song in enumerate(songs):
                 duration = self.format_time(song["duration"])
                 item_text = f"{i+1}. {song['name']} - {song['artists']} ({duration})"
+                if song.get("sources"):
+                    item_text += f" [{' / '.join(song['sources'])}]"
                 item = QListWidgetItem(item_text)
                 item.setData(Qt.UserRole, i)
+                self.results_list.addItem(item)
                 pic_url = song.get("pic", "")
                 if pic_url:
-                    try:
-                        songid = song.get("id", f"song_{i}")
-                        safe_songid = re.sub(r'[\\/*?:"<>|]', "", songid)
-                        image_path = os.path.join(cache_dir, f"{safe_songid}.jpg")
-                        if not os.path.exists(image_path):
-                            logger.info(f"下载专辑封面: {pic_url}")
-                            response = requests.get(pic_url, stream=True, timeout=10)
-                            if response.status_code == 200:
-                                with open(image_path, 'wb') as f:
-                                    for chunk in response.iter_content(1024):
-                                        f.write(chunk)
-                                logger.info(f"封面保存到: {image_path}")
-                            else:
-                                logger.warning(f"封面下载失败: HTTP {response.status_code}")
-                        if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
-                            pixmap = QPixmap(image_path)
-                            if not pixmap.isNull():
-                                pixmap = pixmap.scaled(100, 100, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                                item.setIcon(QIcon(pixmap))
-                            else:
-                                logger.warning(f"无效的图片文件: {image_path}")
-                        else:
-                            logger.warning(f"图片文件不存在或为空: {image_path}")
-                    except Exception as e:
-                        logger.error(f"加载专辑封面失败: {str(e)}")
-                self.results_list.addItem(item)
+                    self.cover_loader.request(
+                        pic_url, 100,
+                        lambda pixmap, row=i: self.set_result_item_icon(generation, row, pixmap)
+                    )
+
+    def set_result_item_icon(self, generation, row, pixmap):
+        """为搜索结果设置封面（结果列表已刷新时忽略）"""
+        if generation != self.search_generation:
+            return
+        item = self.results_list.item(row)
+        if item is not None:
+            item.setIcon(QIcon(pixmap))
             
     def song_selected(self, item):
         index = item.data(Qt.UserRole)
@@ -8470,14 +11981,8 @@ class MusicPlayerApp(QMainWindow):
         elif state == QMediaPlayer.StoppedState:
             self.play_status.setText("已停止")
     
-        # 原有逻辑保持不变
-        if self.room_manager.current_room:
-            if state == QMediaPlayer.PlayingState:
-                self.room_manager.send_playback_command("play")
-            elif state == QMediaPlayer.PausedState:
-                self.room_manager.send_playback_command("pause")
-            elif state == QMediaPlayer.StoppedState:
-                self.room_manager.send_playback_command("stop")
+        # 音乐室：同步用户操作引起的状态变化
+        self.room_manager.on_local_state_changed(state)
 
     def play_next_song(self):
         if not self.playlist:
@@ -8573,6 +12078,7 @@ class MusicPlayerApp(QMainWindow):
         self.download_worker = MusicWorker()
         self.active_threads.append(self.download_worker)
         self.download_worker.download_progress.connect(self.update_download_progress)
+        self.download_worker.download_speed.connect(self.update_download_speed)
         self.download_worker.download_finished.connect(self.download_completed)
         self.download_worker.finished.connect(lambda: self.remove_thread(self.download_worker))
         self.download_worker.finished.connect(self.remove_download_worker)
@@ -8580,6 +12086,9 @@ class MusicPlayerApp(QMainWindow):
         
     def update_download_progress(self, progress):
         self.progress_dialog.setValue(progress)
+
+    def update_download_speed(self, speed, eta):
+        self.progress_dialog.setLabelText(f"下载歌曲... {format_transfer_rate(speed, eta)}")
         
     def cancel_download(self):
         logger.warning("下载取消: 用户取消")
@@ -8593,6 +12102,7 @@ class MusicPlayerApp(QMainWindow):
         self.status_bar.showMessage("下载已取消")
         
     def download_completed(self, file_path):
+        self.library_watcher.notify_path(file_path)
         self.progress_dialog.close()
         self.status_bar.showMessage(f"歌曲下载完成: {file_path}")
         logger.info(f"下载完成: {file_path}")
@@ -8723,8 +12233,9 @@ class MusicPlayerApp(QMainWindow):
             @self.app.route('/api/search', methods=['GET'])
             def search_songs():
                 keyword = request.args.get('keyword', '')
+                refresh = request.args.get('refresh', '0') in ('1', 'true')
                 self.logger.info(f"搜索歌曲: {keyword}")
-                results = self.main_window.search_songs_remote(keyword)
+                results = self.main_window.search_songs_remote(keyword, refresh)
                 return jsonify(results)
 
             @self.app.route('/api/download', methods=['POST'])
@@ -8889,6 +12400,8 @@ class MusicPlayerApp(QMainWindow):
                 self.play_previous()
             elif isinstance(event, PlayFileEvent):
                 self.play_file_remote(event.file_path)
+            elif isinstance(event, SearchEvent):
+                self.handle_remote_search(event)
             elif isinstance(event, SwitchDeviceEvent):
                 self.switch_playback_device(event.device)
             return super().event(event)
@@ -8922,38 +12435,62 @@ class MusicPlayerApp(QMainWindow):
         }
 
     def list_directory(self, path):
-        """列出目录内容"""
+        """列出目录内容（优先查询音乐库目录，未编目的目录才访问文件系统）"""
+        listing = get_library_catalog().list_folder(path)
+        if listing is not None:
+            folders, tracks = listing
+            items = [
+                {"name": os.path.basename(folder), "type": "directory", "path": folder}
+                for folder in folders
+            ]
+            items.extend(
+                {"name": os.path.basename(track["path"]), "type": "file", "path": track["path"]}
+                for track in tracks
+            )
+            return items
+        
         if not os.path.exists(path):
             return []
             
         items = []
-        for entry in os.listdir(path):
-            full_path = os.path.join(path, entry)
-            if os.path.isdir(full_path):
-                items.append({
-                    "name": entry,
-                    "type": "directory",
-                    "path": full_path
-                })
-            elif entry.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
-                items.append({
-                    "name": entry,
-                    "type": "file",
-                    "path": full_path
-                })
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    items.append({
+                        "name": entry.name,
+                        "type": "directory",
+                        "path": entry.path
+                    })
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    items.append({
+                        "name": entry.name,
+                        "type": "file",
+                        "path": entry.path
+                    })
         return items
 
-    def search_songs_remote(self, keyword):
-        """远程搜索歌曲"""
-        self.search_input.setText(keyword)
-        self.start_search()
-        # 等待搜索完成
-        time.sleep(1)
+    def search_songs_remote(self, keyword, refresh=False):
+        """远程搜索歌曲（在Flask线程中调用，搜索和界面更新交给主线程）"""
+        reply = {"cached": False, "done": threading.Event()}
+        self.post_event(SearchEvent(keyword, refresh, reply))
+        reply["done"].wait(5)
+        if not reply["cached"]:
+            # 未命中缓存，等待搜索完成
+            time.sleep(1)
+        results = list(self.search_results)
         return {
-            "results": self.search_results,
-            "count": len(self.search_results)
+            "results": results,
+            "count": len(results)
         }
 
+    def handle_remote_search(self, event):
+        """在主线程中执行远程搜索请求"""
+        try:
+            self.search_input.setText(event.keyword)
+            event.reply["cached"] = bool(self.start_search(event.refresh))
+        finally:
+            event.reply["done"].set()
+
     def download_song_remote(self, song_id, url):
         """远程下载歌曲"""
         if song_id:
@@ -8974,31 +12511,17 @@ class MusicPlayerApp(QMainWindow):
     
     def get_playlist_for_remote(self):
         """获取播放列表（简化版）"""
-        playlist = []
-        for i in range(self.playlist_widget.count()):
-            item = self.playlist_widget.item(i)
-            playlist.append({
-                "name": item.text(),
-                "path": item.data(Qt.UserRole)
-            })
-        return playlist
+        return self.playlist_model.entries()
     
     def add_to_playlist_remote(self, song_path):
         """远程添加到播放列表"""
         if os.path.exists(song_path):
-            song_name = os.path.basename(song_path)
-            item = QListWidgetItem(song_name)
-            item.setData(Qt.UserRole, song_path)
-            self.playlist_widget.addItem(item)
-            return True
+            return self.playlist_model.append(song_path, os.path.basename(song_path))
         return False
     
     def remove_from_playlist_remote(self, index):
         """从播放列表移除歌曲"""
-        if 0 <= index < self.playlist_widget.count():
-            self.playlist_widget.takeItem(index)
-            return True
-        return False
+        return self.playlist_model.remove_row(index)
 
     def set_sleep_timer(self, minutes):
         """设置睡眠定时器"""
@@ -9196,18 +12719,26 @@ class MusicPlayerApp(QMainWindow):
         if not path.startswith(music_dir):
             return {"error": "访问受限"}
             
+        listing = get_library_catalog().list_folder(path)
+        if listing is not None:
+            files = [
+                {"name": os.path.basename(track["path"]), "path": track["path"], "size": track["size"]}
+                for track in listing[1]
+            ]
+            return {"path": path, "files": files}
+            
         if not os.path.exists(path):
             return {"error": "路径不存在"}
             
         files = []
-        for entry in os.listdir(path):
-            full_path = os.path.join(path, entry)
-            if os.path.isfile(full_path) and entry.lower().endswith(('.mp3', '.wav', '.flac')):
-                files.append({
-                    "name": entry,
-                    "path": full_path,
-                    "size": os.path.getsize(full_path)
-                })
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append({
+                        "name": entry.name,
+                        "path": entry.path,
+                        "size": entry.stat().st_size
+                    })
         return {"path": path, "files": files}
     
     def update_network_status(self):
@@ -9309,10 +12840,265 @@ class MusicPlayerApp(QMainWindow):
         except ImportError:
             QMessageBox.warning(self, "错误", "需要安装qrcode和Pillow库")
 
+# =============== 音乐室/设备同步线路协议 ===============
+class RoomWireProtocol:
+    """房间消息的线路编码。
+
+    客户端在 auth 中列出支持的编码，服务器用 hello 回复选定的编码（hello 本身总是 JSON 文本帧），
+    之后双方使用该编码。msgpack 二进制帧 = 1 字节标志 + 消息体，每条消息编码为 [类型码, 其余字段]；
+    一帧可以顺序拼接多条消息（批量），较大的帧用 deflate 压缩。未安装 msgpack 或客户端不支持时仍用 JSON 文本帧。
+    """
+    # 类型码 = 位置 + 1，两端必须一致，新类型只能追加在末尾
+    MESSAGE_TYPES = (
+        "auth", "hello", "error", "create_room", "join_room", "leave_room", "chat", "playback",
+        "playback_state", "time_sync", "room_update", "room_list", "room_added", "room_removed",
+        "member_count_changed", "request_room_list", "subscribe_rooms", "unsubscribe_rooms",
+        "sync", "connected", "client_joined", "client_left"
+    )
+    TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, 1)}
+    FLAG_DEFLATE = 0x01
+    FLAG_BATCH = 0x02
+    FLAG_JSON = 0x04            # 消息体是 UTF-8 JSON（批量时为 JSON 数组，用于设备同步）
+    COMPRESS_MIN_BYTES = 1024   # 小于此大小的帧不压缩
+    MAX_BATCH = 64              # 一帧最多合并的消息数
+    MAX_STREAM_FRAME = 16 * 1024 * 1024  # TCP 流上单帧的长度上限
+    MAX_DECODED_BYTES = 16 * 1024 * 1024  # 解压后单帧的长度上限，防止小帧解压出巨量数据
+
+    @staticmethod
+    def supported_encodings():
+        return ["msgpack", "json"] if MSGPACK_ENABLED else ["json"]
+
+    @classmethod
+    def negotiate(cls, offered):
+        """按客户端的偏好顺序选择双方都支持的编码"""
+        supported = cls.supported_encodings()
+        for encoding in offered or ():
+            if encoding in supported:
+                return encoding
+        return "json"
+
+    @classmethod
+    def pack(cls, message, encoding="msgpack"):
+        """编码一条消息（不含帧头）；发给多个接收者时每种编码只需编码一次"""
+        if encoding == "json":
+            return json.dumps(message)
+        fields = dict(message)
+        code = cls.TYPE_CODES.get(fields.get("type"), 0)
+        if code:
+            del fields["type"]
+        return msgpack.packb([code, fields], use_bin_type=True)
+
+    @classmethod
+    def frame(cls, bodies, flags=0):
+        """把一条或多条已编码的 msgpack 消息组成一个二进制帧"""
+        if len(bodies) > 1:
+            flags |= cls.FLAG_BATCH
+        payload = b"".join(bodies)
+        if len(payload) >= cls.COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(payload, 6)
+            if len(compressed) < len(payload):
+                flags |= cls.FLAG_DEFLATE
+                payload = compressed
+        return bytes((flags,)) + payload
+
+    @classmethod
+    def encode_frame(cls, messages, encoding="msgpack"):
+        """把消息列表编码成一个二进制帧（JSON 编码时置 FLAG_JSON）"""
+        if encoding == "json":
+            body = messages if len(messages) > 1 else messages[0]
+            flags = cls.FLAG_JSON | (cls.FLAG_BATCH if len(messages) > 1 else 0)
+            return cls.frame([json.dumps(body, ensure_ascii=False).encode("utf-8")], flags)
+        return cls.frame([cls.pack(message) for message in messages])
+
+    @classmethod
+    def decode_frame(cls, data):
+        """解码一个二进制帧，返回其中的消息列表"""
+        if not data:
+            return []
+        flags = data[0]
+        payload = bytes(data[1:])
+        if flags & cls.FLAG_DEFLATE:
+            # 帧来自客户端，限制解压后的大小；多解出 1 字节用来判断是否超限
+            inflater = zlib.decompressobj()
+            payload = inflater.decompress(payload, cls.MAX_DECODED_BYTES + 1)
+            if len(payload) > cls.MAX_DECODED_BYTES or inflater.unconsumed_tail:
+                raise ValueError(f"解压后的帧超过 {cls.MAX_DECODED_BYTES} 字节")
+        if flags & cls.FLAG_JSON:
+            decoded = json.loads(payload.decode("utf-8"))
+            return decoded if flags & cls.FLAG_BATCH else [decoded]
+        if not MSGPACK_ENABLED:
+            raise ValueError("收到 msgpack 帧，但未安装 msgpack")
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(payload)
+        messages = []
+        for code, fields in unpacker:
+            if 0 < code <= len(cls.MESSAGE_TYPES):
+                fields["type"] = cls.MESSAGE_TYPES[code - 1]
+            messages.append(fields)
+        return messages
+
+    @classmethod
+    def decode(cls, message):
+        """解码一个 WebSocket 消息：文本帧是单条 JSON，二进制帧按标志解码"""
+        if isinstance(message, str):
+            return [json.loads(message)]
+        return cls.decode_frame(message)
+
+    @staticmethod
+    def stream_frame(frame):
+        """TCP 流上的帧：4 字节大端长度前缀 + 帧"""
+        return struct.pack("!I", len(frame)) + frame
+
+    @classmethod
+    def read_stream(cls, buffer):
+        """从接收缓冲区取出所有完整的帧，返回 (消息列表, 剩余字节)"""
+        messages = []
+        while len(buffer) >= 4:
+            (length,) = struct.unpack_from("!I", buffer)
+            if length > cls.MAX_STREAM_FRAME:
+                raise ValueError(f"帧过大: {length} 字节")
+            if len(buffer) < 4 + length:
+                break
+            messages.extend(cls.decode_frame(buffer[4:4 + length]))
+            buffer = buffer[4 + length:]
+        return messages, buffer
+
+# =============== 音乐室广播 ===============
+class RoomClientConnection:
+    """单个客户端的发送端：有界发送队列 + 独立写协程。
+
+    广播只把已序列化的消息放进队列，不等待网络；队列满说明客户端消费不过来，直接断开它，
+    避免一个慢客户端拖住其他人。
+    """
+    def __init__(self, user_id, websocket, max_queue=256, on_evict=None):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.on_evict = on_evict
+        self.encoding = "json"
+        self.closed = False
+        self.writer = asyncio.ensure_future(self._write_loop())
+
+    def send(self, payload):
+        """非阻塞入队，返回是否成功"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"客户端 {self.user_id} 发送队列溢出，断开连接")
+            self.evict(1013, "发送队列溢出")
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                payload = await self.queue.get()
+                if isinstance(payload, bytes):
+                    # 二进制连接：把已经在队列里的消息合并成一帧发送
+                    # （编码只在认证时切换一次，之后队列里都是同一种负载）
+                    bodies = [payload]
+                    while len(bodies) < RoomWireProtocol.MAX_BATCH and not self.queue.empty():
+                        bodies.append(self.queue.get_nowait())
+                    payload = RoomWireProtocol.frame(bodies)
+                await self.websocket.send(payload)
+        except asyncio.CancelledError:
+            pass
+        except websockets.exceptions.ConnectionClosed:
+            self.close()
+        except Exception as e:
+            logger.warning(f"发送给客户端 {self.user_id} 失败: {str(e)}")
+            self.evict(1011, "发送失败")
+
+    def evict(self, code, reason):
+        """关闭连接并通知所属的广播中心"""
+        if self.closed:
+            return
+        self.close()
+        if self.on_evict:
+            self.on_evict(self)
+        asyncio.ensure_future(self.websocket.close(code=code, reason=reason))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+
+class RoomBroadcastHub:
+    """广播中心：每条消息只序列化一次，再放入各接收者的发送队列"""
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self.clients = {}  # user_id -> RoomClientConnection
+
+    def __contains__(self, user_id):
+        return user_id in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def register(self, user_id, websocket):
+        old = self.clients.get(user_id)
+        if old is not None and old.websocket is websocket and not old.closed:
+            # 同一连接重复认证，沿用原来的发送端
+            return old
+        if old is not None and old.websocket is not websocket:
+            # 同一用户重新连接，旧连接作废
+            old.evict(1000, "已在其他连接登录")
+        client = RoomClientConnection(user_id, websocket, self.max_queue, on_evict=self._evicted)
+        self.clients[user_id] = client
+        return client
+
+    def unregister(self, user_id, websocket):
+        client = self.clients.get(user_id)
+        if client is not None and client.websocket is websocket:
+            del self.clients[user_id]
+            client.close()
+
+    def _evicted(self, client):
+        if self.clients.get(client.user_id) is client:
+            del self.clients[client.user_id]
+
+    def set_encoding(self, user_id, encoding):
+        client = self.clients.get(user_id)
+        if client is not None:
+            client.encoding = encoding
+
+    @staticmethod
+    def encode(message, encoding="json"):
+        if isinstance(message, (str, bytes)):
+            return message
+        return RoomWireProtocol.pack(message, encoding)
+
+    def send(self, user_id, message):
+        client = self.clients.get(user_id)
+        return client is not None and client.send(self.encode(message, client.encoding))
+
+    def broadcast(self, message, user_ids=None, exclude_user=None):
+        """发送给 user_ids 中的用户（默认所有人），返回成功入队的数量"""
+        payloads = {}  # 编码 -> 负载：每种编码只序列化一次
+        targets = list(self.clients) if user_ids is None else list(user_ids)
+        sent = 0
+        for user_id in targets:
+            if user_id == exclude_user:
+                continue
+            client = self.clients.get(user_id)
+            if client is None:
+                continue
+            payload = payloads.get(client.encoding)
+            if payload is None:
+                payload = payloads[client.encoding] = self.encode(message, client.encoding)
+            if client.send(payload):
+                sent += 1
+        return sent
+
 class MusicRoomServer(QObject):
     started = pyqtSignal(int)  # 信号：服务器启动成功，参数为端口号
     stopped = pyqtSignal()     # 信号：服务器停止
     error_occurred = pyqtSignal(str)  # 信号：发生错误
+    # 会改变房间权威播放状态的命令，其余命令（音量、切歌等）直接转发
+    STATE_COMMANDS = ("load_song", "play", "pause", "stop", "seek")
     
     def __init__(self, port=5001, parent=None):
         super().__init__(parent)
@@ -9322,7 +13108,10 @@ class MusicRoomServer(QObject):
         self.running = False
         self.rooms = {}
         self.user_rooms = {}
-        self.connections = {}
+        self.connections = RoomBroadcastHub()
+        # 房间目录：版本号随每个增量事件递增，客户端发现版本不连续时请求完整快照
+        self.directory_version = 0
+        self.directory_subscribers = set()
         self.music_room_server = None 
         
     def is_running(self):
@@ -9395,169 +13184,235 @@ class MusicRoomServer(QObject):
         try:
             async for message in websocket:
                 try:
-                    data = json.loads(message)
-                    message_type = data.get("type")
-                    
-                    if message_type == "auth":
-                        user_id = data.get("user_id", str(uuid.uuid4()))
-                        self.connections[user_id] = websocket
-                        await self.send_room_list(user_id)
-                        
-                    elif message_type == "create_room":
-                        room_name = data.get("name", "未命名房间")
-                        room_id = str(uuid.uuid4())
-                        self.rooms[room_id] = {
-                            "id": room_id,
-                            "name": room_name,
-                            "owner": user_id,
-                            "users": [user_id]
-                        }
-                        self.user_rooms[user_id] = room_id
-                        await self.broadcast_room_list()
-                        await self.notify_room_update(room_id, "created", user_id)
+                    messages = RoomWireProtocol.decode(message)
+                except Exception as e:
+                    logger.error(f"解码消息错误: {str(e)}")
+                    continue
+                for data in messages:
+                    try:
+                        message_type = data.get("type")
                         
-                    elif message_type == "join_room":
-                        room_id = data.get("room_id")
-                        if room_id in self.rooms:
-                            self.rooms[room_id]["users"].append(user_id)
+                        if message_type == "auth":
+                            new_user_id = data.get("user_id", str(uuid.uuid4()))
+                            if user_id and new_user_id != user_id:
+                                # 同一连接换用户登录：先释放旧身份
+                                await self.release_connection(user_id, websocket)
+                            user_id = new_user_id
+                            self.connections.register(user_id, websocket)
+                            if "encodings" in data:
+                                # 协商编码：hello 仍以 JSON 发出，之后的消息使用选定的编码
+                                encoding = RoomWireProtocol.negotiate(data["encodings"])
+                                self.connections.send(user_id, {"type": "hello", "encoding": encoding})
+                                self.connections.set_encoding(user_id, encoding)
+                            if data.get("subscribe_rooms", True):
+                                await self.send_room_list(user_id)
+                            
+                        elif message_type == "create_room":
+                            room_name = data.get("name", "未命名房间")
+                            room_id = str(uuid.uuid4())
+                            self.rooms[room_id] = {
+                                "id": room_id,
+                                "name": room_name,
+                                "owner": user_id,
+                                "users": [user_id]
+                            }
                             self.user_rooms[user_id] = room_id
-                            await self.broadcast_room_list()
-                            await self.notify_room_update(room_id, "user_joined", user_id)
+                            self.publish_directory("room_added", room=self.room_summary(self.rooms[room_id]))
+                            await self.notify_room_update(room_id, "created", user_id)
                             
-                    elif message_type == "leave_room":
-                        if user_id in self.user_rooms:
-                            room_id = self.user_rooms[user_id]
+                        elif message_type == "join_room":
+                            room_id = data.get("room_id")
                             if room_id in self.rooms:
-                                if user_id in self.rooms[room_id]["users"]:
-                                    self.rooms[room_id]["users"].remove(user_id)
-                                del self.user_rooms[user_id]
+                                # 重连后再次加入时用户仍在房间内，不重复添加
+                                if user_id not in self.rooms[room_id]["users"]:
+                                    self.rooms[room_id]["users"].append(user_id)
+                                    self.publish_member_count(room_id)
+                                self.user_rooms[user_id] = room_id
+                                await self.notify_room_update(room_id, "user_joined", user_id)
+                                if self.rooms[room_id].get("playback"):
+                                    self.connections.send(user_id, self.playback_state_message(room_id))
                                 
-                                # 如果房间为空，关闭房间
-                                if not self.rooms[room_id]["users"]:
-                                    del self.rooms[room_id]
-                                    await self.broadcast_room_list()
-                                    await self.notify_room_update(room_id, "closed", user_id)
-                                else:
-                                    await self.broadcast_room_list()
-                                    await self.notify_room_update(room_id, "user_left", user_id)
-                        
-                    elif message_type == "chat":
-                        if user_id in self.user_rooms:
-                            room_id = self.user_rooms[user_id]
-                            await self.broadcast_message(room_id, {
-                                "type": "chat",
-                                "user_id": user_id,
-                                "message": data.get("message", ""),
-                                "timestamp": int(time.time())
+                        elif message_type == "leave_room":
+                            await self.leave_room(user_id)
+                            
+                        elif message_type == "chat":
+                            if user_id in self.user_rooms:
+                                room_id = self.user_rooms[user_id]
+                                await self.broadcast_message(room_id, {
+                                    "type": "chat",
+                                    "user_id": user_id,
+                                    "message": data.get("message", ""),
+                                    "timestamp": int(time.time())
+                                })
+                                
+                        elif message_type == "time_sync":
+                            # NTP 式时钟同步：回送客户端发送时间 t0 和服务器收到/发出的时间 t1、t2
+                            received = self.now_ms()
+                            self.connections.send(user_id, {
+                                "type": "time_sync",
+                                "t0": data.get("t0"),
+                                "t1": received,
+                                "t2": self.now_ms()
                             })
                             
-                    elif message_type == "playback":
-                        if user_id in self.user_rooms:
-                            room_id = self.user_rooms[user_id]
-                            await self.broadcast_message(room_id, {
-                                "type": "playback",
-                                "user_id": user_id,
-                                "command": data.get("command"),
-                                "position": data.get("position"),
-                                "volume": data.get("volume"),
-                                "song_path": data.get("song_path")
-                            }, exclude_user=user_id)
+                        elif message_type == "playback":
+                            if user_id in self.user_rooms:
+                                room_id = self.user_rooms[user_id]
+                                if data.get("command") in self.STATE_COMMANDS:
+                                    self.update_playback_state(room_id, user_id, data)
+                                    continue
+                                await self.broadcast_message(room_id, {
+                                    "type": "playback",
+                                    "room_id": room_id,
+                                    "user_id": user_id,
+                                    "command": data.get("command"),
+                                    "position": data.get("position"),
+                                    "volume": data.get("volume"),
+                                    "song_path": data.get("song_path")
+                                }, exclude_user=user_id)
+                                
+                        elif message_type in ("request_room_list", "subscribe_rooms"):
+                            # 订阅房间目录，并以完整快照作为起点（也用于客户端重新同步）
+                            await self.send_room_list(user_id)
+                            
+                        elif message_type == "unsubscribe_rooms":
+                            self.directory_subscribers.discard(user_id)
                             
-                    elif message_type == "request_room_list":
-                        await self.send_room_list(user_id)
+                    except Exception as e:
+                        logger.error(f"处理消息错误: {str(e)}")
                         
-                except Exception as e:
-                    logger.error(f"处理消息错误: {str(e)}")
-                    
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
-            # 清理连接
-            if user_id and user_id in self.connections:
-                del self.connections[user_id]
-                
+            if user_id:
+                await self.release_connection(user_id, websocket)
+    
+    async def release_connection(self, user_id, websocket):
+        """注销连接；同一用户已在新连接上登录时保留目录订阅和所在房间"""
+        self.connections.unregister(user_id, websocket)
+        if user_id not in self.connections:
+            self.directory_subscribers.discard(user_id)
             # 用户离开房间
-            if user_id and user_id in self.user_rooms:
-                room_id = self.user_rooms[user_id]
-                if room_id in self.rooms:
-                    if user_id in self.rooms[room_id]["users"]:
-                        self.rooms[room_id]["users"].remove(user_id)
-                    del self.user_rooms[user_id]
-                    
-                    # 如果房间为空，关闭房间
-                    if not self.rooms[room_id]["users"]:
-                        del self.rooms[room_id]
-                        asyncio.run_coroutine_threadsafe(self.broadcast_room_list(), self.loop)
-                        asyncio.run_coroutine_threadsafe(
-                            self.notify_room_update(room_id, "closed", user_id), 
-                            self.loop
-                        )
-                    else:
-                        asyncio.run_coroutine_threadsafe(self.broadcast_room_list(), self.loop)
-                        asyncio.run_coroutine_threadsafe(
-                            self.notify_room_update(room_id, "user_left", user_id), 
-                            self.loop
-                        )
+            await self.leave_room(user_id)
+    
+    async def leave_room(self, user_id):
+        """用户离开所在房间，房间为空时关闭"""
+        room_id = self.user_rooms.pop(user_id, None)
+        if room_id not in self.rooms:
+            return
+        if user_id in self.rooms[room_id]["users"]:
+            self.rooms[room_id]["users"].remove(user_id)
+            
+        # 如果房间为空，关闭房间
+        if not self.rooms[room_id]["users"]:
+            del self.rooms[room_id]
+            self.publish_directory("room_removed", room_id=room_id)
+            await self.notify_room_update(room_id, "closed", user_id)
+        else:
+            self.publish_member_count(room_id)
+            await self.notify_room_update(room_id, "user_left", user_id)
+    
+    @staticmethod
+    def now_ms():
+        """服务器时钟（单调时钟，毫秒），所有播放状态都以它为基准"""
+        return time.monotonic() * 1000
+    
+    def update_playback_state(self, room_id, user_id, data):
+        """根据播放命令更新房间的权威播放状态：歌曲 T 在服务器时间 S 处于位置 P，以速率 R 播放"""
+        room = self.rooms[room_id]
+        now = self.now_ms()
+        state = room.get("playback") or {
+            "song_path": None, "state": "stopped", "position": 0, "server_time": now, "rate": 1.0, "version": 0
+        }
+        command = data.get("command")
+        # 客户端给出采样位置时对应的服务器时间，偏差过大（时钟未同步）时改用收到的时间
+        at = data.get("at")
+        anchor = at if isinstance(at, (int, float)) and abs(at - now) < 10000 else now
+        position = data.get("position") or 0
+        rate = data.get("rate") or state["rate"]
+        song_path = state["song_path"]
+        
+        if command == "load_song":
+            song_path = data.get("song_path")
+            playback = "playing"
+            position = 0
+        elif command == "play":
+            playback = "playing"
+        elif command == "pause":
+            playback = "paused"
+        elif command == "stop":
+            playback = "stopped"
+            position = 0
+        else:  # seek：保持原来的播放/暂停状态
+            playback = state["state"]
+        
+        room["playback"] = {
+            "song_path": song_path,
+            "state": playback,
+            "position": position,
+            "server_time": anchor,
+            "rate": rate,
+            "version": state["version"] + 1
+        }
+        message = self.playback_state_message(room_id)
+        message["user_id"] = user_id
+        self.connections.broadcast(message, room["users"])
+    
+    def playback_state_message(self, room_id):
+        message = {"type": "playback_state", "room_id": room_id}
+        message.update(self.rooms[room_id]["playback"])
+        return message
+    
+    @staticmethod
+    def room_summary(room):
+        """房间目录中的条目：不含成员列表，只有人数"""
+        return {
+            "id": room["id"],
+            "name": room["name"],
+            "owner": room["owner"],
+            "member_count": len(room["users"])
+        }
+    
+    def publish_directory(self, event, **fields):
+        """向订阅房间目录的客户端发送一条带版本号的增量事件"""
+        self.directory_version += 1
+        message = {"type": event, "version": self.directory_version}
+        message.update(fields)
+        self.connections.broadcast(message, self.directory_subscribers)
+    
+    def publish_member_count(self, room_id):
+        self.publish_directory(
+            "member_count_changed", room_id=room_id, member_count=len(self.rooms[room_id]["users"])
+        )
     
     async def send_room_list(self, user_id):
-        """发送房间列表给指定用户"""
-        if user_id in self.connections:
-            room_list = list(self.rooms.values())
-            await self.connections[user_id].send(json.dumps({
-                "type": "room_list",
-                "rooms": room_list
-            }))
-    
-    async def broadcast_room_list(self):
-        """广播房间列表给所有用户"""
-        room_list = list(self.rooms.values())
-        message = json.dumps({
+        """发送房间目录快照给指定用户，并订阅之后的增量事件"""
+        self.directory_subscribers.add(user_id)
+        self.connections.send(user_id, {
             "type": "room_list",
-            "rooms": room_list
+            "version": self.directory_version,
+            "rooms": [self.room_summary(room) for room in self.rooms.values()]
         })
-        
-        for user_id, ws in self.connections.items():
-            try:
-                await ws.send(message)
-            except:
-                pass
     
     async def notify_room_update(self, room_id, action, user_id):
         """通知房间更新"""
         if room_id not in self.rooms:
             return
             
-        message = json.dumps({
+        self.connections.broadcast({
             "type": "room_update",
             "room_id": room_id,
             "action": action,
             "user_id": user_id,
             "users": self.rooms[room_id]["users"]
-        })
-        
-        for room_user_id in self.rooms[room_id]["users"]:
-            if room_user_id in self.connections:
-                try:
-                    await self.connections[room_user_id].send(message)
-                except:
-                    pass
+        }, self.rooms[room_id]["users"])
     
     async def broadcast_message(self, room_id, message, exclude_user=None):
         """广播消息给房间内所有用户"""
         if room_id not in self.rooms:
             return
             
-        message_json = json.dumps(message)
-        
-        for user_id in self.rooms[room_id]["users"]:
-            if user_id == exclude_user:
-                continue
-                
-            if user_id in self.connections:
-                try:
-                    await self.connections[user_id].send(message_json)
-                except:
-                    pass
+        self.connections.broadcast(message, self.rooms[room_id]["users"], exclude_user=exclude_user)
 
 # =============== 歌词渲染函数 ===============
 def draw_lyrics(
@@ -9626,6 +13481,8 @@ def draw_lyrics(
 
 # =============== 主程序入口 ===============
 if __name__ == "__main__":
+    # 打包后特征提取进程池需要
+    multiprocessing.freeze_support()
     try:
         os.environ["QT_MULTIMEDIA_PREFERRED_PLUGINS"] = "windowsmediafoundation"
         app = QApplication(sys.argv)
@@ -1,184 +1,877 @@
 # music_room_server.py
+import argparse
 import asyncio
+import copy
 import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
 import time
 import uuid
+import zlib
 from collections import defaultdict
 import websockets
+try:
+    import msgpack
+    MSGPACK_ENABLED = True
+except ImportError:
+    MSGPACK_ENABLED = False
 
-class MusicRoomServer:
+logger = logging.getLogger("MusicRoomServer")
+
+
+# =============== 线路协议 ===============
+class WireProtocol:
+    """房间消息的线路编码。
+
+    客户端在 auth 中列出支持的编码，服务器用 hello 回复选定的编码（hello 本身总是 JSON 文本帧），
+    之后双方使用该编码。msgpack 二进制帧 = 1 字节标志 + 消息体，每条消息编码为 [类型码, 其余字段]；
+    一帧可以顺序拼接多条消息（批量），较大的帧用 deflate 压缩。未安装 msgpack 或客户端不支持时仍用 JSON 文本帧。
+    """
+    # 类型码 = 位置 + 1，两端必须一致，新类型只能追加在末尾
+    MESSAGE_TYPES = (
+        "auth", "hello", "error", "create_room", "join_room", "leave_room", "chat", "playback",
+        "playback_state", "time_sync", "room_update", "room_list", "room_added", "room_removed",
+        "member_count_changed", "request_room_list", "subscribe_rooms", "unsubscribe_rooms",
+        "sync", "connected", "client_joined", "client_left"
+    )
+    TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, 1)}
+    FLAG_DEFLATE = 0x01
+    FLAG_BATCH = 0x02
+    FLAG_JSON = 0x04            # 消息体是 UTF-8 JSON（批量时为 JSON 数组）
+    COMPRESS_MIN_BYTES = 1024   # 小于此大小的帧不压缩
+    MAX_BATCH = 64              # 一帧最多合并的消息数
+    MAX_DECODED_BYTES = 16 * 1024 * 1024  # 解压后单帧的长度上限，防止小帧解压出巨量数据
+
+    @staticmethod
+    def supported_encodings():
+        return ["msgpack", "json"] if MSGPACK_ENABLED else ["json"]
+
+    @classmethod
+    def negotiate(cls, offered):
+        """按客户端的偏好顺序选择双方都支持的编码"""
+        supported = cls.supported_encodings()
+        for encoding in offered or ():
+            if encoding in supported:
+                return encoding
+        return "json"
+
+    @classmethod
+    def pack(cls, message, encoding="msgpack"):
+        """编码一条消息（不含帧头）；发给多个接收者时每种编码只需编码一次"""
+        if encoding == "json":
+            return json.dumps(message)
+        fields = dict(message)
+        code = cls.TYPE_CODES.get(fields.get("type"), 0)
+        if code:
+            del fields["type"]
+        return msgpack.packb([code, fields], use_bin_type=True)
+
+    @classmethod
+    def frame(cls, bodies, flags=0):
+        """把一条或多条已编码的 msgpack 消息组成一个二进制帧"""
+        if len(bodies) > 1:
+            flags |= cls.FLAG_BATCH
+        payload = b"".join(bodies)
+        if len(payload) >= cls.COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(payload, 6)
+            if len(compressed) < len(payload):
+                flags |= cls.FLAG_DEFLATE
+                payload = compressed
+        return bytes((flags,)) + payload
+
+    @classmethod
+    def encode_frame(cls, messages, encoding="msgpack"):
+        """把消息列表编码成一个二进制帧（JSON 编码时置 FLAG_JSON）"""
+        if encoding == "json":
+            body = messages if len(messages) > 1 else messages[0]
+            flags = cls.FLAG_JSON | (cls.FLAG_BATCH if len(messages) > 1 else 0)
+            return cls.frame([json.dumps(body, ensure_ascii=False).encode("utf-8")], flags)
+        return cls.frame([cls.pack(message) for message in messages])
+
+    @classmethod
+    def decode_frame(cls, data):
+        """解码一个二进制帧，返回其中的消息列表"""
+        if not data:
+            return []
+        flags = data[0]
+        payload = bytes(data[1:])
+        if flags & cls.FLAG_DEFLATE:
+            # 帧来自客户端，限制解压后的大小；多解出 1 字节用来判断是否超限
+            inflater = zlib.decompressobj()
+            payload = inflater.decompress(payload, cls.MAX_DECODED_BYTES + 1)
+            if len(payload) > cls.MAX_DECODED_BYTES or inflater.unconsumed_tail:
+                raise ValueError(f"解压后的帧超过 {cls.MAX_DECODED_BYTES} 字节")
+        if flags & cls.FLAG_JSON:
+            decoded = json.loads(payload.decode("utf-8"))
+            return decoded if flags & cls.FLAG_BATCH else [decoded]
+        if not MSGPACK_ENABLED:
+            raise ValueError("收到 msgpack 帧，但未安装 msgpack")
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(payload)
+        messages = []
+        for code, fields in unpacker:
+            if 0 < code <= len(cls.MESSAGE_TYPES):
+                fields["type"] = cls.MESSAGE_TYPES[code - 1]
+            messages.append(fields)
+        return messages
+
+    @classmethod
+    def decode(cls, message):
+        """解码一个 WebSocket 消息：文本帧是单条 JSON，二进制帧按标志解码"""
+        if isinstance(message, str):
+            return [json.loads(message)]
+        return cls.decode_frame(message)
+
+
+# =============== 广播 ===============
+class ClientConnection:
+    """单个客户端的发送端：有界发送队列 + 独立写协程。
+
+    广播只把已序列化的消息放进队列，不等待网络；队列满说明客户端消费不过来，直接断开它，
+    避免一个慢客户端拖住其他人。
+    """
+    def __init__(self, user_id, websocket, max_queue=256, on_evict=None):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.on_evict = on_evict
+        self.encoding = "json"
+        self.closed = False
+        self.writer = asyncio.ensure_future(self._write_loop())
+
+    def send(self, payload):
+        """非阻塞入队，返回是否成功"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"客户端 {self.user_id} 发送队列溢出，断开连接")
+            self.evict(1013, "发送队列溢出")
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                payload = await self.queue.get()
+                if isinstance(payload, bytes):
+                    # 二进制连接：把已经在队列里的消息合并成一帧发送
+                    # （编码只在认证时切换一次，之后队列里都是同一种负载）
+                    bodies = [payload]
+                    while len(bodies) < WireProtocol.MAX_BATCH and not self.queue.empty():
+                        bodies.append(self.queue.get_nowait())
+                    payload = WireProtocol.frame(bodies)
+                await self.websocket.send(payload)
+        except asyncio.CancelledError:
+            pass
+        except websockets.exceptions.ConnectionClosed:
+            self.close()
+        except Exception as e:
+            logger.warning(f"发送给客户端 {self.user_id} 失败: {e}")
+            self.evict(1011, "发送失败")
+
+    def evict(self, code, reason):
+        """关闭连接并通知所属的广播中心"""
+        if self.closed:
+            return
+        self.close()
+        if self.on_evict:
+            self.on_evict(self)
+        asyncio.ensure_future(self.websocket.close(code=code, reason=reason))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+
+
+class BroadcastHub:
+    """广播中心：每条消息只序列化一次，再放入各接收者的发送队列"""
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self.clients = {}  # user_id -> ClientConnection
+
+    def __contains__(self, user_id):
+        return user_id in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def register(self, user_id, websocket):
+        old = self.clients.get(user_id)
+        if old is not None and old.websocket is websocket and not old.closed:
+            # 同一连接重复认证，沿用原来的发送端
+            return old
+        if old is not None and old.websocket is not websocket:
+            # 同一用户重新连接，旧连接作废
+            old.evict(1000, "已在其他连接登录")
+        client = ClientConnection(user_id, websocket, self.max_queue, on_evict=self._evicted)
+        self.clients[user_id] = client
+        return client
+
+    def unregister(self, user_id, websocket):
+        client = self.clients.get(user_id)
+        if client is not None and client.websocket is websocket:
+            del self.clients[user_id]
+            client.close()
+
+    def _evicted(self, client):
+        if self.clients.get(client.user_id) is client:
+            del self.clients[client.user_id]
+
+    def set_encoding(self, user_id, encoding):
+        client = self.clients.get(user_id)
+        if client is not None:
+            client.encoding = encoding
+
+    @staticmethod
+    def encode(message, encoding="json"):
+        if isinstance(message, (str, bytes)):
+            return message
+        return WireProtocol.pack(message, encoding)
+
+    def send(self, user_id, message):
+        client = self.clients.get(user_id)
+        return client is not None and client.send(self.encode(message, client.encoding))
+
+    def broadcast(self, message, user_ids=None, exclude_user=None):
+        """发送给 user_ids 中的用户（默认所有人），返回成功入队的数量"""
+        payloads = {}  # 编码 -> 负载：每种编码只序列化一次
+        targets = list(self.clients) if user_ids is None else list(user_ids)
+        sent = 0
+        for user_id in targets:
+            if user_id == exclude_user:
+                continue
+            client = self.clients.get(user_id)
+            if client is None:
+                continue
+            payload = payloads.get(client.encoding)
+            if payload is None:
+                payload = payloads[client.encoding] = self.encode(message, client.encoding)
+            if client.send(payload):
+                sent += 1
+        return sent
+
+
+# =============== 状态后端 ===============
+def shard_for(room_id, shard_count):
+    """房间的归属分片：对房间ID做稳定哈希（所有进程、节点结果一致）"""
+    return zlib.crc32(room_id.encode("utf-8")) % shard_count
+
+
+class InProcessBackend:
+    """进程内后端：房间状态保存在字典里，发布时直接调用本进程的订阅者。
+
+    单进程运行时使用；测试时多个分片可以共享同一个实例。
+    """
     def __init__(self):
         self.rooms = {}
-        self.user_rooms = {}
-        self.connections = defaultdict(dict)
-        
+        self.directory_version = 0
+        self.subscribers = defaultdict(list)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_room(self, room_id):
+        room = self.rooms.get(room_id)
+        return copy.deepcopy(room) if room else None
+
+    async def save_room(self, room):
+        self.rooms[room["id"]] = copy.deepcopy(room)
+
+    async def delete_room(self, room_id):
+        self.rooms.pop(room_id, None)
+
+    async def list_rooms(self):
+        return [copy.deepcopy(room) for room in self.rooms.values()]
+
+    async def publish_versioned(self, channel, message):
+        """分配下一个目录版本号并发布，两步之间不会插入其他目录事件"""
+        self.directory_version += 1
+        message["version"] = self.directory_version
+        await self.publish(channel, message)
+
+    async def get_directory_version(self):
+        return self.directory_version
+
+    def subscribe(self, channel, callback):
+        self.subscribers[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        callbacks = self.subscribers.get(channel)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.subscribers[channel]
+
+    async def publish(self, channel, message):
+        for callback in list(self.subscribers.get(channel, ())):
+            await callback(message)
+
+
+class SQLiteBackend(InProcessBackend):
+    """SQLite 后端：同一台机器上的多个工作进程共享一个数据库文件。
+
+    房间状态和目录版本存在表里；发布/订阅用追加写的事件表加轮询实现。
+    它是 Redis 之类外部服务的本地替身，用于测试多进程部署，不适合跨节点。
+    """
+    def __init__(self, path, poll_interval=0.01, retention=30):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.conn = None
+        self.last_event_id = 0
+        self.poll_task = None
+
+    @staticmethod
+    def reset(path):
+        """删除旧数据库（房间只在服务器运行期间有效）"""
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    async def start(self):
+        self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rooms (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('directory_version', 0)")
+        self.last_event_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        self.poll_task = asyncio.ensure_future(self._poll_loop())
+
+    async def close(self):
+        if self.poll_task:
+            self.poll_task.cancel()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    async def get_room(self, room_id):
+        row = self.conn.execute("SELECT data FROM rooms WHERE id = ?", (room_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def save_room(self, room):
+        self.conn.execute("INSERT OR REPLACE INTO rooms (id, data) VALUES (?, ?)", (room["id"], json.dumps(room)))
+
+    async def delete_room(self, room_id):
+        self.conn.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+
+    async def list_rooms(self):
+        return [json.loads(row[0]) for row in self.conn.execute("SELECT data FROM rooms")]
+
+    async def publish_versioned(self, channel, message):
+        # 版本号递增和事件写入在同一个写事务中完成，事件ID的顺序就是版本号的顺序
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'directory_version'")
+            message["version"] = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'directory_version'"
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO events (channel, payload, created) VALUES (?, ?, ?)",
+                (channel, json.dumps(message), time.time())
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    async def get_directory_version(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'directory_version'").fetchone()[0]
+
+    async def publish(self, channel, message):
+        # 本进程的订阅者也通过轮询收到，保证所有进程看到相同的事件顺序
+        self.conn.execute(
+            "INSERT INTO events (channel, payload, created) VALUES (?, ?, ?)",
+            (channel, json.dumps(message), time.time())
+        )
+
+    async def _poll_loop(self):
+        last_prune = time.monotonic()
+        while True:
+            rows = []
+            try:
+                rows = self.conn.execute(
+                    "SELECT id, channel, payload FROM events WHERE id > ? ORDER BY id LIMIT 1000",
+                    (self.last_event_id,)
+                ).fetchall()
+                for event_id, channel, payload in rows:
+                    self.last_event_id = event_id
+                    callbacks = self.subscribers.get(channel)
+                    if callbacks:
+                        message = json.loads(payload)
+                        for callback in list(callbacks):
+                            await callback(message)
+                if time.monotonic() - last_prune > 1:
+                    last_prune = time.monotonic()
+                    self.conn.execute("DELETE FROM events WHERE created < ?", (time.time() - self.retention,))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"读取事件失败: {e}")
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
+
+
+# =============== 音乐室服务器 ===============
+class MusicRoomServer:
+    """音乐室服务器（一个分片）。
+
+    每个房间按ID哈希归属一个分片，房间状态只由归属分片修改；客户端可以连接任意分片，
+    房间相关的请求经后端发布到归属分片的请求频道，房间内的事件发布到房间频道，
+    由各分片投递给本进程中的房间成员。单进程时分片数为 1，所有请求都在本地处理。
+    """
+    # 会改变房间权威播放状态的命令，其余命令（音量、切歌等）直接转发
+    STATE_COMMANDS = ("load_song", "play", "pause", "stop", "seek")
+    DIRECTORY_CHANNEL = "directory"
+    
+    def __init__(self, max_queue=256, backend=None, shard_id=0, shard_count=1):
+        self.backend = backend or InProcessBackend()
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.connections = BroadcastHub(max_queue)
+        self.user_rooms = {}                   # 本分片连接的用户 -> 所在房间
+        self.room_members = {}                 # 房间 -> 本分片中的成员（房间频道的投递对象）
+        # 房间目录：版本号随每个增量事件递增，客户端发现版本不连续时请求完整快照
+        self.directory_subscribers = set()
+        self.room_lock = asyncio.Lock()
+        self.started = False
+    
+    async def start(self):
+        """连接后端，订阅本分片的请求频道和房间目录频道"""
+        if self.started:
+            return
+        self.started = True
+        await self.backend.start()
+        self.backend.subscribe(self.shard_channel(self.shard_id), self.handle_shard_message)
+        self.backend.subscribe(self.DIRECTORY_CHANNEL, self.handle_directory_event)
+    
+    async def close(self):
+        await self.backend.close()
+    
+    @staticmethod
+    def shard_channel(shard_id):
+        return f"shard:{shard_id}"
+    
+    @staticmethod
+    def room_channel(room_id):
+        return f"room:{room_id}"
+    
+    # ---------- 接入：客户端连接所在的分片 ----------
     async def handle_connection(self, websocket):
         """处理客户端连接"""
+        await self.start()
         user_id = None
-        room_id = None
         
         try:
             async for message in websocket:
-                data = json.loads(message)
-                message_type = data.get("type")
-                
-                if message_type == "auth":
-                    user_id = data.get("user_id", str(uuid.uuid4()))
-                    self.connections[user_id] = websocket
-                    await self.send_room_list(user_id)
-                    
-                elif message_type == "create_room":
-                    room_name = data.get("name", "未命名房间")
-                    room_id = str(uuid.uuid4())
-                    self.rooms[room_id] = {
-                        "id": room_id,
-                        "name": room_name,
-                        "owner": user_id,
-                        "users": [user_id]
-                    }
-                    self.user_rooms[user_id] = room_id
-                    await self.broadcast_room_list()
-                    await self.notify_room_update(room_id, "created", user_id)
+                try:
+                    messages = WireProtocol.decode(message)
+                except ValueError as e:
+                    logger.warning(f"客户端 {user_id} 发送了无效的帧，断开连接: {e}")
+                    await websocket.close(code=1007, reason="无效的帧")
+                    break
+                for data in messages:
+                    message_type = data.get("type")
                     
-                elif message_type == "join_room":
-                    room_id = data.get("room_id")
-                    if room_id in self.rooms:
-                        self.rooms[room_id]["users"].append(user_id)
-                        self.user_rooms[user_id] = room_id
-                        await self.broadcast_room_list()
-                        await self.notify_room_update(room_id, "user_joined", user_id)
+                    if message_type == "auth":
+                        new_user_id = data.get("user_id", str(uuid.uuid4()))
+                        if user_id and new_user_id != user_id:
+                            # 同一连接换用户登录：先释放旧身份
+                            await self.release_connection(user_id, websocket)
+                        user_id = new_user_id
+                        self.connections.register(user_id, websocket)
+                        if "encodings" in data:
+                            # 协商编码：hello 仍以 JSON 发出，之后的消息使用选定的编码
+                            encoding = WireProtocol.negotiate(data["encodings"])
+                            self.connections.send(user_id, {"type": "hello", "encoding": encoding})
+                            self.connections.set_encoding(user_id, encoding)
+                        if data.get("subscribe_rooms", True):
+                            await self.send_room_list(user_id)
                         
-                elif message_type == "leave_room":
-                    if user_id in self.user_rooms:
-                        room_id = self.user_rooms[user_id]
-                        if room_id in self.rooms:
-                            if user_id in self.rooms[room_id]["users"]:
-                                self.rooms[room_id]["users"].remove(user_id)
-                            del self.user_rooms[user_id]
-                            
-                            # 如果房间为空，关闭房间
-                            if not self.rooms[room_id]["users"]:
-                                del self.rooms[room_id]
-                                await self.broadcast_room_list()
-                                await self.notify_room_update(room_id, "closed", user_id)
-                            else:
-                                await self.broadcast_room_list()
-                                await self.notify_room_update(room_id, "user_left", user_id)
-                    
-                elif message_type == "chat":
-                    if user_id in self.user_rooms:
-                        room_id = self.user_rooms[user_id]
-                        await self.broadcast_message(room_id, {
-                            "type": "chat",
+                    elif message_type == "create_room":
+                        await self.leave_room(user_id)
+                        room_id = str(uuid.uuid4())
+                        self.track_member(room_id, user_id)
+                        await self.route(room_id, {
+                            "op": "create_room",
                             "user_id": user_id,
-                            "message": data.get("message", ""),
-                            "timestamp": int(time.time())
+                            "name": data.get("name", "未命名房间")
                         })
                         
-                elif message_type == "playback":
-                    if user_id in self.user_rooms:
-                        room_id = self.user_rooms[user_id]
-                        await self.broadcast_message(room_id, {
-                            "type": "playback",
-                            "user_id": user_id,
-                            "command": data.get("command"),
-                            "position": data.get("position"),
-                            "volume": data.get("volume"),
-                            "song_path": data.get("song_path")
-                        }, exclude_user=user_id)
+                    elif message_type == "join_room":
+                        room_id = data.get("room_id")
+                        if room_id and self.user_rooms.get(user_id) != room_id:
+                            await self.leave_room(user_id)
+                            self.track_member(room_id, user_id)
+                            await self.route(room_id, {"op": "join_room", "user_id": user_id})
+                            
+                    elif message_type == "leave_room":
+                        await self.leave_room(user_id)
+                        
+                    elif message_type == "chat":
+                        if user_id in self.user_rooms:
+                            await self.route(self.user_rooms[user_id], {
+                                "op": "chat",
+                                "user_id": user_id,
+                                "message": data.get("message", "")
+                            })
+                            
+                    elif message_type == "time_sync":
+                        # NTP 式时钟同步：回送客户端发送时间 t0 和服务器收到/发出的时间 t1、t2
+                        received = self.now_ms()
+                        self.connections.send(user_id, {
+                            "type": "time_sync",
+                            "t0": data.get("t0"),
+                            "t1": received,
+                            "t2": self.now_ms()
+                        })
+                        
+                    elif message_type == "playback":
+                        if user_id in self.user_rooms:
+                            await self.route(self.user_rooms[user_id], {
+                                "op": "playback",
+                                "user_id": user_id,
+                                "data": data
+                            })
+                            
+                    elif message_type in ("request_room_list", "subscribe_rooms"):
+                        # 订阅房间目录，并以完整快照作为起点（也用于客户端重新同步）
+                        await self.send_room_list(user_id)
+                        
+                    elif message_type == "unsubscribe_rooms":
+                        self.directory_subscribers.discard(user_id)
                         
-                elif message_type == "request_room_list":
-                    await self.send_room_list(user_id)
-                    
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
-            # 清理连接
-            if user_id and user_id in self.connections:
-                del self.connections[user_id]
-                
+            if user_id:
+                await self.release_connection(user_id, websocket)
+    
+    async def release_connection(self, user_id, websocket):
+        """注销连接；同一用户已在新连接上登录时保留目录订阅和所在房间"""
+        self.connections.unregister(user_id, websocket)
+        if user_id not in self.connections:
+            self.directory_subscribers.discard(user_id)
             # 用户离开房间
-            if user_id and user_id in self.user_rooms:
-                room_id = self.user_rooms[user_id]
-                if room_id in self.rooms:
-                    if user_id in self.rooms[room_id]["users"]:
-                        self.rooms[room_id]["users"].remove(user_id)
-                    del self.user_rooms[user_id]
-                    
-                    # 如果房间为空，关闭房间
-                    if not self.rooms[room_id]["users"]:
-                        del self.rooms[room_id]
-                        await self.broadcast_room_list()
-                        await self.notify_room_update(room_id, "closed", user_id)
-                    else:
-                        await self.broadcast_room_list()
-                        await self.notify_room_update(room_id, "user_left", user_id)
+            await self.leave_room(user_id)
+    
+    def track_member(self, room_id, user_id):
+        """记录本分片中的房间成员，第一个成员加入时订阅房间频道"""
+        members = self.room_members.get(room_id)
+        if members is None:
+            members = self.room_members[room_id] = set()
+            self.backend.subscribe(self.room_channel(room_id), self.handle_room_event)
+        members.add(user_id)
+        self.user_rooms[user_id] = room_id
+    
+    def untrack_member(self, user_id):
+        room_id = self.user_rooms.pop(user_id, None)
+        members = self.room_members.get(room_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.room_members[room_id]
+                self.backend.unsubscribe(self.room_channel(room_id), self.handle_room_event)
+        return room_id
+    
+    async def leave_room(self, user_id):
+        """用户离开所在房间（由归属分片更新房间状态）"""
+        room_id = self.untrack_member(user_id)
+        if room_id:
+            await self.route(room_id, {"op": "leave_room", "user_id": user_id})
+    
+    async def route(self, room_id, request):
+        """把房间请求交给房间的归属分片处理"""
+        request["room_id"] = room_id
+        request["origin"] = self.shard_id
+        owner = shard_for(room_id, self.shard_count)
+        if owner == self.shard_id:
+            await self.handle_room_request(request)
+        else:
+            await self.backend.publish(self.shard_channel(owner), request)
+    
+    async def handle_shard_message(self, message):
+        if message.get("op") == "deliver":
+            self.deliver(message)
+        else:
+            await self.handle_room_request(message)
+    
+    def deliver(self, message):
+        """把归属分片发来的消息投递给本分片中的指定用户"""
+        drop_room = message.get("drop_room")
+        for user_id in message.get("user_ids", []):
+            self.connections.send(user_id, message["message"])
+            if drop_room and self.user_rooms.get(user_id) == drop_room:
+                self.untrack_member(user_id)
+    
+    async def handle_room_event(self, event):
+        """房间频道的事件：投递给本分片中的房间成员"""
+        members = self.room_members.get(event.get("room_id"))
+        if members:
+            self.connections.broadcast(event["message"], members, exclude_user=event.get("exclude"))
+    
+    async def handle_directory_event(self, message):
+        self.connections.broadcast(message, self.directory_subscribers)
     
     async def send_room_list(self, user_id):
-        """发送房间列表给指定用户"""
-        if user_id in self.connections:
-            room_list = list(self.rooms.values())
-            await self.connections[user_id].send(json.dumps({
-                "type": "room_list",
-                "rooms": room_list
-            }))
-    
-    async def broadcast_room_list(self):
-        """广播房间列表给所有用户"""
-        room_list = list(self.rooms.values())
-        message = json.dumps({
+        """发送房间目录快照给指定用户，并订阅之后的增量事件"""
+        self.directory_subscribers.add(user_id)
+        # 先读版本再读房间：快照只可能比版本号新，客户端重复应用增量事件是无害的
+        version = await self.backend.get_directory_version()
+        rooms = await self.backend.list_rooms()
+        self.connections.send(user_id, {
             "type": "room_list",
-            "rooms": room_list
+            "version": version,
+            "rooms": [self.room_summary(room) for room in rooms]
         })
+    
+    # ---------- 归属分片：房间状态的唯一修改者 ----------
+    async def handle_room_request(self, request):
+        async with self.room_lock:
+            op = request.get("op")
+            room_id = request["room_id"]
+            user_id = request.get("user_id")
+            room = await self.backend.get_room(room_id)
+            
+            if op == "create_room":
+                room = {
+                    "id": room_id,
+                    "name": request.get("name", "未命名房间"),
+                    "owner": user_id,
+                    "users": [user_id]
+                }
+                await self.backend.save_room(room)
+                await self.publish_directory("room_added", room=self.room_summary(room))
+                await self.notify_room_update(room, "created", user_id)
+                
+            elif room is None:
+                if op == "join_room":
+                    await self.send_to(request["origin"], [user_id], {
+                        "type": "error",
+                        "message": "房间不存在"
+                    }, drop_room=room_id)
+                
+            elif op == "join_room":
+                if user_id not in room["users"]:
+                    room["users"].append(user_id)
+                await self.backend.save_room(room)
+                await self.publish_member_count(room)
+                await self.notify_room_update(room, "user_joined", user_id)
+                if room.get("playback"):
+                    await self.send_to(request["origin"], [user_id], self.playback_state_message(room))
+                
+            elif op == "leave_room":
+                if user_id in room["users"]:
+                    room["users"].remove(user_id)
+                # 如果房间为空，关闭房间
+                if not room["users"]:
+                    await self.backend.delete_room(room_id)
+                    await self.publish_directory("room_removed", room_id=room_id)
+                else:
+                    await self.backend.save_room(room)
+                    await self.publish_member_count(room)
+                    await self.notify_room_update(room, "user_left", user_id)
+                
+            elif op == "chat":
+                await self.broadcast_message(room_id, {
+                    "type": "chat",
+                    "user_id": user_id,
+                    "message": request.get("message", ""),
+                    "timestamp": int(time.time())
+                })
+                
+            elif op == "playback":
+                data = request.get("data", {})
+                if data.get("command") in self.STATE_COMMANDS:
+                    self.update_playback_state(room, data)
+                    await self.backend.save_room(room)
+                    message = self.playback_state_message(room)
+                    message["user_id"] = user_id
+                    await self.broadcast_message(room_id, message)
+                else:
+                    await self.broadcast_message(room_id, {
+                        "type": "playback",
+                        "room_id": room_id,
+                        "user_id": user_id,
+                        "command": data.get("command"),
+                        "position": data.get("position"),
+                        "volume": data.get("volume"),
+                        "song_path": data.get("song_path")
+                    }, exclude_user=user_id)
+    
+    async def send_to(self, shard_id, user_ids, message, drop_room=None):
+        """发送给连接在指定分片上的用户"""
+        delivery = {"op": "deliver", "user_ids": user_ids, "message": message, "drop_room": drop_room}
+        if shard_id == self.shard_id:
+            self.deliver(delivery)
+        else:
+            await self.backend.publish(self.shard_channel(shard_id), delivery)
+    
+    @staticmethod
+    def now_ms():
+        """服务器时钟（毫秒），所有播放状态都以它为基准。
         
-        for user_id, ws in self.connections.items():
-            try:
-                await ws.send(message)
-            except:
-                pass
+        多个进程/节点共同服务时用系统时间作为共同基准（各节点应开启 NTP 校时）。
+        """
+        return time.time() * 1000
     
-    async def notify_room_update(self, room_id, action, user_id):
+    def update_playback_state(self, room, data):
+        """根据播放命令更新房间的权威播放状态：歌曲 T 在服务器时间 S 处于位置 P，以速率 R 播放"""
+        now = self.now_ms()
+        state = room.get("playback") or {
+            "song_path": None, "state": "stopped", "position": 0, "server_time": now, "rate": 1.0, "version": 0
+        }
+        command = data.get("command")
+        # 客户端给出采样位置时对应的服务器时间，偏差过大（时钟未同步）时改用收到的时间
+        at = data.get("at")
+        anchor = at if isinstance(at, (int, float)) and abs(at - now) < 10000 else now
+        position = data.get("position") or 0
+        rate = data.get("rate") or state["rate"]
+        song_path = state["song_path"]
+        
+        if command == "load_song":
+            song_path = data.get("song_path")
+            playback = "playing"
+            position = 0
+        elif command == "play":
+            playback = "playing"
+        elif command == "pause":
+            playback = "paused"
+        elif command == "stop":
+            playback = "stopped"
+            position = 0
+        else:  # seek：保持原来的播放/暂停状态
+            playback = state["state"]
+        
+        room["playback"] = {
+            "song_path": song_path,
+            "state": playback,
+            "position": position,
+            "server_time": anchor,
+            "rate": rate,
+            "version": state["version"] + 1
+        }
+    
+    @staticmethod
+    def playback_state_message(room):
+        message = {"type": "playback_state", "room_id": room["id"]}
+        message.update(room["playback"])
+        return message
+    
+    @staticmethod
+    def room_summary(room):
+        """房间目录中的条目：不含成员列表，只有人数"""
+        return {
+            "id": room["id"],
+            "name": room["name"],
+            "owner": room["owner"],
+            "member_count": len(room["users"])
+        }
+    
+    async def publish_directory(self, event, **fields):
+        """向所有分片上订阅房间目录的客户端发送一条带版本号的增量事件"""
+        message = {"type": event, "version": None}
+        message.update(fields)
+        await self.backend.publish_versioned(self.DIRECTORY_CHANNEL, message)
+    
+    async def publish_member_count(self, room):
+        await self.publish_directory("member_count_changed", room_id=room["id"], member_count=len(room["users"]))
+    
+    async def notify_room_update(self, room, action, user_id):
         """通知房间更新"""
-        if room_id not in self.rooms:
-            return
-            
-        message = json.dumps({
+        await self.broadcast_message(room["id"], {
             "type": "room_update",
-            "room_id": room_id,
+            "room_id": room["id"],
             "action": action,
             "user_id": user_id,
-            "users": self.rooms[room_id]["users"]
+            "users": room["users"]
         })
-        
-        for room_user_id in self.rooms[room_id]["users"]:
-            if room_user_id in self.connections:
-                try:
-                    await self.connections[room_user_id].send(message)
-                except:
-                    pass
     
     async def broadcast_message(self, room_id, message, exclude_user=None):
-        """广播消息给房间内所有用户"""
-        if room_id not in self.rooms:
-            return
-            
-        message_json = json.dumps(message)
-        
-        for user_id in self.rooms[room_id]["users"]:
-            if user_id == exclude_user:
-                continue
-                
-            if user_id in self.connections:
-                try:
-                    await self.connections[user_id].send(message_json)
-                except:
-                    pass
+        """广播消息给房间内所有用户（经房间频道发给成员所在的各个分片）"""
+        await self.backend.publish(self.room_channel(room_id), {
+            "room_id": room_id,
+            "message": message,
+            "exclude": exclude_user
+        })
+
+
+# =============== 启动 ===============
+def make_backend(args):
+    if args.backend == "sqlite":
+        return SQLiteBackend(args.db)
+    return InProcessBackend()
 
-async def main():
-    server = MusicRoomServer()
-    async with websockets.serve(server.handle_connection, "127.0.0.1", 5001):
-        print("音乐室服务器已启动，监听 ws://127.0.0.1:5001")
-        await asyncio.Future()  # 永久运行
+async def serve(args, shard_id):
+    server = MusicRoomServer(backend=make_backend(args), shard_id=shard_id, shard_count=args.workers)
+    await server.start()
+    # 多个工作进程通过 SO_REUSEPORT 共享同一端口，由内核分配连接
+    async with websockets.serve(server.handle_connection, args.host, args.port, reuse_port=args.workers > 1):
+        print(f"音乐室服务器已启动，监听 ws://{args.host}:{args.port}（分片 {shard_id + 1}/{args.workers}）")
+        try:
+            await asyncio.Future()  # 永久运行
+        finally:
+            await server.close()
+
+def run_worker(args, shard_id):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(args, shard_id))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="音乐室服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=1, help="工作进程（分片）数量")
+    parser.add_argument("--backend", choices=("memory", "sqlite"), help="状态后端，多进程时默认 sqlite")
+    parser.add_argument("--db", default="music_rooms.db", help="sqlite 后端的数据库文件")
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+    if args.backend is None:
+        args.backend = "sqlite" if args.workers > 1 else "memory"
+    
+    if args.workers == 1:
+        if args.backend == "sqlite":
+            SQLiteBackend.reset(args.db)
+        run_worker(args, 0)
+        return
+    
+    if args.backend == "memory":
+        parser.error("进程内后端无法在多个进程间共享，请使用 --backend sqlite")
+    if not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("当前平台不支持 SO_REUSEPORT，无法让多个进程监听同一端口")
+    SQLiteBackend.reset(args.db)
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(args, shard_id), name=f"room-shard-{shard_id}")
+        for shard_id in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
\ No newline at end of file
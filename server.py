@@ -8,11 +8,13 @@ from flask import Flask, request, jsonify, g, make_response
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+from smart_rules import compile_smart_rules, default_library_path
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # 允许所有域跨域访问
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key_here')
 app.config['DATABASE'] = 'user_data.db'
+app.config['LIBRARY_DATABASE'] = os.environ.get('LIBRARY_DATABASE', default_library_path())  # 客户端音乐库目录
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制上传文件大小 16MB
 
 # =============== 数据库辅助函数 ===============
@@ -184,6 +186,30 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
+# =============== 智能播放列表 ===============
+def evaluate_smart_rules(smart_rules):
+    """在客户端音乐库目录上执行智能规则（与客户端共用同一个规则编译器），返回 [(路径, 标题)]。
+
+    规则无效时抛出 ValueError；目录不存在或结构不完整时抛出 sqlite3.Error。
+    """
+    sql, params, _ = compile_smart_rules(smart_rules, columns='tracks.path, tracks.title')
+    library_path = app.config['LIBRARY_DATABASE']
+    library = sqlite3.connect(f'file:{library_path}?mode=ro', uri=True)
+    try:
+        return library.execute(sql, params).fetchall()
+    finally:
+        library.close()
+
+def refresh_smart_playlist(cursor, playlist_id, smart_rules):
+    """按规则重新填充智能播放列表的歌曲"""
+    songs = evaluate_smart_rules(smart_rules)
+    cursor.execute('DELETE FROM playlist_songs WHERE playlist_id = ?', (playlist_id,))
+    cursor.executemany(
+        'INSERT INTO playlist_songs (playlist_id, song_path, song_name, position) VALUES (?, ?, ?, ?)',
+        [(playlist_id, path, title, position) for position, (path, title) in enumerate(songs)]
+    )
+    return len(songs)
+
 # =============== 用户认证API ===============
 @app.route('/api/register', methods=['POST'])
 def register_user():
@@ -394,9 +420,14 @@ def create_playlist():
     
     # 如果是智能播放列表，应用规则添加歌曲
     if is_smart and smart_rules:
-        # 这里需要实现根据规则获取歌曲的逻辑
-        # 简化处理：返回空播放列表
-        pass
+        try:
+            refresh_smart_playlist(cursor, playlist_id, smart_rules)
+        except ValueError as e:
+            db.rollback()
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.Error as e:
+            db.rollback()
+            return jsonify({'error': f'Music library unavailable: {e}'}), 503
     
     db.commit()
     
@@ -441,6 +472,17 @@ def update_playlist(playlist_id):
         values
     )
     
+    # 规则变化时重新计算智能播放列表
+    if 'smart_rules' in data and data.get('is_smart', True) and data['smart_rules']:
+        try:
+            refresh_smart_playlist(cursor, playlist_id, data['smart_rules'])
+        except ValueError as e:
+            db.rollback()
+            return jsonify({'error': str(e)}), 400
+        except sqlite3.Error as e:
+            db.rollback()
+            return jsonify({'error': f'Music library unavailable: {e}'}), 503
+    
     db.commit()
     
     return jsonify({'message': 'Playlist updated successfully'})
@@ -0,0 +1,100 @@
+"""智能播放列表规则：字段白名单和参数化SQL编译，客户端（main.py）与同步服务器（server.py）共用"""
+import os
+import sys
+
+# 规则字段 -> (SQL表达式, 类型, 数值换算系数)，对应客户端音乐库目录（library.db）的表结构
+SMART_RULE_FIELDS = {
+    "title": ("tracks.title", "text", 1),
+    "artist": ("tracks.artist", "text", 1),
+    "album": ("tracks.album", "text", 1),
+    "genre": ("tracks.genre", "text", 1),
+    "year": ("tracks.year", "number", 1),
+    "duration": ("tracks.duration", "number", 1000),  # 规则值以秒为单位
+    "play_count": ("(SELECT COUNT(*) FROM play_history h WHERE h.path = tracks.path)", "number", 1),
+    "last_played": ("(SELECT MAX(played_at) FROM play_history h WHERE h.path = tracks.path)", "number", 1),
+    "dir": ("tracks.dir", "text", 1),
+}
+SMART_FIELD_ALIASES = {
+    "标题": "title", "艺术家": "artist", "专辑": "album", "风格": "genre",
+    "年份": "year", "时长(秒)": "duration", "播放次数": "play_count", "目录": "dir",
+}
+SMART_OPERATORS = {
+    "==": "=", "!=": "!=", ">": ">", "<": "<", ">=": ">=", "<=": "<=",
+    "contains": "LIKE", "包含": "LIKE", "not contains": "NOT LIKE", "不包含": "NOT LIKE",
+}
+SMART_SORT_KEYS = {
+    "title": "tracks.title", "artist": "tracks.artist", "album": "tracks.album",
+    "year": "tracks.year", "duration": "tracks.duration", "added": "tracks.mtime",
+    "play_count": SMART_RULE_FIELDS["play_count"][0], "random": "RANDOM()",
+}
+HISTORY_FIELDS = {"play_count", "last_played"}
+
+
+def normalize_smart_rules(rules):
+    """统一规则集格式：兼容 [(字段, 运算符, 值)] 旧格式"""
+    if isinstance(rules, dict):
+        rule_set = dict(rules)
+    else:
+        rule_set = {"rules": list(rules or [])}
+    rule_set.setdefault("match", "all")
+    rule_set.setdefault("rules", [])
+    rule_set.setdefault("sort", None)
+    rule_set.setdefault("descending", False)
+    rule_set.setdefault("limit", 0)
+    return rule_set
+
+
+def compile_smart_conditions(rule_set):
+    """把规则编译为参数化的 WHERE 子句，返回 (条件SQL, 参数, 用到的字段)"""
+    conditions = []
+    params = []
+    fields = set()
+    for field, operator, value in rule_set["rules"]:
+        field = SMART_FIELD_ALIASES.get(field, field)
+        if field not in SMART_RULE_FIELDS or operator not in SMART_OPERATORS:
+            raise ValueError(f"不支持的规则: {field} {operator}")
+        expression, kind, scale = SMART_RULE_FIELDS[field]
+        sql_operator = SMART_OPERATORS[operator]
+        fields.add(field)
+        if sql_operator.endswith("LIKE"):
+            escaped = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append(f"{expression} {sql_operator} ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        elif kind == "number":
+            conditions.append(f"{expression} {sql_operator} ?")
+            params.append(float(value) * scale)
+        else:
+            conditions.append(f"{expression} {sql_operator} ?")
+            params.append(str(value))
+    joiner = " OR " if rule_set["match"] == "any" else " AND "
+    return (joiner.join(conditions) if conditions else "1"), params, fields
+
+
+def compile_smart_rules(rules, columns="tracks.path"):
+    """把规则集编译为使用索引的参数化SQL，返回 (sql, params, 用到的字段)"""
+    rule_set = normalize_smart_rules(rules)
+    where, params, fields = compile_smart_conditions(rule_set)
+    sql = f"SELECT {columns} FROM tracks WHERE {where}"
+    sort = rule_set["sort"]
+    if sort:
+        if sort not in SMART_SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        if sort == "play_count":
+            fields.add(sort)
+        direction = " DESC" if rule_set["descending"] and sort != "random" else ""
+        sql += f" ORDER BY {SMART_SORT_KEYS[sort]}{direction}, tracks.path"
+    else:
+        sql += " ORDER BY tracks.path"
+    if rule_set["limit"]:
+        sql += " LIMIT ?"
+        params.append(int(rule_set["limit"]))
+    return sql, params, fields
+
+
+def default_library_path():
+    """客户端音乐库目录的默认位置：与设置文件同目录（与 main.py 的 get_settings_path 保持一致）"""
+    if sys.platform.startswith("linux"):
+        return os.path.join(os.path.expanduser("~"), ".config", "music-player", "library.db")
+    if getattr(sys, "frozen", False):
+        return os.path.join(os.path.dirname(sys.executable), "library.db")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "library.db")